@@ -2,14 +2,23 @@
 Script for baseline optimization
 """
 import os
+from concurrent.futures import ThreadPoolExecutor
 # import tarfile
 # import shutil
 from datetime import datetime
 
-from ema_workbench import ema_logging, Model, RealParameter, ScalarOutcome, MultiprocessingEvaluator
+import pandas as pd
+
+from ema_workbench import ema_logging, Model, RealParameter, ScalarOutcome
 from ema_workbench.em_framework.optimization import EpsilonProgress, ArchiveLogger, epsilon_nondominated, to_problem
+from experimentation.checkpointing import optimize_with_checkpoints
+from experimentation.chunked_evaluator import ChunkedEvaluator
 from experimentation.data_generation import generate_input_data
+from experimentation.steady_state import optimize_steady_state
+from experimentation.warm_start import WarmStart, warm_start_population
+from model.evaluation_cache import describe_statistics
 from model.model_nile import ModelNile
+from model.shared_inputs import share_input_data
 
 
 
@@ -36,7 +45,14 @@ from model.model_nile import ModelNile
 #         else:
 #             print(f"CSV files saved: {len(csv_files)}")
 
-def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, principle:str):
+def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, principle:str,
+        seeds=range(5), concurrent_seeds:bool=True, merge:bool=True, checkpoint_freq:int=None,
+        steady_state:bool=False, migration_freq:int=None, warm_start:list=None,
+        warm_start_size:int=50, warm_start_perturbation:float=0.0,
+        screening_fidelity:tuple=None, screening_margin:float=1.0,
+        screening_cost:float=1.0, integration_tolerance:float=None,
+        analytic_integration:bool=False, early_termination:bool=False,
+        surrogate:bool=False, surrogate_kappa:float=1.0, evaluation_cache:str=None):
     """
     Perform baseline optimization using the EMA Workbench.
 
@@ -45,6 +61,57 @@ def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, princ
     epsilon_list (list): List of epsilon values for the optimization.
     convergence_freq (int): Frequency of convergence logging during optimization.
     description (str): A string identifier for the experiment, used to label the output files.
+    seeds (iterable): Seeds to optimize, each writing its own "_s{seed}" result files.
+    concurrent_seeds (bool): Whether the seeds run at the same time on the shared worker pool.
+        Seeds with checkpoints always run one after another, as concurrent seeds share the
+        global random state a checkpoint saves and restores.
+    merge (bool): Whether the results of the seeds are merged at the end (see merge_seeds).
+    checkpoint_freq (int, optional): NFE between checkpoints of every seed. A run restarted
+        with the same settings skips finished seeds and resumes the others from their
+        checkpoints.
+    steady_state (bool): Whether the seeds run as islands of the asynchronous steady-state
+        optimizer (see steady_state.optimize_steady_state) instead of generation by
+        generation with EpsNSGAII. Evaluations then never wait for the rest of a generation.
+    migration_freq (int, optional): NFE between migrations of archive members from every
+        island to the next one in steady state mode. Islands are independent if None.
+    warm_start (list, optional): Results files of earlier experiments whose levers seed the
+        initial population of every seed instead of random policies (see
+        warm_start.warm_start_population). The convergence files get a "warm_start"
+        column with the number of seeded solutions.
+    warm_start_size (int): Maximum number of seeded solutions per seed, subsampled for
+        diversity from the prior solutions. The rest of the population of 100 is random, so
+        the default of half the population keeps the seeds different even when they are
+        seeded with the same prior solutions, unperturbed.
+    warm_start_perturbation (float): Standard deviation of the perturbation of the seeded
+        levers, relative to their range.
+    screening_fidelity (tuple, optional): Integration interval and simulation horizon (e.g.
+        ("once-a-month", 60)) at which offspring are screened in steady state mode. Only
+        offspring that would enter the epsilon archive, give or take screening_margin
+        epsilons, are evaluated again at the fidelity of the settings file.
+    screening_margin (float): Epsilons by which a screened offspring may miss the archive.
+    screening_cost (float): Cost of a screening evaluation relative to a full one, counted
+        against the NFE of every seed (see experimentation/fidelity.py to measure it).
+    integration_tolerance (float, optional): Storage error per month allowed to the adaptive
+        reservoir integration, relative to the storage range of each reservoir. Fixed
+        sub-steps if None. The objectives then only approximate those of the fixed
+        sub-steps.
+    analytic_integration (bool): Whether months in which no release bound binds are
+        integrated in closed form, giving the objectives of the sub-steps up to rounding
+        but not bit for bit.
+    early_termination (bool): Whether evaluations of offspring in steady state mode stop
+        once their objectives are epsilon dominated by the archive whatever the remaining
+        months (see model/early_termination.py). The convergence files get the number of
+        truncated evaluations and the estimated simulation time they saved.
+    surrogate (bool): Whether offspring in steady state mode are pre-screened by a Gaussian
+        process trained on the evaluations of their seed (see experimentation/surrogate.py),
+        discarding those that would not enter the archive. The convergence files get the
+        number of discarded offspring and the prediction error in epsilons.
+    surrogate_kappa (float): Predicted standard deviations by which the predictions are
+        improved at the pre-screening. A larger kappa evaluates more uncertain offspring.
+    evaluation_cache (str, optional): SQLite file whose stored evaluations are read instead
+        of simulated, and to which new evaluations are added (see model/evaluation_cache.py).
+        Its hits and misses are logged at the end of the run and written to the time counter
+        file. No cache if None.
 
     Returns:
     None
@@ -59,9 +126,14 @@ def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, princ
     to make them easily identifiable and distinguishable for different experiments.
 
     The function sets up the model, levers, outcomes, convergence metrics, and other
-    necessary configurations for the optimization process. It uses the `MultiprocessingEvaluator`
+    necessary configurations for the optimization process. It uses the `ChunkedEvaluator`
     for parallel evaluation and logs the optimization progress.
 
+    The seeds run concurrently by default, so the workers stay busy while one seed
+    waits for the last evaluations of its generation. A SLURM array can instead run
+    every seed as an independent shard (seeds=[i], merge=False) and merge the shards
+    afterwards with merge_seeds.
+
     The results of the optimization are saved in CSV files with filenames that include
     the experiment identifier to distinguish between different experiments. The filenames
     will have the format "baseline_results_description.csv" for the results and
@@ -89,9 +161,231 @@ def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, princ
     os.makedirs(output_directory, exist_ok=True)
     os.makedirs(archive_directory, exist_ok=True)
 
+    em_model = build_em_model(principle, integration_tolerance, analytic_integration,
+                              evaluation_cache)
+    seeds = list(seeds)
+
+    # random.seed(123)
+    before = datetime.now()
+
+    if steady_state and checkpoint_freq is not None:
+        raise ValueError("The steady state optimization does not support checkpoints")
+    if screening_fidelity is not None and not steady_state:
+        raise ValueError("Screening evaluations require the steady state optimization")
+    if early_termination and not steady_state:
+        raise ValueError("Early termination requires the steady state optimization")
+    if surrogate and not steady_state:
+        raise ValueError("Surrogate pre-screening requires the steady state optimization")
+
+    # Initial population of every seed, random unless warm started from prior results
+    if warm_start:
+        problem = to_problem(em_model, searchover="levers")
+        populations = {
+            i: warm_start_population(problem, em_model, warm_start, warm_start_size,
+                                     warm_start_perturbation)
+            for i in seeds
+        }
+    else:
+        populations = {i: (None, None) for i in seeds}
+
+    # Workers keep their model and evaluate the population in chunks
+    with ChunkedEvaluator(em_model) as evaluator:
+        if steady_state:
+            results, convergences = optimize_steady_state(
+                evaluator,
+                em_model,
+                nfe,
+                epsilon_list,
+                [convergence_metrics(em_model, archive_directory, i, populations[i][1])
+                 for i in seeds],
+                convergence_freq=convergence_freq,
+                migration_freq=migration_freq,
+                generators=[populations[i][0] for i in seeds],
+                screening_fidelity=screening_fidelity,
+                screening_margin=screening_margin,
+                screening_cost=screening_cost,
+                early_termination=early_termination,
+                surrogate=surrogate,
+                surrogate_kappa=surrogate_kappa,
+            )
+            for i, result, convergence in zip(seeds, results, convergences):
+                save_seed(result, convergence, nfe, description, output_directory, i)
+        elif concurrent_seeds and len(seeds) > 1 and checkpoint_freq is None:
+            # Every seed gets its own evaluator on the same pool, as the
+            # optimization keeps its callback on the evaluator
+            with ThreadPoolExecutor(max_workers=len(seeds)) as executor:
+                results = list(executor.map(
+                    lambda i: optimize_seed(evaluator.share(), em_model, i, nfe, epsilon_list,
+                                            convergence_freq, description, output_directory,
+                                            checkpoint_freq, *populations[i]),
+                    seeds,
+                ))
+        else:
+            results = [
+                optimize_seed(evaluator, em_model, i, nfe, epsilon_list, convergence_freq,
+                              description, output_directory, checkpoint_freq, *populations[i])
+                for i in seeds
+            ]
+    after = datetime.now()
+    cache_statistics = evaluator.cache_statistics()
+
+    seed_label = f"_s{seeds[0]}" if len(seeds) == 1 else ""
+    with open(f"{output_directory}time_counter_{description}{seed_label}.txt", "w") as f:
+        f.write(
+            f'''experiment {description} took {after-before} time to do {nfe} NFEs with 
+            a convergence frequency of {convergence_freq} and epsilons: {epsilon_list}, for principle {principle} and {len(seeds)} seeds.'''
+            )
+        if warm_start:
+            f.write(f"\nwarm started from {warm_start} with at most {warm_start_size} seeded "
+                    f"solutions per seed and perturbation {warm_start_perturbation}.")
+        if cache_statistics is not None:
+            f.write(f"\n{describe_statistics(evaluation_cache, cache_statistics)}.")
+
+    if merge:
+        merge_seeds(nfe, epsilon_list, description, em_model, seeds, results)
+
+
+def optimize_seed(evaluator, em_model, i:int, nfe:int, epsilon_list:list, convergence_freq:int,
+                  description:str, output_directory:str, checkpoint_freq:int=None,
+                  generator=None, warm_start_count:int=None):
+    """
+    Runs the optimization of seed i and writes its results, convergence and archive logs.
+    With a checkpoint_freq, the state of the optimization is saved to
+    "checkpoint_s{i}.pkl" every checkpoint_freq NFE (see
+    checkpointing.optimize_with_checkpoints) and a seed that already finished is read
+    from its results file instead of being run again. A generator (e.g. of
+    warm_start.warm_start_population) replaces the random initial population, its number of
+    seeded solutions is recorded as warm_start_count in the convergence.
+
+    Returns:
+    result (pd.DataFrame): Epsilon nondominated solutions of the seed.
+    """
+    archive_directory = f"{output_directory}archive_logs"
+    result_filename = f"{output_directory}baseline_results_nfe{nfe}_{description}_s{i}.csv"
+    checkpoint_path = f"{output_directory}checkpoint_s{i}.pkl"
+
+    metrics = convergence_metrics(em_model, archive_directory, i, warm_start_count)
+    kwargs = dict() if generator is None else {"generator": generator}
+
+    if checkpoint_freq is None:
+        result, convergence = evaluator.optimize(
+            nfe=nfe,
+            searchover="levers",
+            epsilons=epsilon_list,
+            convergence_freq=convergence_freq,
+            # real convergence_freq=500,
+            convergence=metrics,
+            **kwargs,
+        )
+    elif os.path.exists(result_filename) and not os.path.exists(checkpoint_path):
+        return pd.read_csv(result_filename, index_col=0)
+    else:
+        result, convergence = optimize_with_checkpoints(
+            evaluator,
+            em_model,
+            nfe,
+            epsilon_list,
+            checkpoint_path,
+            checkpoint_freq,
+            convergence=metrics,
+            convergence_freq=convergence_freq,
+            generator=generator,
+        )
+    save_seed(result, convergence, nfe, description, output_directory, i)
+
+    return result
+
+
+def convergence_metrics(em_model, archive_directory:str, i:int, warm_start_count:int=None):
+    """
+    Epsilon progress and archive logging of seed i, writing the archives to
+    "{archive_directory}/{i}.tar.gz", and the number of seeded solutions of a warm start.
+    """
+    metrics = [
+        EpsilonProgress(),
+        ArchiveLogger(
+            archive_directory,
+            [lever.name for lever in em_model.levers],
+            [outcome.name for outcome in em_model.outcomes],
+            base_filename=f"{i}.tar.gz"
+        ),
+    ]
+    if warm_start_count is not None:
+        metrics.append(WarmStart(warm_start_count))
+
+    return metrics
+
+
+def save_seed(result, convergence, nfe:int, description:str, output_directory:str, i:int):
+    """
+    Writes the results and convergence of seed i to their "_s{i}" CSV files.
+    """
+    result_filename = f"{output_directory}baseline_results_nfe{nfe}_{description}_s{i}.csv"
+    result.to_csv(result_filename)
+    convergence_filename = f"{output_directory}baseline_convergence_nfe{nfe}_{description}_s{i}.csv"
+    convergence.to_csv(convergence_filename)
+
+
+def merge_seeds(nfe:int, epsilon_list:list, description:str, em_model, seeds=range(5), results=None):
+    """
+    Merges the results of the seeds of an experiment into one epsilon nondominated set,
+    saved as "baseline_results_nfe{nfe}_{description}.csv".
+
+    Parameters:
+    em_model (Model or str): EMA Workbench model of the experiment, or its principle. Only the
+        levers and outcomes are needed, so a principle gives a model without input data.
+    seeds (iterable): Seeds to merge.
+    results (list, optional): Results of the seeds. If None, the "_s{seed}" result files
+        written by the seeds (e.g. by separate SLURM array shards) are read.
+    """
+    output_directory = f"outputs/nfe{nfe}_{description}/"
+    if isinstance(em_model, str):
+        em_model = wrap_em_model(ModelNile(principle=em_model), em_model)
+
+    if results is None:
+        results = [
+            pd.read_csv(f"{output_directory}baseline_results_nfe{nfe}_{description}_s{i}.csv", index_col=0)
+            for i in seeds
+        ]
+
+    problem = to_problem(em_model, searchover="levers")
+    epsilons = epsilon_list
+
+    merged_results = epsilon_nondominated(results, epsilons, problem)
+    # Use description in the filename for the CSV files
+    results_filename = f"{output_directory}baseline_results_nfe{nfe}_{description}.csv"
+    merged_results.to_csv(results_filename)
+
+
+def build_em_model(principle:str, integration_tolerance:float=None,
+                   analytic_integration:bool=False, evaluation_cache:str=None):
+    """
+    Creates the Nile model with its baseline input data and wraps it in an EMA
+    Workbench model with the policy parameters as levers and the objectives as
+    outcomes. An integration_tolerance switches the reservoirs to the adaptive
+    integration, analytic_integration to the closed-form integration, and an
+    evaluation_cache file makes the evaluations go through the cache.
+    """
     nile_model = ModelNile(principle=principle)
+    if integration_tolerance is not None:
+        nile_model.set_integration_tolerance(integration_tolerance)
+    if analytic_integration:
+        nile_model.set_analytic_integration()
+    nile_model.set_evaluation_cache(evaluation_cache)
     nile_model = generate_input_data(nile_model, sim_horizon=20)
+    # Only the objectives are needed during optimization
+    nile_model.set_recording_mode("objectives")
+    # Workers attach to the input arrays instead of holding their own copies
+    share_input_data(nile_model)
+
+    return wrap_em_model(nile_model, principle)
+
 
+def wrap_em_model(nile_model, principle:str):
+    """
+    Wraps the Nile model in an EMA Workbench model with the policy parameters as levers and
+    the objectives as outcomes.
+    """
     em_model = Model("NileProblem", function=nile_model)
 
     parameter_count = nile_model.overarching_policy.get_total_parameter_count()
@@ -128,46 +422,4 @@ def run(nfe:int, epsilon_list:list, convergence_freq:int, description:str, princ
         ScalarOutcome("principle_result", ScalarOutcome.MAXIMIZE)
         )
 
-    # random.seed(123)
-    results = []
-    before = datetime.now()
-
-    with MultiprocessingEvaluator(em_model) as evaluator:
-        for i in range(5):
-            result, convergence = evaluator.optimize(
-                nfe=nfe,
-                searchover="levers",
-                epsilons=epsilon_list,
-                convergence_freq=convergence_freq,
-                # real convergence_freq=500,
-                convergence=[
-                    EpsilonProgress(),
-                    ArchiveLogger(
-                        archive_directory,
-                        [lever.name for lever in em_model.levers],
-                        [outcome.name for outcome in em_model.outcomes],
-                        base_filename=f"{i}.tar.gz"
-        ),
-    ],
-            )
-            result_filename = f"{output_directory}baseline_results_nfe{nfe}_{description}_s{i}.csv"
-            result.to_csv(result_filename)
-            results.append(result)
-            convergence_filename = f"{output_directory}baseline_convergence_nfe{nfe}_{description}_s{i}.csv"
-            convergence.to_csv(convergence_filename)
-    after = datetime.now()
-
-
-    with open(f"{output_directory}time_counter_{description}.txt", "w") as f:
-        f.write(
-            f'''experiment {description} took {after-before} time to do {nfe} NFEs with 
-            a convergence frequency of {convergence_freq} and epsilons: {epsilon_list}, for principle {principle} and 5 seeds.'''
-            )
-    
-    problem = to_problem(em_model, searchover="levers")
-    epsilons = epsilon_list
-
-    merged_results = epsilon_nondominated(results, epsilons, problem)
-    # Use description in the filename for the CSV files
-    results_filename = f"{output_directory}baseline_results_nfe{nfe}_{description}.csv"
-    merged_results.to_csv(results_filename)
\ No newline at end of file
+    return em_model
@@ -0,0 +1,178 @@
+"""
+Optimization with the EMA Workbench that periodically saves the state of
+the algorithm to a checkpoint file, so that an interrupted run continues
+from its last checkpoint instead of starting over.
+"""
+
+# Importing libraries for functionality
+import functools
+import os
+import pickle
+import random
+
+import numpy as np
+
+from ema_workbench.em_framework.optimization import (
+    CombinedMutator,
+    CombinedVariator,
+    Convergence,
+    EpsNSGAII,
+    to_dataframe,
+    to_problem,
+)
+from ema_workbench.util import get_module_logger
+
+_logger = get_module_logger(__name__)
+
+
+def save_checkpoint(checkpoint_path, optimizer, convergence):
+    """Writes the algorithm (population, epsilon archive, NFE count and
+    operator states), the convergence history and the random states to
+    the checkpoint file. The file is replaced in one step, so a run
+    interrupted while saving keeps its previous checkpoint.
+    """
+
+    # The evaluator holds the worker pool and is attached again on loading.
+    # The function of the problem is set by the evaluator for every job.
+    evaluators = (optimizer.evaluator, optimizer.algorithm.evaluator)
+    function = optimizer.problem.function
+    optimizer.evaluator = optimizer.algorithm.evaluator = None
+    optimizer.problem.function = None
+    try:
+        state = {
+            "optimizer": optimizer,
+            "convergence": convergence,
+            "random_state": random.getstate(),
+            "numpy_random_state": np.random.get_state(),
+        }
+        temporary_path = f"{checkpoint_path}.tmp"
+        with open(temporary_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(temporary_path, checkpoint_path)
+    finally:
+        optimizer.evaluator, optimizer.algorithm.evaluator = evaluators
+        optimizer.problem.function = function
+
+
+def load_checkpoint(checkpoint_path, evaluator):
+    """Reads a checkpoint written by save_checkpoint, restores the random
+    states and attaches the evaluator to the algorithm
+
+    Returns
+    -------
+    optimizer : platypus Algorithm
+    convergence : ema_workbench Convergence
+    """
+
+    with open(checkpoint_path, "rb") as f:
+        state = pickle.load(f)
+
+    optimizer = state["optimizer"]
+    optimizer.evaluator = optimizer.algorithm.evaluator = evaluator
+    random.setstate(state["random_state"])
+    np.random.set_state(state["numpy_random_state"])
+
+    return optimizer, state["convergence"]
+
+
+def optimize_with_checkpoints(
+    evaluator,
+    em_model,
+    nfe,
+    epsilons,
+    checkpoint_path,
+    checkpoint_freq,
+    convergence=None,
+    convergence_freq=1000,
+    logging_freq=5,
+    searchover="levers",
+    generator=None,
+):
+    """Optimizes the model with EpsNSGAII as evaluator.optimize does, saving
+    a checkpoint after the first generation that completes checkpoint_freq
+    NFE after the previous one. If checkpoint_path exists, the run
+    continues from it. Since the random states are part of the
+    checkpoint, a resumed run gives the same results as an uninterrupted
+    one. No other optimization may draw random numbers in the same
+    process meanwhile, so seeds with checkpoints do not run concurrently
+    (see baseline_optimization.run).
+
+    Parameters
+    ----------
+    evaluator : ema_workbench evaluator
+    em_model : ema_workbench Model
+    nfe : int
+        Total number of function evaluations of the run
+    epsilons : list
+        Epsilon values of the outcomes
+    checkpoint_path : str
+        File of the checkpoint. It is removed when the run completes
+    checkpoint_freq : int
+        NFE between checkpoints
+    convergence : list, optional
+        Convergence metrics of the run
+    convergence_freq : int
+        NFE between convergence checks
+    logging_freq : int
+        Generations between progress logs
+    generator : platypus Generator, optional
+        Generator of the initial population of a new run, e.g. seeded with
+        prior solutions (see warm_start.warm_start_population)
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Epsilon nondominated solutions
+    convergence : pd.DataFrame
+        Convergence metrics over the NFE
+    """
+
+    if checkpoint_freq < 1:
+        raise ValueError("checkpoint_freq must be at least 1")
+
+    if os.path.exists(checkpoint_path):
+        optimizer, convergence_tracker = load_checkpoint(checkpoint_path, evaluator)
+        problem = optimizer.problem
+        _logger.info(f"resuming from {checkpoint_path} at {optimizer.nfe} nfe")
+    else:
+        problem = to_problem(em_model, searchover)
+        klass = problem.types[0].__class__
+        if all(isinstance(t, klass) for t in problem.types):
+            variator = None
+        else:
+            variator = CombinedVariator()
+
+        kwargs = dict() if generator is None else {"generator": generator}
+        optimizer = EpsNSGAII(
+            problem,
+            epsilons=epsilons,
+            evaluator=evaluator,
+            variator=variator,
+            log_frequency=500,
+            **kwargs,
+        )
+        optimizer.mutator = CombinedMutator()
+        convergence_tracker = Convergence(
+            convergence,
+            nfe,
+            convergence_freq=convergence_freq,
+            logging_freq=logging_freq,
+        )
+
+    evaluator.callback = functools.partial(convergence_tracker, optimizer)
+
+    last_checkpoint = [optimizer.nfe]
+
+    def checkpoint(algorithm):
+        if algorithm.nfe >= last_checkpoint[0] + checkpoint_freq:
+            save_checkpoint(checkpoint_path, optimizer, convergence_tracker)
+            last_checkpoint[0] = algorithm.nfe
+
+    optimizer.run(lambda algorithm: algorithm.nfe >= nfe, callback=checkpoint)
+
+    results = to_dataframe(optimizer, problem.parameter_names, problem.outcome_names)
+    convergence = convergence_tracker.to_dataframe()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return results, convergence
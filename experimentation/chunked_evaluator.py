@@ -0,0 +1,430 @@
+"""
+Evaluator for the EMA Workbench that keeps one Nile model per worker
+process and dispatches the experiments in chunks. The levers of a chunk
+travel as one contiguous float64 matrix and the outcomes come back as one
+array, which the batched simulation evaluates in a single pass.
+"""
+
+# Importing libraries for functionality
+import copy
+import math
+import multiprocessing
+import threading
+
+import numpy as np
+
+from ema_workbench.em_framework.evaluators import BaseEvaluator
+from ema_workbench.em_framework.parameters import experiment_generator
+from ema_workbench.util import get_module_logger
+from model.evaluation_cache import describe_statistics
+
+_logger = get_module_logger(__name__)
+
+# Model of the worker process, set once by the pool initializer
+worker_model = None
+
+# Integration interval and simulation horizon the worker model was created
+# with, used by chunks that do not request another fidelity
+full_fidelity = None
+
+
+def initialize_worker(nile_model):
+    """Pool initializer keeping the model of the worker process. With the
+    fork start method the model of the parent is inherited as is,
+    otherwise it is unpickled once per worker.
+    """
+    global worker_model, full_fidelity
+    worker_model = nile_model
+    full_fidelity = nile_model.get_fidelity()
+
+
+def evaluate_chunk(
+    parameter_matrix,
+    uncertainty_dicts=None,
+    batched=True,
+    fidelity=None,
+    termination=None,
+):
+    """Evaluates a chunk of experiments on the model of the worker process.
+
+    Parameters
+    ----------
+    parameter_matrix : np.array (N x parameter count)
+        Policy parameters of the experiments, one per row
+    uncertainty_dicts : list, optional
+        Uncertainty parameters of each experiment, for models evaluated
+        under scenarios (ModelNileScenario)
+    batched : bool
+        Whether the chunk is simulated with the batched engine (see
+        ModelNileBase.simulate) or experiment by experiment
+    fidelity : tuple, optional
+        Integration interval and simulation horizon of the simulations
+        (see ModelNile.set_fidelity), those of the model as created if
+        None
+    termination : DominanceTermination or ThresholdTermination, optional
+        Criterion stopping the simulations early (see
+        ModelNile.set_early_termination)
+
+    Returns
+    -------
+    outcomes : np.array (N x outcome count)
+        Outcomes of each experiment in the order returned by evaluate
+    truncation : np.array (N x 2)
+        With a termination criterion only: simulated months and estimated
+        saved seconds of each experiment (see simulate_chunk)
+    """
+
+    fidelity = full_fidelity if fidelity is None else tuple(fidelity)
+    if worker_model.get_fidelity() != fidelity:
+        worker_model.set_fidelity(*fidelity)
+    worker_model.set_early_termination(termination, worker_model.termination_interval)
+
+    cache = worker_model.evaluation_cache
+    if cache is None:
+        outcomes, truncation = simulate_chunk(
+            parameter_matrix, uncertainty_dicts, batched
+        )
+        return outcomes if termination is None else (outcomes, truncation)
+
+    # Only the experiments missing in the evaluation cache are simulated
+    if uncertainty_dicts is None:
+        keys = [worker_model.evaluation_key(row) for row in parameter_matrix]
+    else:
+        keys = [
+            worker_model.evaluation_key(row, uncertainty_dict)
+            for row, uncertainty_dict in zip(parameter_matrix, uncertainty_dicts)
+        ]
+    outcomes = [cache.get(key) for key in keys]
+    truncation = np.zeros((len(keys), 2))
+    truncation[:, 0] = worker_model.simulation_horizon
+    missing = [i for i, row in enumerate(outcomes) if row is None]
+    if missing:
+        simulated, truncation[missing] = simulate_chunk(
+            parameter_matrix[missing],
+            None
+            if uncertainty_dicts is None
+            else [uncertainty_dicts[i] for i in missing],
+            batched,
+        )
+        # Truncated simulations are not stored
+        cache.put_many(
+            [
+                (keys[i], row)
+                for i, row in zip(missing, simulated)
+                if truncation[i, 0] == worker_model.simulation_horizon
+            ]
+        )
+        for i, row in zip(missing, simulated):
+            outcomes[i] = row
+
+    outcomes = np.array(outcomes)
+    return outcomes if termination is None else (outcomes, truncation)
+
+
+def simulate_chunk(parameter_matrix, uncertainty_dicts=None, batched=True):
+    """Simulates a chunk of experiments, see evaluate_chunk
+
+    Returns
+    -------
+    outcomes : np.array (N x outcome count)
+    truncation : np.array (N x 2)
+        Simulated months and estimated saved seconds of each experiment.
+        The lanes of a batch stop together and share its saved seconds
+    """
+
+    truncation = list()
+
+    def record(outcomes):
+        lanes = len(np.atleast_2d(outcomes))
+        truncation.extend(
+            [(worker_model.simulated_months, worker_model.saved_seconds / lanes)]
+            * lanes
+        )
+        return outcomes
+
+    if uncertainty_dicts is None:
+        if batched:
+            outcomes = record(worker_model.evaluate_batch(parameter_matrix))
+        else:
+            outcomes = np.array(
+                [record(worker_model.evaluate(row)) for row in parameter_matrix]
+            )
+    elif not batched:
+        outcomes = np.array(
+            [
+                record(worker_model.evaluate(row, uncertainty_dict))
+                for row, uncertainty_dict in zip(parameter_matrix, uncertainty_dicts)
+            ]
+        )
+    else:
+        # Consecutive experiments of the same policy are simulated together
+        # under their scenarios
+        outcomes = list()
+        start = 0
+        for end in range(1, len(parameter_matrix) + 1):
+            if end == len(parameter_matrix) or not np.array_equal(
+                parameter_matrix[end], parameter_matrix[start]
+            ):
+                outcomes.append(
+                    record(
+                        worker_model.evaluate_batch(
+                            parameter_matrix[start], uncertainty_dicts[start:end]
+                        )
+                    )
+                )
+                start = end
+        outcomes = np.vstack(outcomes)
+
+    return outcomes, np.array(truncation, dtype=float).reshape(-1, 2)
+
+
+def _evaluate_chunk_star(arguments):
+    """evaluate_chunk followed by the evaluation cache hits and misses of the
+    chunk, as the counts of a worker's cache are not seen by the parent
+    """
+    cache = worker_model.evaluation_cache
+    if cache is None:
+        return evaluate_chunk(*arguments), 0, 0
+
+    hits, misses = cache.hits, cache.misses
+    result = evaluate_chunk(*arguments)
+    return result, cache.hits - hits, cache.misses - misses
+
+
+class ChunkedEvaluator(BaseEvaluator):
+    """
+    Evaluator running the experiments of a ModelNile or ModelNileScenario
+    (wrapped in an EMA Workbench Model) on a pool of persistent workers.
+
+    Parameters
+    ----------
+    msis : ema_workbench Model
+        Model whose function is the Nile model object
+    n_processes : int, optional
+        Number of worker processes, all cores if None
+    chunk_size : int, optional
+        Number of experiments sent to a worker at once. If None, a
+        heuristic spreads the experiments of every call over
+        chunks_per_process chunks per worker, with at most max_chunk_size
+        experiments each. It is not tuned on measured chunk times
+    chunks_per_process : int
+        Chunks per worker of the heuristic chunk size. More chunks
+        balance the load better at the cost of more messages
+    max_chunk_size : int
+        Upper limit of the heuristic chunk size. The batched simulation
+        does not get cheaper per experiment beyond a few hundred lanes
+    batched : bool
+        Whether chunks are simulated with the batched engine
+    early_termination : DominanceTermination or ThresholdTermination, optional
+        Opt-in criterion stopping the simulations of perform_experiments
+        once their outcomes are decided, e.g. the class of every outcome
+        with respect to its thresholds (see model.early_termination).
+        Truncated experiments get NaN outcomes, as only the criterion is
+        known for them, not their values
+
+    Attributes
+    ----------
+    simulated_months : list
+        Simulated months of every experiment of perform_experiments, less
+        than the horizon for truncated simulations
+    saved_seconds : float
+        Estimated simulation time saved by the early termination
+    cache_counts : dict
+        Evaluation cache hits and misses of all chunks run on the pool
+        (see cache_statistics), shared with the evaluators of share
+    """
+
+    def __init__(
+        self,
+        msis,
+        n_processes=None,
+        chunk_size=None,
+        chunks_per_process=4,
+        max_chunk_size=256,
+        batched=True,
+        early_termination=None,
+    ):
+        super().__init__(msis)
+
+        if len(self._msis) != 1:
+            raise ValueError("ChunkedEvaluator runs a single model")
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        self.em_model = self._msis[0]
+        self.nile_model = self.em_model.function
+        self.n_processes = n_processes
+        self.chunk_size = chunk_size
+        self.chunks_per_process = chunks_per_process
+        self.max_chunk_size = max_chunk_size
+        self.batched = batched
+        self.early_termination = early_termination
+        self.simulated_months = list()
+        self.saved_seconds = 0.0
+        self.cache_counts = {"hits": 0, "misses": 0}
+        self._cache_lock = threading.Lock()
+        self._pool = None
+        self.owns_pool = True
+
+    def initialize(self):
+        self._pool = multiprocessing.Pool(
+            self.n_processes, initialize_worker, (self.nile_model,)
+        )
+        self.n_processes = self._pool._processes
+        _logger.info("pool started")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Pending chunks are aborted without waiting
+            self._pool.terminate()
+            return False
+
+        super().__exit__(exc_type, exc_value, traceback)
+
+    def finalize(self):
+        if self.owns_pool:
+            self._pool.close()
+            self._pool.join()
+            statistics = self.cache_statistics()
+            if statistics is not None:
+                _logger.info(
+                    describe_statistics(self.nile_model.evaluation_cache.path, statistics)
+                )
+
+    def share(self):
+        """Evaluator on the same worker pool, e.g. for optimizations running
+        concurrently in threads, which each keep their own callback on the
+        evaluator. The pool stays owned by this evaluator.
+        """
+        shared = copy.copy(self)
+        shared.owns_pool = False
+        return shared
+
+    def submit(
+        self,
+        parameter_matrix,
+        callback,
+        error_callback=None,
+        fidelity=None,
+        termination=None,
+    ):
+        """Evaluates a chunk of policies (one per row of parameter_matrix)
+        asynchronously on the pool, calling callback with the outcomes of
+        the chunk when they are available, and their truncation with a
+        termination criterion (see evaluate_chunk)
+        """
+        return self._pool.apply_async(
+            _evaluate_chunk_star,
+            (
+                (
+                    np.ascontiguousarray(parameter_matrix, dtype=np.float64),
+                    None,
+                    self.batched,
+                    fidelity,
+                    termination,
+                ),
+            ),
+            callback=lambda result: callback(self.count_cache(result)),
+            error_callback=error_callback,
+        )
+
+    def count_cache(self, result):
+        """Adds the cache hits and misses of a chunk (see
+        _evaluate_chunk_star) to cache_counts and returns its outcomes
+        """
+        result, hits, misses = result
+        with self._cache_lock:
+            self.cache_counts["hits"] += hits
+            self.cache_counts["misses"] += misses
+        return result
+
+    def cache_statistics(self):
+        """Hits, misses and hit rate of the evaluation cache over the chunks
+        of the pool and the evaluations of this process, and the number of
+        evaluations stored in its file. None without a cache
+        """
+        cache = self.nile_model.evaluation_cache
+        if cache is None:
+            return None
+
+        statistics = cache.statistics()
+        with self._cache_lock:
+            statistics["hits"] += self.cache_counts["hits"]
+            statistics["misses"] += self.cache_counts["misses"]
+        requests = statistics["hits"] + statistics["misses"]
+        statistics["hit_rate"] = statistics["hits"] / requests if requests else 0.0
+        return statistics
+
+    def get_chunk_size(self, experiment_count):
+        """Chunk size for a call with experiment_count experiments: the
+        fixed chunk_size, or the heuristic of chunks_per_process chunks per
+        worker capped at max_chunk_size
+        """
+        if self.chunk_size is not None:
+            return self.chunk_size
+
+        chunk_count = self.n_processes * self.chunks_per_process
+        chunk_size = math.ceil(experiment_count / chunk_count)
+        return max(1, min(self.max_chunk_size, chunk_size))
+
+    def evaluate_experiments(self, scenarios, policies, callback):
+        experiments = list(experiment_generator(scenarios, self._msis, policies))
+        if not experiments:
+            return
+
+        policy = self.nile_model.overarching_policy
+        parameter_count = policy.get_total_parameter_count()
+        parameter_matrix = np.array(
+            [
+                [experiment.policy[f"v{i}"] for i in range(parameter_count)]
+                for experiment in experiments
+            ],
+            dtype=np.float64,
+        )
+
+        uncertainty_names = [
+            uncertainty.name for uncertainty in self.em_model.uncertainties
+        ]
+        if uncertainty_names:
+            uncertainty_dicts = [
+                {name: experiment.scenario[name] for name in uncertainty_names}
+                for experiment in experiments
+            ]
+        else:
+            uncertainty_dicts = None
+
+        chunk_size = self.get_chunk_size(len(experiments))
+        chunks = [
+            (
+                parameter_matrix[start : start + chunk_size],
+                None
+                if uncertainty_dicts is None
+                else uncertainty_dicts[start : start + chunk_size],
+                self.batched,
+                None,
+                self.early_termination,
+            )
+            for start in range(0, len(experiments), chunk_size)
+        ]
+        _logger.debug(f"{len(experiments)} experiments in {len(chunks)} chunks")
+
+        outcome_names = self.em_model.output_variables
+        experiment_iterator = iter(experiments)
+        for result in self._pool.imap(_evaluate_chunk_star, chunks):
+            outcomes = self.count_cache(result)
+            if self.early_termination is not None:
+                outcomes, truncation = outcomes
+                self.simulated_months.extend(truncation[:, 0].astype(int))
+                self.saved_seconds += truncation[:, 1].sum()
+                # The best case of the remaining months is no simulated outcome
+                outcomes = np.where(
+                    truncation[:, :1] < self.nile_model.simulation_horizon,
+                    np.nan,
+                    outcomes,
+                )
+            for row in outcomes:
+                callback(
+                    next(experiment_iterator),
+                    {name: row[i] for i, name in enumerate(outcome_names)},
+                )
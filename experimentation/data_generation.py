@@ -1,6 +1,189 @@
+import hashlib
+import inspect
+import os
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 
+# Wheeler (2018) gauges summed into each catchment inflow. The White Nile
+# also gets the stochastic Mogren flow on top of these.
+wheeler_catchment_columns = {
+    "Dinder": ["340.Inflow", "635.Inflow", "1308.Inflow"],
+    "Rahad": ["243.Inflow", "519.Inflow", "524.Inflow"],
+    "GERDToRoseires": ["33.Inflow", "530.Inflow", "1374.Inflow"],
+    "RoseiresToAbuNaama": ["1309.Inflow"],
+    "SukiToSennar": ["470.Inflow"],
+    "WhiteNile": ["1364.Inflow", "1338.Inflow", "1317.Inflow", "31.Inflow"],
+}
+
+# Wheeler stores, distribution parameters and yearly demands read in this
+# process, by path
+wheeler_stores = dict()
+distribution_parameters = dict()
+yearly_demands = dict()
+
+# Standardized random draws of the scenario engine read in this process, by
+# seed and simulation horizon
+base_draws = dict()
+
+
+def convert_wheeler_set(
+    wh_set="Baseline", data_directory="stochastic_data_generation_inputs/"
+):
+    """Converts a Wheeler (2018) ensemble CSV into a binary store of the
+    catchment inflows. Only the gauges used by the model are read and
+    they are summed per catchment beforehand, giving a (rows x catchment)
+    matrix in the order of wheeler_catchment_columns.
+
+    Returns
+    -------
+    store_path : str
+        Path of the .npy file the store is written to
+    """
+
+    columns = [
+        column for columns in wheeler_catchment_columns.values() for column in columns
+    ]
+    wheeler_large = pd.read_csv(
+        f"{data_directory}{wh_set}_wheeler.csv", usecols=columns
+    )
+
+    catchment_inflows = np.empty((len(wheeler_large), len(wheeler_catchment_columns)))
+    for i, columns in enumerate(wheeler_catchment_columns.values()):
+        # Same summation order as the gauge columns were added before
+        inflow = wheeler_large[columns[0]].to_numpy()
+        for column in columns[1:]:
+            inflow = inflow + wheeler_large[column].to_numpy()
+        catchment_inflows[:, i] = inflow
+
+    store_path = f"{data_directory}{wh_set}_wheeler_inflows.npy"
+    np.save(store_path, catchment_inflows)
+
+    return store_path
+
+
+def load_wheeler_store(
+    wh_set="Baseline", data_directory="stochastic_data_generation_inputs/"
+):
+    """Memory-maps the binary store of a Wheeler set, converting the CSV
+    first if the store is missing or older than the CSV. The store is
+    opened once per process and its pages are shared by all processes
+    reading the same file.
+
+    Returns
+    -------
+    store : np.memmap (rows x catchment)
+        Catchment inflows in the order of wheeler_catchment_columns
+    """
+
+    csv_path = f"{data_directory}{wh_set}_wheeler.csv"
+    store_path = f"{data_directory}{wh_set}_wheeler_inflows.npy"
+
+    if store_path not in wheeler_stores:
+        if not os.path.exists(store_path) or (
+            os.path.exists(csv_path)
+            and os.path.getmtime(csv_path) > os.path.getmtime(store_path)
+        ):
+            convert_wheeler_set(wh_set, data_directory)
+        wheeler_stores[store_path] = np.load(store_path, mmap_mode="r")
+
+    return wheeler_stores[store_path]
+
+
+def load_generation_inputs(data_directory="stochastic_data_generation_inputs/"):
+    """Reads the monthly distribution parameters of the stochastic inflows
+    once per process.
+
+    Returns
+    -------
+    generation_inputs : dict
+        Arrays of 12 monthly values: atbara_mean, atbara_std, mogren_min,
+        mogren_max, mogren_mean and bluenile (nominal Blue Nile flow)
+    """
+
+    if data_directory not in distribution_parameters:
+        atbara_dist = pd.read_csv(f"{data_directory}atbara_distribution.csv")
+        mogren_dist = pd.read_csv(f"{data_directory}mogren_distribution.csv")
+        bluenile_dist = pd.read_csv(f"{data_directory}blue_nile_series.csv")
+        distribution_parameters[data_directory] = {
+            "atbara_mean": atbara_dist["mean"].to_numpy()[:12],
+            "atbara_std": atbara_dist["std"].to_numpy()[:12],
+            "mogren_min": mogren_dist["MinQ"].to_numpy()[:12],
+            "mogren_max": mogren_dist["MaxQ"].to_numpy()[:12],
+            "mogren_mean": mogren_dist["MeanQ"].to_numpy()[:12],
+            "bluenile": bluenile_dist["0"].to_numpy()[:12],
+        }
+
+    return distribution_parameters[data_directory]
+
+
+def load_yearly_demand(name, data_directory="stochastic_data_generation_inputs/"):
+    """Reads the 12 monthly irrigation demands of a district once per
+    process
+    """
+
+    path = f"{data_directory}IrrDemand{name}.txt"
+    if path not in yearly_demands:
+        yearly_demands[path] = np.loadtxt(path)
+
+    return yearly_demands[path]
+
+
+def load_base_draws(myseed=123, sim_horizon=20):
+    """Draws the standardized random numbers of a seed once per process.
+    They are the same for every scenario, so the stochastic flows of any
+    combination of uncertainty parameters follow from them with a few
+    array operations (common random numbers across scenarios).
+
+    The draws come from a numpy Generator seeded with myseed in the order
+    in which Generator.integers, normal, triangular and uniform consumed
+    them before, so the mapped flows are identical to direct draws.
+
+    Returns
+    -------
+    draws : dict
+        set_number of the Wheeler set, and (sim_horizon x 12) matrices of
+        standard_normal draws (Atbara), triangular_uniform draws on [0, 1)
+        (Mogren, by inverse transform) and uniform draws on [0, 1) (Blue
+        Nile)
+    """
+
+    key = (myseed, sim_horizon)
+    if key not in base_draws:
+        rng = np.random.default_rng(myseed)
+        shape = (sim_horizon, 12)
+        draws = {
+            "set_number": int(rng.integers(1, 101)),
+            "standard_normal": rng.standard_normal(shape),
+            "triangular_uniform": rng.random(shape),
+            "uniform": rng.random(shape),
+        }
+        for name in ["standard_normal", "triangular_uniform", "uniform"]:
+            draws[name].flags.writeable = False
+        base_draws[key] = draws
+
+    return base_draws[key]
+
+
+def triangular_from_uniform(uniform, left, mode, right):
+    """Inverse transform of uniform draws into draws of the triangular
+    distribution, with the arithmetic of numpy's triangular sampler
+    """
+
+    base = right - left
+    leftbase = mode - left
+    ratio = leftbase / base
+    leftprod = leftbase * base
+    rightprod = (right - mode) * base
+
+    return np.where(
+        uniform <= ratio,
+        left + np.sqrt(uniform * leftprod),
+        right - np.sqrt((1.0 - uniform) * rightprod),
+    )
+
+
 def generate_input_data(
     nile_model,
     myseed=123,
@@ -15,85 +198,92 @@ def generate_input_data(
     blue_nile_dev_coef=1,
     white_nile_dev_coef=1,
     atbara_dev_coef=1,
+    legacy_seed_order=True,
 ):
+    """Generates the irrigation demands and catchment inflows of one
+    scenario and assigns them to the model.
+
+    With legacy_seed_order (the default), the global numpy random state is
+    seeded with myseed and the stochastic Atbara, Mogren and Blue Nile
+    flows are drawn month by month in the original order, which reproduces
+    the inputs of the stored results, Pareto sets and warm starts bit by
+    bit. Otherwise they are mapped from the standardized draws of myseed
+    (see load_base_draws), which is faster but gives a different
+    realisation of the scenario. Either way, scenarios with the same seed
+    share their random numbers.
+    """
     # streamflow + demand
     data_directory = "stochastic_data_generation_inputs/"
 
-    # start with the demand
+    # start with the demand, growing geometrically every year
+    n_years = sim_horizon + demand_data_carry_over
     for district in nile_model.irr_districts.values():
-        one_year = np.loadtxt(f"{data_directory}IrrDemand{district.name}.txt")
-        demand_vector = np.empty(0)
-        loop_counter = sim_horizon + demand_data_carry_over
-        while loop_counter > 0:
-            demand_vector = np.append(demand_vector, one_year)
-            one_year *= 1 + yearly_demand_growth_rate
-            loop_counter -= 1
-        district.demand = demand_vector[demand_data_carry_over * 12 :]
-
-    # time for streamflow, start by getting the appropriate Wheeler (2018) set:
-    wheeler_large = pd.read_csv(f"{data_directory}{wh_set}_wheeler.csv")
-    wh_data = [wheeler_large[i : i + 600] for i in range(100)]
-    del wheeler_large
-    # wh_data = pickle.load( open( f"{data_directory}{wh_set}_wheeler.p", "rb" ) )
-    np.random.seed(myseed)
-    set_number = np.random.randint(1, 101)
-    numbered_catchments = wh_data[set_number]
-    numbered_catchments = numbered_catchments.iloc[49 : (49 + sim_horizon * 12)]
-
-    # Focus on the major inflows (3 gaging stations)
-    atbara_dist = pd.read_csv(f"{data_directory}atbara_distribution.csv")
-    mogren_dist = pd.read_csv(f"{data_directory}mogren_distribution.csv")
-    bluenile_dist = pd.read_csv(f"{data_directory}blue_nile_series.csv")
-    loop_counter = sim_horizon
-    atbara = np.empty(0)
-    mogren = np.empty(0)
-    bluenile = np.empty(0)
+        one_year = load_yearly_demand(district.name, data_directory)
+        if legacy_seed_order:
+            # Repeated multiplication rounds as the original year by year
+            # growth did
+            demand_matrix = np.empty((n_years, 12))
+            for year in range(n_years):
+                demand_matrix[year] = one_year
+                one_year = one_year * (1 + yearly_demand_growth_rate)
+        else:
+            growth = (1 + yearly_demand_growth_rate) ** np.arange(n_years)
+            demand_matrix = one_year * growth[:, np.newaxis]
+        district.demand = demand_matrix.ravel()[demand_data_carry_over * 12 :]
+
+    # Monthly distribution parameters of the major inflows (3 gaging
+    # stations)
+    dist = load_generation_inputs(data_directory)
+    atbara_mean = atbara_mean_coef * dist["atbara_mean"]
+    atbara_std = atbara_dev_coef * dist["atbara_std"]
+    mogren_mean = white_nile_mean_coef * dist["mogren_mean"]
+    mogren_min = white_nile_mean_coef * dist["mogren_min"]
+    mogren_min = np.maximum(
+        mogren_mean - (mogren_mean - mogren_min) * white_nile_dev_coef, 0
+    )
+    mogren_max = white_nile_mean_coef * dist["mogren_max"]
+    mogren_max = mogren_mean + (mogren_max - mogren_mean) * white_nile_dev_coef
     bluenile_nominal_disperse = 0.3
     bluenile_disperse = bluenile_nominal_disperse * blue_nile_dev_coef
-    while loop_counter > 0:
-        a = list()
-        m = list()
-        b = list()
-        for i in range(12):
-            a.append(
-                max(
-                    0,
-                    np.random.normal(
-                        atbara_mean_coef * atbara_dist.loc[i, "mean"],
-                        atbara_dev_coef * atbara_dist.loc[i, "std"],
-                    ),
-                )
-            )
-            mogren_mean = white_nile_mean_coef * mogren_dist.loc[i, "MeanQ"]
-            mogren_min = white_nile_mean_coef * mogren_dist.loc[i, "MinQ"]
-            mogren_min = max(
-                mogren_mean - (mogren_mean - mogren_min) * white_nile_dev_coef, 0
-            )
-            mogren_max = white_nile_mean_coef * mogren_dist.loc[i, "MaxQ"]
-            mogren_max = mogren_mean + (mogren_max - mogren_mean) * white_nile_dev_coef
-            m.append(
-                np.random.triangular(
-                    mogren_min,
-                    mogren_mean,
-                    mogren_max,
+    bluenile_low = blue_nile_mean_coef * dist["bluenile"] * (1 - bluenile_disperse)
+    bluenile_high = blue_nile_mean_coef * dist["bluenile"] * (1 + bluenile_disperse)
+
+    shape = (sim_horizon, 12)
+    if legacy_seed_order:
+        np.random.seed(myseed)
+        set_number = np.random.randint(1, 101)
+        atbara = np.empty(shape)
+        mogren = np.empty(shape)
+        bluenile = np.empty(shape)
+        for year in range(sim_horizon):
+            for i in range(12):
+                atbara[year, i] = max(
+                    0, np.random.normal(atbara_mean[i], atbara_std[i])
                 )
-            )
-            b.append(
-                np.random.uniform(
-                    blue_nile_mean_coef
-                    * bluenile_dist.loc[i, "0"]
-                    * (1 - bluenile_disperse),
-                    blue_nile_mean_coef
-                    * bluenile_dist.loc[i, "0"]
-                    * (1 + bluenile_disperse),
+                mogren[year, i] = np.random.triangular(
+                    mogren_min[i], mogren_mean[i], mogren_max[i]
                 )
-            )
-        atbara = np.append(atbara, a)
-        mogren = np.append(mogren, m)
-        bluenile = np.append(bluenile, b)
+                bluenile[year, i] = np.random.uniform(bluenile_low[i], bluenile_high[i])
+    else:
+        draws = load_base_draws(myseed, sim_horizon)
+        set_number = draws["set_number"]
+        atbara = np.maximum(0, atbara_mean + atbara_std * draws["standard_normal"])
+        mogren = triangular_from_uniform(
+            draws["triangular_uniform"], mogren_min, mogren_mean, mogren_max
+        )
+        bluenile = bluenile_low + (bluenile_high - bluenile_low) * draws["uniform"]
+
+    # time for streamflow, start by getting the appropriate Wheeler (2018) set.
+    # The selected set starts set_number rows into the ensemble (sets were
+    # taken as 600-row windows shifted by one row) and its first 49 months
+    # are skipped. Slicing the memory-mapped store does not copy.
+    wheeler_store = load_wheeler_store(wh_set, data_directory)
+    first_row = set_number + 49
+    numbered_catchments = wheeler_store[first_row : first_row + sim_horizon * 12]
 
-        loop_counter -= 1
-    inflow_dict = get_inflow_dict(numbered_catchments, atbara, mogren, bluenile)
+    inflow_dict = get_inflow_dict(
+        numbered_catchments, atbara.ravel(), mogren.ravel(), bluenile.ravel()
+    )
     for catchment in nile_model.catchments.values():
         catchment.inflow = np.array(inflow_dict[catchment.name])
 
@@ -102,24 +292,134 @@ def generate_input_data(
     return nile_model
 
 
-def get_inflow_dict(wh_df, atbara, mogren, bluenile):
+def get_inflow_dict(wh_inflows, atbara, mogren, bluenile):
+    """Catchment inflows from the Wheeler store rows (months x catchment)
+    and the stochastic Atbara, Mogren and Blue Nile series.
+    """
 
     output = dict()
-    output["Dinder"] = wh_df["340.Inflow"] + wh_df["635.Inflow"] + wh_df["1308.Inflow"]
-    output["Rahad"] = wh_df["243.Inflow"] + wh_df["519.Inflow"] + wh_df["524.Inflow"]
-    output["GERDToRoseires"] = (
-        wh_df["33.Inflow"] + wh_df["530.Inflow"] + wh_df["1374.Inflow"]
-    )
-    output["RoseiresToAbuNaama"] = wh_df["1309.Inflow"]
-    output["SukiToSennar"] = wh_df["470.Inflow"]
-    output["WhiteNile"] = (
-        wh_df["1364.Inflow"]
-        + wh_df["1338.Inflow"]
-        + wh_df["1317.Inflow"]
-        + wh_df["31.Inflow"]
-        + mogren
-    )
+    for i, name in enumerate(wheeler_catchment_columns):
+        output[name] = wh_inflows[:, i]
+    output["WhiteNile"] = output["WhiteNile"] + mogren
     output["Atbara"] = atbara
     output["BlueNile"] = bluenile
 
     return output
+
+
+class ScenarioInputCache:
+    """Bounded least-recently-used cache of the generated catchment inflows
+    and district demands of scenarios. Scenarios are identified by all
+    keyword arguments of generate_input_data (uncertainty parameters, seed,
+    wh_set etc.), with the defaults filled in, so the inputs of a scenario
+    are generated once no matter how many policies are evaluated on it.
+
+    When a cache directory is given, generated inputs are also written to
+    it as .npz files and read back by later processes. Stored files are
+    not checked against the input data files, so the directory should be
+    emptied when those change.
+    """
+
+    def __init__(self, maxsize=256, cache_directory=None):
+        if maxsize < 1:
+            raise ValueError("maxsize of the input cache must be at least 1")
+
+        self.maxsize = maxsize
+        self.cache_directory = cache_directory
+        self.entries = OrderedDict()
+
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+
+    @staticmethod
+    def scenario_key(**generation_kwargs):
+        """Hashable key of a scenario: the sorted keyword arguments of
+        generate_input_data with the defaults filled in
+        """
+
+        bound = inspect.signature(generate_input_data).bind(
+            None, **generation_kwargs
+        )
+        bound.apply_defaults()
+        del bound.arguments["nile_model"]
+
+        return tuple(sorted(bound.arguments.items()))
+
+    def file_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_directory, f"{digest}.npz")
+
+    def get_inputs(self, nile_model, **generation_kwargs):
+        """Catchment inflows and district demands of a scenario, generated
+        with generate_input_data on the first request only. The returned
+        arrays are shared between requests and are therefore read-only.
+
+        Returns
+        -------
+        inflows : dict
+            Inflow vector of each catchment, by name
+        demands : dict
+            Demand vector of each irrigation district, by name
+        """
+
+        key = self.scenario_key(**generation_kwargs)
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        inputs = None
+        if self.cache_directory is not None and os.path.exists(self.file_path(key)):
+            with np.load(self.file_path(key)) as stored:
+                inputs = (
+                    {name: stored[f"inflow_{name}"] for name in nile_model.catchments},
+                    {
+                        name: stored[f"demand_{name}"]
+                        for name in nile_model.irr_districts
+                    },
+                )
+
+        if inputs is None:
+            generate_input_data(nile_model, **generation_kwargs)
+            inputs = (
+                {
+                    name: np.array(catchment.inflow)
+                    for name, catchment in nile_model.catchments.items()
+                },
+                {
+                    name: np.array(district.demand)
+                    for name, district in nile_model.irr_districts.items()
+                },
+            )
+            if self.cache_directory is not None:
+                arrays = {f"inflow_{name}": x for name, x in inputs[0].items()}
+                arrays.update({f"demand_{name}": x for name, x in inputs[1].items()})
+                # Written under a temporary name first, so processes sharing
+                # the directory never read a partially written file
+                temporary_path = f"{self.file_path(key)}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(temporary_path, self.file_path(key))
+
+        for vectors in inputs:
+            for vector in vectors.values():
+                vector.flags.writeable = False
+
+        self.entries[key] = inputs
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return inputs
+
+    def assign_input_data(self, nile_model, **generation_kwargs):
+        """Assigns the cached inputs of a scenario to the model, in place of
+        generate_input_data
+        """
+
+        inflows, demands = self.get_inputs(nile_model, **generation_kwargs)
+        for name, catchment in nile_model.catchments.items():
+            catchment.inflow = inflows[name]
+        for name, district in nile_model.irr_districts.items():
+            district.demand = demands[name]
+
+        return nile_model
@@ -0,0 +1,284 @@
+"""
+Benchmark of the error and cost of simulating at a lower fidelity, i.e. a
+coarser integration interval or a truncated horizon (see
+ModelNile.set_fidelity), against a reference fidelity. The results show
+how much accuracy screening evaluations trade for their lower cost. The
+adaptive and analytic reservoir integrations (see
+ModelNile.set_integration_tolerance and set_analytic_integration) are
+benchmarked against the fixed sub-steps in the same way, as neither
+reproduces their objectives exactly, and simulations
+stopped early once their outcomes are decided (see
+ModelNile.set_early_termination) against the whole horizon.
+"""
+
+# Importing libraries for functionality
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def fidelity_benchmark(
+    nile_model, parameter_matrix, fidelities, reference=None, outcome_names=None
+):
+    """Evaluates the policies at every fidelity and at the reference fidelity
+    and compares their outcomes.
+
+    Parameters
+    ----------
+    nile_model : ModelNile object
+    parameter_matrix : np.array (N x parameter count)
+        Policies to evaluate, one per row
+    fidelities : list
+        (integration interval, simulation horizon) pairs to benchmark. None
+        in a pair keeps the value of the reference
+    reference : tuple, optional
+        Reference fidelity, the current fidelity of the model if None
+    outcome_names : list, optional
+        Names of the outcome columns of evaluate_batch
+
+    Returns
+    -------
+    benchmark : pd.DataFrame
+        One row per fidelity with the seconds per evaluation, the speed-up
+        against the reference and the mean and maximum absolute error of
+        every outcome
+    """
+
+    original = nile_model.get_fidelity()
+    if reference is None:
+        reference = original
+
+    def evaluate_at(fidelity):
+        nile_model.set_fidelity(*reference)
+        nile_model.set_fidelity(*fidelity)
+        start = time.perf_counter()
+        outcomes = nile_model.evaluate_batch(parameter_matrix)
+        return outcomes, (time.perf_counter() - start) / len(parameter_matrix)
+
+    try:
+        reference_outcomes, reference_seconds = evaluate_at(reference)
+        if outcome_names is None:
+            outcome_names = [f"outcome_{i}" for i in range(reference_outcomes.shape[1])]
+
+        rows = list()
+        for fidelity in fidelities:
+            outcomes, seconds = evaluate_at(fidelity)
+            errors = np.abs(outcomes - reference_outcomes)
+            row = {
+                "integration_interval": nile_model.integration_interval,
+                "simulation_horizon": nile_model.simulation_horizon,
+                "seconds_per_evaluation": seconds,
+                "speed_up": reference_seconds / seconds,
+            }
+            for i, name in enumerate(outcome_names):
+                row[f"{name}_mean_error"] = errors[:, i].mean()
+                row[f"{name}_max_error"] = errors[:, i].max()
+            rows.append(row)
+    finally:
+        nile_model.set_fidelity(*original)
+
+    return pd.DataFrame(rows)
+
+
+def local_integration_errors(nile_model, parameter_vector):
+    """Simulates the policy with the reservoir integration of the model
+    (adaptive or analytic) and integrates every month of every reservoir
+    also with the fixed sub-steps, from the same storage and flows.
+    Unlike the storages of two whole simulations, which drift apart
+    wherever the release switches back and forth at a bound, this shows
+    the error of the integration itself.
+
+    Parameters
+    ----------
+    nile_model : ModelNile object
+        Model with an integration tolerance or analytic integration,
+        recording the storages
+    parameter_vector : np.array
+        Policy parameters
+
+    Returns
+    -------
+    errors : dict
+        End of month storage error relative to the storage range of the
+        reservoir (as the integration tolerance), per month, of each
+        reservoir
+    """
+
+    errors = {name: list() for name in nile_model.reservoirs}
+
+    def checked_integration(reservoir):
+        integration = reservoir.integration
+
+        def checked(t, *args, fixed_steps=False):
+            if fixed_steps:
+                return integration(t, *args, fixed_steps=True)
+            integration(t, *args, fixed_steps=True)
+            fixed_storage = reservoir.storage_vector[t + 1]
+            integration(t, *args)
+            errors[reservoir.name].append(
+                abs(reservoir.storage_vector[t + 1] - fixed_storage)
+                / (reservoir.lookup_end - reservoir.lookup_start)
+            )
+
+        return checked
+
+    try:
+        for reservoir in nile_model.reservoirs.values():
+            reservoir.integration = checked_integration(reservoir)
+        nile_model.evaluate(parameter_vector)
+    finally:
+        for reservoir in nile_model.reservoirs.values():
+            del reservoir.integration
+
+    return {name: np.array(values) for name, values in errors.items()}
+
+
+def integration_benchmark(nile_model, parameter_matrix, tolerances=(), analytic=True):
+    """Evaluates the policies with the adaptive reservoir integration at
+    every tolerance, with the analytic integration and with the fixed
+    sub-steps of the integration interval.
+
+    Parameters
+    ----------
+    nile_model : ModelNile object
+    parameter_matrix : np.array (N x parameter count)
+        Policies to evaluate, one per row
+    tolerances : list
+        Integration tolerances of the adaptive integration to benchmark
+    analytic : bool
+        Whether the analytic integration is benchmarked
+
+    Returns
+    -------
+    benchmark : pd.DataFrame
+        One row per integration with the seconds per evaluation, the
+        speed-up against the fixed sub-steps, and for every reservoir the
+        mean sub-steps per month and the maximum monthly storage error
+        (see local_integration_errors)
+    """
+
+    original_integration = (
+        nile_model.integration_tolerance,
+        nile_model.analytic_integration,
+    )
+    original_mode = (
+        nile_model.recording_mode,
+        nile_model.trace_variables,
+        nile_model.trace_stride,
+    )
+    nile_model.set_recording_mode("trace", ["storage_vector", "substep_vector"])
+
+    def set_integration(tolerance, analytic):
+        nile_model.set_integration_tolerance(tolerance)
+        nile_model.set_analytic_integration(analytic)
+
+    def seconds_per_evaluation():
+        start = time.perf_counter()
+        for parameter_vector in parameter_matrix:
+            nile_model.evaluate(parameter_vector)
+        return (time.perf_counter() - start) / len(parameter_matrix)
+
+    integrations = [("adaptive", tolerance, False) for tolerance in tolerances]
+    if analytic:
+        integrations.append(("analytic", None, True))
+
+    try:
+        set_integration(None, False)
+        reference_seconds = seconds_per_evaluation()
+
+        rows = list()
+        for method, tolerance, analytic in integrations:
+            set_integration(tolerance, analytic)
+            seconds = seconds_per_evaluation()
+            row = {
+                "method": method,
+                "integration_tolerance": tolerance,
+                "seconds_per_evaluation": seconds,
+                "speed_up": reference_seconds / seconds,
+            }
+
+            substeps = {name: list() for name in nile_model.reservoirs}
+            errors = {name: list() for name in nile_model.reservoirs}
+            for parameter_vector in parameter_matrix:
+                policy_errors = local_integration_errors(nile_model, parameter_vector)
+                for name, reservoir in nile_model.reservoirs.items():
+                    substeps[name].append(reservoir.substep_vector.mean())
+                    errors[name].append(policy_errors[name].max())
+            for name in nile_model.reservoirs:
+                row[f"{name}_substeps"] = np.mean(substeps[name])
+                row[f"{name}_storage_error"] = np.max(errors[name])
+            rows.append(row)
+    finally:
+        set_integration(*original_integration)
+        nile_model.set_recording_mode(*original_mode)
+
+    return pd.DataFrame(rows)
+
+
+def early_termination_benchmark(
+    nile_model, parameter_matrix, criterion, check_intervals=(12, 24, 48)
+):
+    """Evaluates the policies over the whole horizon and with early
+    termination by the criterion at every check interval (see
+    ModelNile.set_early_termination). The policies are evaluated one at a
+    time, as the lanes of a batch only stop together.
+
+    Parameters
+    ----------
+    nile_model : ModelNile object
+    parameter_matrix : np.array (N x parameter count)
+        Policies to evaluate, one per row
+    criterion : DominanceTermination or ThresholdTermination
+        Termination criterion to benchmark
+    check_intervals : list
+        Months between checks of the criterion to benchmark
+
+    Returns
+    -------
+    benchmark : pd.DataFrame
+        One row per check interval with the share of truncated
+        evaluations, their mean simulated months, the seconds per
+        evaluation, the speed-up against the whole horizon including the
+        cost of the checks, and the saved seconds per evaluation estimated
+        by the truncated simulations
+    """
+
+    original = (nile_model.early_termination, nile_model.termination_interval)
+
+    def evaluate_all():
+        months = list()
+        saved_seconds = 0.0
+        start = time.perf_counter()
+        for parameter_vector in parameter_matrix:
+            nile_model.evaluate(parameter_vector)
+            months.append(nile_model.simulated_months)
+            saved_seconds += nile_model.saved_seconds
+        seconds = time.perf_counter() - start
+        return np.array(months), seconds / len(months), saved_seconds / len(months)
+
+    try:
+        nile_model.set_early_termination(None)
+        _, reference_seconds, _ = evaluate_all()
+
+        rows = list()
+        for check_interval in check_intervals:
+            nile_model.set_early_termination(criterion, check_interval)
+            months, seconds, saved_seconds = evaluate_all()
+            truncated = months < nile_model.simulation_horizon
+            rows.append(
+                {
+                    "check_interval": check_interval,
+                    "truncated_share": truncated.mean(),
+                    "truncated_months": months[truncated].mean()
+                    if truncated.any()
+                    else np.nan,
+                    "seconds_per_evaluation": seconds,
+                    "speed_up": reference_seconds / seconds,
+                    "saved_seconds_per_evaluation": saved_seconds,
+                }
+            )
+    finally:
+        nile_model.set_early_termination(*original)
+
+    return pd.DataFrame(rows)
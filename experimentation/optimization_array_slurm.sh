@@ -0,0 +1,35 @@
+#!/bin/sh
+#
+#SBATCH --job-name="python_reservoir_sim"
+#SBATCH --partition=compute
+#SBATCH --time=16:00:00
+#SBATCH --nodes=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=48
+#SBATCH --mem-per-cpu=1G
+#SBATCH --account=research-tpm-mas
+#SBATCH --array=0-4
+
+# Every array task optimizes one seed. Once all of them are done, merge the
+# shards with the same settings:
+# sbatch --dependency=afterok:<array job id> --array=0 --cpus-per-task=1 \
+#     --export=ALL,MERGE_SEEDS="0 1 2 3 4" optimization_array_slurm.sh
+
+module load 2022r2
+module load python/3.8.12
+
+export OMP_NUM_THREADS=$SLURM_CPUS_PER_TASK
+
+# Set the desired input parameters as environment variables
+export NFE=50000
+export EPSILON_LIST="0.01 0.001 0.001 0.01 0.001 0.01"
+export CONVERGENCE_FREQ=500
+export DESCRIPTION="shards"
+export PRINCIPLE="None"
+# Resubmitting the job resumes every seed from its last checkpoint
+export CHECKPOINT_FREQ=1000
+if [ -z "$MERGE_SEEDS" ]; then
+    export SEED=$SLURM_ARRAY_TASK_ID
+fi
+
+srun python3 main.py
@@ -10,12 +10,15 @@ from datetime import datetime
 
 
 from ema_workbench import RealParameter, ScalarOutcome, Model, Policy, Scenario
-from ema_workbench import MultiprocessingEvaluator, ema_logging
+from ema_workbench import ema_logging
 
 module_path = os.path.abspath(os.path.join(".."))
 if module_path not in sys.path:
     sys.path.append(module_path)
 from model.model_nile_scenario import ModelNileScenario
+from model.shared_inputs import share_input_data
+from model.evaluation_cache import describe_statistics
+from experimentation.chunked_evaluator import ChunkedEvaluator
 
 
 if __name__ == "__main__":
@@ -23,6 +26,12 @@ if __name__ == "__main__":
 
     output_directory = "../outputs/"
     nile_model = ModelNileScenario()
+    # Opt-in: EVALUATION_CACHE names an SQLite file of evaluations, e.g. shared with
+    # earlier runs, whose stored experiments are read instead of simulated
+    evaluation_cache = os.environ.get("EVALUATION_CACHE")
+    nile_model.set_evaluation_cache(evaluation_cache)
+    # Workers attach to the input arrays instead of holding their own copies
+    share_input_data(nile_model)
 
     em_model = Model("NileProblem", function=nile_model)
     em_model.uncertainties = [
@@ -121,7 +130,7 @@ if __name__ == "__main__":
 
     before = datetime.now()
 
-    with MultiprocessingEvaluator(em_model) as evaluator:
+    with ChunkedEvaluator(em_model) as evaluator:
         experiments, outcomes = evaluator.perform_experiments(my_scenarios, my_policies)
 
     after = datetime.now()
@@ -130,6 +139,9 @@ if __name__ == "__main__":
         f.write(
             f"It took {after-before} time to run re-simulation 5 scenarios {len(my_policies)} policies"
         )
+        cache_statistics = evaluator.cache_statistics()
+        if cache_statistics is not None:
+            f.write(f"\n{describe_statistics(evaluation_cache, cache_statistics)}")
     outcomes = pd.DataFrame.from_dict(outcomes)
     experiments.to_csv(f"{output_directory}experiments_resimulation.csv")
     outcomes.to_csv(f"{output_directory}outcomes_resimulation.csv")
@@ -10,12 +10,16 @@ from datetime import datetime
 
 
 from ema_workbench import RealParameter, ScalarOutcome, Model, Policy
-from ema_workbench import MultiprocessingEvaluator, ema_logging
+from ema_workbench import ema_logging
 
 module_path = os.path.abspath(os.path.join(".."))
 if module_path not in sys.path:
     sys.path.append(module_path)
 from model.model_nile_scenario import ModelNileScenario
+from model.early_termination import ThresholdTermination
+from model.shared_inputs import share_input_data
+from model.evaluation_cache import describe_statistics
+from experimentation.chunked_evaluator import ChunkedEvaluator
 
 
 if __name__ == "__main__":
@@ -23,6 +27,12 @@ if __name__ == "__main__":
 
     output_directory = "../outputs/"
     nile_model = ModelNileScenario()
+    # Opt-in: EVALUATION_CACHE names an SQLite file of evaluations, e.g. shared with
+    # earlier runs, whose stored experiments are read instead of simulated
+    evaluation_cache = os.environ.get("EVALUATION_CACHE")
+    nile_model.set_evaluation_cache(evaluation_cache)
+    # Workers attach to the input arrays instead of holding their own copies
+    share_input_data(nile_model)
 
     em_model = Model("NileProblem", function=nile_model)
     em_model.uncertainties = [
@@ -72,10 +82,24 @@ if __name__ == "__main__":
         for i in policy_df.index
     ]
 
+    # Opt-in: THRESHOLD_OUTCOMES names the outcomes file of an earlier exploration.
+    # Simulations then stop once every outcome is known to be below the 20th, between the
+    # 20th and 80th or above the 80th percentile of that file (the smaller20/bigger80
+    # splits). Truncated experiments get NaN outcomes, as only their classes are known.
+    # The checks have cost more time than they saved so far (see
+    # model/early_termination.py), so this is off unless the variable is set
+    threshold_outcomes = os.environ.get("THRESHOLD_OUTCOMES")
+    early_termination = None
+    if threshold_outcomes is not None:
+        prior_outcomes = pd.read_csv(threshold_outcomes, index_col=0)
+        early_termination = ThresholdTermination.from_quantiles(
+            prior_outcomes[[outcome.name for outcome in em_model.outcomes]].values
+        )
+
     random.seed(123)
     before = datetime.now()
 
-    with MultiprocessingEvaluator(em_model) as evaluator:
+    with ChunkedEvaluator(em_model, early_termination=early_termination) as evaluator:
         experiments, outcomes = evaluator.perform_experiments(n_scenarios, my_policies)
 
     after = datetime.now()
@@ -84,6 +108,19 @@ if __name__ == "__main__":
         f.write(
             f"It took {after-before} time to run {n_scenarios} scenarios {len(my_policies)} policies"
         )
+        if early_termination is not None:
+            truncated = sum(months < nile_model.simulation_horizon
+                            for months in evaluator.simulated_months)
+            f.write(
+                f"\n{truncated} simulations stopped early once their outcome classes were "
+                f"decided, saving about {evaluator.saved_seconds:.0f} seconds of simulation"
+            )
+        cache_statistics = evaluator.cache_statistics()
+        if cache_statistics is not None:
+            f.write(f"\n{describe_statistics(evaluation_cache, cache_statistics)}")
+    if early_termination is not None:
+        # Truncated experiments have NaN outcomes
+        experiments["simulated_months"] = evaluator.simulated_months
     outcomes = pd.DataFrame.from_dict(outcomes)
     experiments.to_csv(f"{output_directory}experiments_exploration.csv")
     outcomes.to_csv(f"{output_directory}outcomes_exploration.csv")
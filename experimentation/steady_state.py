@@ -0,0 +1,605 @@
+"""
+Asynchronous steady-state optimization on the worker pool of a
+ChunkedEvaluator. Instead of evaluating a generation and waiting for its
+last evaluation, every island keeps a number of offspring in flight and
+replaces members of its population (epsilon-MOEA style) as soon as an
+evaluation returns, generating the next offspring right away. Islands run
+one seed each and can periodically send members of their epsilon archive
+to the next island.
+
+With a screening fidelity (a coarser integration interval or a truncated
+horizon, see ModelNile.set_fidelity), offspring are first evaluated
+cheaply. Only those that would enter the epsilon archive, give or take a
+margin of epsilons, are evaluated again at the fidelity of the model and
+added to the population and archive.
+
+With early termination, full evaluations of offspring stop as soon as
+their outcomes cannot enter the epsilon archive whatever the remaining
+months (see model.early_termination). Such truncated evaluations count
+against the NFE but are not added to the population.
+
+With a surrogate, a Gaussian process trained on the evaluations of the
+island pre-screens the offspring (see experimentation.surrogate). Offspring
+that would not enter the epsilon archive even with their predicted
+objectives a number of predicted standard deviations better are discarded
+without an evaluation.
+"""
+
+# Importing libraries for functionality
+import copy
+import math
+import queue
+import random
+from collections import deque
+
+import numpy as np
+
+from ema_workbench.em_framework.optimization import (
+    AbstractConvergenceMetric,
+    CombinedVariator,
+    Convergence,
+    to_dataframe,
+    to_problem,
+)
+from ema_workbench.util import get_module_logger
+from platypus import EpsMOEA, Problem, RandomGenerator, default_variator
+
+from experimentation.surrogate import GaussianProcessSurrogate
+from model.early_termination import DominanceTermination
+
+_logger = get_module_logger(__name__)
+
+
+class IslandCount(AbstractConvergenceMetric):
+    """Convergence metric recording a counter of the island, e.g. the
+    evaluations at screening fidelity
+    """
+
+    def __init__(self, name, attribute):
+        super().__init__(name)
+        self.attribute = attribute
+
+    def __call__(self, optimizer):
+        self.results.append(getattr(optimizer, self.attribute))
+
+
+class Island:
+    """
+    Steady-state epsilon-MOEA of one seed. The population and the epsilon
+    archive are those of platypus EpsMOEA, but the offspring are generated
+    and added one evaluation at a time.
+
+    Attributes
+    ----------
+    algorithm : platypus EpsMOEA
+        Population, epsilon archive and NFE count of the island
+    convergence : ema_workbench Convergence
+        Convergence metrics of the island, tracked every population_size
+        evaluations
+    in_flight : int
+        Chunks of the island being evaluated
+    pending : list
+        Initial solutions not yet sent for evaluation
+    promoted : list
+        Screened solutions waiting for their evaluation at full fidelity
+    cost : float
+        NFE budget used by the dispatched evaluations, in which a
+        screening evaluation counts as its relative cost
+    screening_nfe : int
+        Evaluations at screening fidelity
+    full_nfe : int
+        Evaluations at the fidelity of the model
+    truncated_nfe : int
+        Evaluations stopped early as dominated by the archive
+    saved_seconds : float
+        Estimated simulation time saved by the early termination
+    surrogate : GaussianProcessSurrogate
+        Surrogate pre-screening the offspring, None without
+    prescreened : list
+        Offspring that passed the pre-screening, not yet evaluated
+    surrogate_rejected : int
+        Offspring discarded by the pre-screening without an evaluation
+    surrogate_errors : deque
+        Mean absolute prediction error, in epsilons, of the latest
+        population_size evaluated predictions
+    last_fit : int
+        Full NFE at the last fit of the surrogate
+    """
+
+    def __init__(self, problem, epsilons, population_size, convergence, generator=None):
+        klass = problem.types[0].__class__
+        if all(isinstance(t, klass) for t in problem.types):
+            variator = default_variator(problem)
+        else:
+            variator = CombinedVariator()
+
+        self.algorithm = EpsMOEA(
+            problem, epsilons, population_size=population_size, variator=variator
+        )
+        # Filled by the evaluated initial solutions as they return
+        self.algorithm.population = list()
+        self.convergence = convergence
+        self.in_flight = 0
+        self.promoted = list()
+        self.cost = 0.0
+        self.screening_nfe = 0
+        self.full_nfe = 0
+        self.truncated_nfe = 0
+        self.saved_seconds = 0.0
+        self.surrogate = None
+        self.prescreened = list()
+        self.surrogate_rejected = 0
+        self.surrogate_errors = deque(maxlen=population_size)
+        self.last_fit = 0
+        self.last_migration = 0
+        self.last_convergence = 0
+
+        if generator is None:
+            generator = RandomGenerator()
+        self.pending = [generator.generate(problem) for _ in range(population_size)]
+
+    @property
+    def nfe(self):
+        return self.algorithm.nfe
+
+    @property
+    def surrogate_error(self):
+        if not self.surrogate_errors:
+            return np.nan
+        return np.mean(self.surrogate_errors)
+
+    @property
+    def result(self):
+        # Read by the convergence metrics and to_dataframe
+        return self.algorithm.archive
+
+    def offspring(self, count):
+        """Up to count solutions to evaluate: the initial population first,
+        then offspring of the current population and archive. Offspring
+        are only generated once two members are evaluated.
+        """
+        algorithm = self.algorithm
+        solutions = list()
+        if self.pending:
+            while self.pending and len(solutions) < count:
+                solutions.append(self.pending.pop())
+            return solutions
+
+        if len(algorithm.population) < 2:
+            return solutions
+
+        variator = algorithm.variator
+        while len(solutions) < count:
+            if len(algorithm.archive) <= 1:
+                parents = algorithm.selector.select(variator.arity, algorithm.population)
+            else:
+                parents = algorithm.selector.select(
+                    variator.arity - 1, algorithm.population
+                ) + [random.choice(algorithm.archive)]
+            random.shuffle(parents)
+            solutions.extend(variator.evolve(parents))
+
+        return solutions[:count]
+
+    def add(self, solution):
+        """Adds an evaluated solution to the population and the archive"""
+        algorithm = self.algorithm
+        if len(algorithm.population) < algorithm.population_size:
+            algorithm.population.append(solution)
+        else:
+            algorithm._add_to_population(solution)
+        algorithm.archive.add(solution)
+
+    def prescreen(self, count, kappa, rounds=10):
+        """Up to count offspring passing the surrogate pre-screening, i.e.
+        that would enter the epsilon archive with their predicted
+        objectives kappa predicted standard deviations better. At most
+        rounds times count offspring are generated, if none of them passes
+        the last ones are returned anyway. Without a fitted surrogate or
+        while the initial population is pending, offspring are returned
+        as generated.
+        """
+        if self.surrogate is None or not self.surrogate.fitted or self.pending:
+            return self.offspring(count)
+
+        accepted = self.prescreened
+        candidates = list()
+        rejected = 0
+        for _ in range(rounds):
+            if len(accepted) >= count:
+                break
+            candidates = self.offspring(count)
+            if not candidates:
+                break
+            mean, std = self.surrogate.predict(
+                [candidate.variables[:] for candidate in candidates]
+            )
+            for candidate, objectives, deviations in zip(candidates, mean, std):
+                # Compared with the outcome of its evaluation
+                candidate.prediction = objectives
+                if self.enters_archive(candidate, objectives, kappa * deviations):
+                    accepted.append(candidate)
+                else:
+                    rejected += 1
+
+        if not accepted:
+            # The last candidates are evaluated after all
+            self.surrogate_rejected += rejected - len(candidates)
+            return candidates
+
+        self.surrogate_rejected += rejected
+        self.prescreened = accepted[count:]
+        return accepted[:count]
+
+    def learn(self, solution, epsilons):
+        """Adds a full evaluation to the training samples of the surrogate
+        and records the error of its prediction, if any, in epsilons
+        """
+        self.surrogate.add(solution.variables[:], solution.objectives[:])
+        prediction = getattr(solution, "prediction", None)
+        if prediction is not None:
+            self.surrogate_errors.append(
+                np.mean(np.abs(prediction - solution.objectives[:]) / epsilons)
+            )
+            solution.prediction = None
+
+    def near_archive(self, solution, margin):
+        """Whether the solution would enter the epsilon archive if each of
+        its objectives were margin epsilons better
+        """
+        epsilons = self.algorithm.archive._dominance.epsilons
+        shifts = [
+            margin * float(epsilons[i % len(epsilons)])
+            for i in range(solution.problem.nobjs)
+        ]
+        return self.enters_archive(solution, solution.objectives, shifts)
+
+    def enters_archive(self, solution, objectives, shifts):
+        """Whether the solution would enter the epsilon archive with the
+        given objectives, each shifted by its shift in its direction of
+        improvement
+        """
+        archive = self.algorithm.archive
+        dominance = archive._dominance
+        problem = solution.problem
+
+        shifted = copy.deepcopy(solution)
+        for i in range(problem.nobjs):
+            if problem.directions[i] == Problem.MAXIMIZE:
+                shifted.objectives[i] = objectives[i] + shifts[i]
+            else:
+                shifted.objectives[i] = objectives[i] - shifts[i]
+
+        return not any(dominance.compare(shifted, member) > 0 for member in archive)
+
+    def track_convergence(self):
+        if self.nfe >= self.last_convergence + self.algorithm.population_size:
+            self.convergence(self)
+            self.last_convergence = self.nfe
+
+
+def optimize_steady_state(
+    evaluator,
+    em_model,
+    nfe,
+    epsilons,
+    convergences,
+    convergence_freq=1000,
+    logging_freq=5,
+    population_size=100,
+    chunk_size=4,
+    chunks_per_process=2,
+    migration_freq=None,
+    migration_size=5,
+    generators=None,
+    screening_fidelity=None,
+    screening_margin=1.0,
+    screening_cost=1.0,
+    early_termination=False,
+    surrogate=False,
+    surrogate_kappa=1.0,
+    surrogate_samples=500,
+):
+    """Optimizes the model on one island per convergence list, e.g. one
+    per seed. Each island runs nfe evaluations and keeps its own
+    population, epsilon archive and convergence metrics.
+
+    Parameters
+    ----------
+    evaluator : ChunkedEvaluator
+        Evaluator whose worker pool evaluates the offspring
+    em_model : ema_workbench Model
+    nfe : int
+        Number of function evaluations of every island
+    epsilons : list
+        Epsilon values of the outcomes
+    convergences : list
+        Convergence metrics of each island
+    convergence_freq : int
+        NFE between convergence checks
+    logging_freq : int
+        Convergence checks (of population_size evaluations) between
+        progress logs
+    population_size : int
+        Population size of every island
+    chunk_size : int
+        Offspring evaluated together by a worker. Small chunks keep the
+        replacement close to steady state, larger ones make use of the
+        batched simulation
+    chunks_per_process : int
+        Chunks in flight per worker process, over all islands
+    migration_freq : int, optional
+        NFE between migrations of an island. At a migration migration_size
+        random members of its archive are added to the next island (in a
+        ring). The islands are independent if None
+    migration_size : int
+        Archive members sent at a migration
+    generators : list, optional
+        Generator of the initial population of each island, random if None
+        (see warm_start.warm_start_population)
+    screening_fidelity : tuple, optional
+        Integration interval and simulation horizon at which offspring are
+        screened (see ModelNile.set_fidelity). The initial population and
+        the offspring passing the screening are evaluated at the fidelity
+        of the model, which alone enter the population and archive. No
+        screening if None
+    screening_margin : float
+        Epsilons by which a screened solution may miss the archive and
+        still be evaluated at full fidelity, allowing for the error of
+        the screening fidelity
+    screening_cost : float
+        Cost of a screening evaluation relative to a full one, counted
+        against the nfe budget of the island
+    early_termination : bool
+        Whether full evaluations of offspring stop once their objectives
+        are epsilon dominated by the archive of the island, checked every
+        termination_interval months of the model (see
+        ModelNile.set_early_termination)
+    surrogate : bool
+        Whether a Gaussian process trained on the full evaluations of the
+        island pre-screens its offspring once the initial population is
+        evaluated, refitted every population_size full evaluations
+    surrogate_kappa : float
+        Predicted standard deviations by which the predicted objectives of
+        an offspring are improved at the pre-screening. A larger kappa
+        evaluates more uncertain offspring
+    surrogate_samples : int
+        Most recent full evaluations the surrogate is trained on
+
+    Returns
+    -------
+    results : list
+        Epsilon nondominated solutions (pd.DataFrame) of each island. With
+        screening, the integration_interval and simulation_horizon
+        columns record the fidelity they were evaluated at
+    convergences : list
+        Convergence metrics over the NFE (pd.DataFrame) of each island
+    """
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if population_size < 2:
+        raise ValueError("population_size must be at least 2")
+    if screening_fidelity is not None:
+        if not 0 < screening_cost <= 1:
+            raise ValueError("screening_cost must be in (0, 1]")
+        if screening_margin < 0:
+            raise ValueError("screening_margin must not be negative")
+        screening_fidelity = tuple(screening_fidelity)
+    if surrogate and surrogate_kappa < 0:
+        raise ValueError("surrogate_kappa must not be negative")
+
+    problem = to_problem(em_model, "levers")
+    if generators is None:
+        generators = [None] * len(convergences)
+    outcome_names = em_model.output_variables
+    outcome_indices = [outcome_names.index(name) for name in problem.outcome_names]
+    lever_count = len(problem.parameter_names)
+    lever_order = [problem.parameter_names.index(f"v{i}") for i in range(lever_count)]
+    # Epsilon and direction of every objective for the early termination,
+    # as in the epsilon dominance of the archive
+    objective_epsilons = [
+        epsilons[min(i, len(epsilons) - 1)] for i in range(problem.nobjs)
+    ]
+    maximize = [direction == Problem.MAXIMIZE for direction in problem.directions]
+    horizon = evaluator.nile_model.get_fidelity()[1]
+
+    if screening_fidelity is not None:
+        convergences = [
+            list(convergence)
+            + [
+                IslandCount("screening_nfe", "screening_nfe"),
+                IslandCount("full_nfe", "full_nfe"),
+            ]
+            for convergence in convergences
+        ]
+    if early_termination:
+        convergences = [
+            list(convergence)
+            + [
+                IslandCount("truncated_nfe", "truncated_nfe"),
+                IslandCount("saved_seconds", "saved_seconds"),
+            ]
+            for convergence in convergences
+        ]
+
+    if surrogate:
+        convergences = [
+            list(convergence)
+            + [
+                IslandCount("surrogate_rejected", "surrogate_rejected"),
+                IslandCount("surrogate_error", "surrogate_error"),
+            ]
+            for convergence in convergences
+        ]
+
+    islands = [
+        Island(
+            problem,
+            epsilons,
+            population_size,
+            Convergence(
+                convergence,
+                nfe,
+                convergence_freq=convergence_freq,
+                logging_freq=logging_freq,
+            ),
+            generator,
+        )
+        for convergence, generator in zip(convergences, generators)
+    ]
+    if surrogate:
+        for island in islands:
+            island.surrogate = GaussianProcessSurrogate(
+                [variable_type.min_value for variable_type in problem.types],
+                [variable_type.max_value for variable_type in problem.types],
+                surrogate_samples,
+            )
+    chunk_limit = max(1, evaluator.n_processes * chunks_per_process // len(islands))
+
+    # Outcomes are put on the queue by the result thread of the pool and
+    # handled here, one chunk at a time
+    completed = queue.Queue()
+
+    def dispatch(island):
+        while island.in_flight < chunk_limit:
+            fidelity = None
+            # The initial population is always evaluated over the horizon
+            initial = bool(island.pending)
+            if island.promoted:
+                # Their cost was counted when they were promoted
+                solutions = island.promoted[:chunk_size]
+                del island.promoted[:chunk_size]
+            else:
+                if screening_fidelity is not None and not island.pending:
+                    fidelity = screening_fidelity
+                cost = 1.0 if fidelity is None else screening_cost
+                count = min(chunk_size, math.floor((nfe - island.cost) / cost + 1e-9))
+                solutions = (
+                    island.prescreen(count, surrogate_kappa) if count > 0 else []
+                )
+                if not solutions:
+                    return
+                island.cost += len(solutions) * cost
+            parameter_matrix = np.array(
+                [[solution.variables[j] for j in lever_order] for solution in solutions]
+            )
+
+            termination = None
+            if (
+                early_termination
+                and fidelity is None
+                and not initial
+                and len(island.algorithm.archive)
+            ):
+                termination = DominanceTermination(
+                    [member.objectives[:] for member in island.algorithm.archive],
+                    objective_epsilons,
+                    maximize,
+                    outcome_indices,
+                )
+
+            def put(
+                result,
+                island=island,
+                solutions=solutions,
+                fidelity=fidelity,
+                terminated=termination is not None,
+            ):
+                outcomes, truncation = result if terminated else (result, None)
+                completed.put((island, solutions, outcomes, truncation, fidelity))
+
+            evaluator.submit(
+                parameter_matrix, put, completed.put, fidelity, termination
+            )
+            island.in_flight += 1
+
+    for island in islands:
+        dispatch(island)
+
+    while any(island.in_flight for island in islands):
+        item = completed.get()
+        if isinstance(item, BaseException):
+            raise item
+        island, solutions, outcomes, truncation, fidelity = item
+        island.in_flight -= 1
+
+        for j, (solution, row) in enumerate(zip(solutions, outcomes)):
+            solution.objectives[:] = [row[i] for i in outcome_indices]
+            solution.constraint_violation = 0.0
+            solution.feasible = True
+            solution.evaluated = True
+            island.algorithm.nfe += 1
+            if fidelity is None:
+                island.full_nfe += 1
+                if truncation is not None and truncation[j, 0] < horizon:
+                    # Cannot enter the archive, whatever the remaining months
+                    island.truncated_nfe += 1
+                    island.saved_seconds += truncation[j, 1]
+                else:
+                    island.add(solution)
+                    if island.surrogate is not None:
+                        island.learn(solution, objective_epsilons)
+            else:
+                island.screening_nfe += 1
+                if island.cost + 1 <= nfe + 1e-9 and island.near_archive(
+                    solution, screening_margin
+                ):
+                    island.promoted.append(solution)
+                    island.cost += 1
+
+        if (
+            island.surrogate is not None
+            and len(island.surrogate.levers) >= population_size
+            and island.full_nfe >= island.last_fit + population_size
+        ):
+            island.surrogate.fit()
+            island.last_fit = island.full_nfe
+            _logger.debug(
+                f"island {islands.index(island)} surrogate fitted on "
+                f"{len(island.surrogate.levers)} evaluations, prediction error "
+                f"{island.surrogate_error:.2f} epsilons"
+            )
+
+        island.track_convergence()
+
+        if (
+            migration_freq is not None
+            and len(islands) > 1
+            and island.nfe >= island.last_migration + migration_freq
+        ):
+            destination = islands[(islands.index(island) + 1) % len(islands)]
+            archive = island.algorithm.archive
+            for solution in random.sample(
+                list(archive), min(migration_size, len(archive))
+            ):
+                destination.add(copy.deepcopy(solution))
+            island.last_migration = island.nfe
+
+        dispatch(island)
+
+    results = list()
+    convergence_results = list()
+    for island in islands:
+        result = to_dataframe(island, problem.parameter_names, problem.outcome_names)
+        if screening_fidelity is not None:
+            result["integration_interval"], result["simulation_horizon"] = (
+                evaluator.nile_model.get_fidelity()
+            )
+        results.append(result)
+        convergence_results.append(island.convergence.to_dataframe())
+        _logger.info(
+            f"optimization completed, found {len(island.algorithm.archive)} solutions"
+        )
+        if early_termination:
+            _logger.info(
+                f"{island.truncated_nfe} evaluations stopped early, saving about "
+                f"{island.saved_seconds:.1f} seconds of simulation"
+            )
+        if surrogate:
+            _logger.info(
+                f"surrogate discarded {island.surrogate_rejected} offspring, "
+                f"prediction error {island.surrogate_error:.2f} epsilons"
+            )
+
+    return results, convergence_results
@@ -0,0 +1,140 @@
+"""
+Surrogate of the Nile model for the pre-screening of offspring in the
+steady-state optimization. A Gaussian process over the levers is trained
+online on the evaluated (lever, objective) pairs of an island and predicts
+the objectives of new offspring together with their uncertainty. Only
+offspring that are promising or uncertain, i.e. that would enter the
+epsilon archive with their predicted objectives improved by a number of
+predicted standard deviations, are evaluated with the model.
+
+Pre-screening is opt-in. A simulation of the current problem is cheap
+next to a fit of the process, and in short benchmark runs it either
+discarded no offspring (kappa 1) or discarded promising ones along with
+the rest, converging more slowly in both NFE and time (kappa 0). Compare
+runs with output_analysis.convergence.compare before relying on it.
+"""
+
+# Importing libraries for functionality
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+
+
+class GaussianProcessSurrogate:
+    """
+    Gaussian process regression of the objectives on the levers with a
+    squared exponential kernel shared by all objectives. The levers are
+    scaled to the unit cube and the objectives standardized. The length
+    scale and the noise of the kernel are chosen from a grid around the
+    median distance between the samples by their marginal likelihood.
+
+    Parameters
+    ----------
+    lower, upper : np.array
+        Bounds of every lever
+    max_samples : int
+        Number of most recent evaluations the process is trained on. The
+        cost of a fit grows with its cube
+    length_factors : tuple
+        Length scales of the grid, relative to the median distance
+    noise_levels : tuple
+        Noise variances of the grid, relative to the variance of the
+        standardized objectives
+    min_length_scale : float
+        Floor of the length scale in the unit cube, e.g. for training
+        samples at a single point
+
+    Attributes
+    ----------
+    levers, objectives : list
+        Training samples, the oldest first
+    fitted : bool
+        Whether predictions are available
+    """
+
+    def __init__(
+        self,
+        lower,
+        upper,
+        max_samples=500,
+        length_factors=(0.5, 1.0, 2.0, 4.0),
+        noise_levels=(1e-3, 1e-2, 1e-1),
+        min_length_scale=1e-3,
+    ):
+        self.lower = np.asarray(lower, dtype=float)
+        self.range = np.asarray(upper, dtype=float) - self.lower
+        self.max_samples = max_samples
+        self.length_factors = length_factors
+        self.noise_levels = noise_levels
+        self.min_length_scale = min_length_scale
+        self.levers = list()
+        self.objectives = list()
+        self.fitted = False
+
+    def scale(self, levers):
+        return (np.atleast_2d(np.asarray(levers, dtype=float)) - self.lower) / self.range
+
+    @staticmethod
+    def squared_distances(a, b):
+        distances = (
+            np.sum(a**2, axis=1)[:, None] + np.sum(b**2, axis=1)[None, :] - 2 * a @ b.T
+        )
+        return np.maximum(distances, 0)
+
+    def add(self, levers, objectives):
+        """Adds an evaluated sample, dropping the oldest beyond max_samples"""
+        self.levers.append(np.asarray(levers, dtype=float))
+        self.objectives.append(np.asarray(objectives, dtype=float))
+        del self.levers[: -self.max_samples]
+        del self.objectives[: -self.max_samples]
+
+    def fit(self):
+        """Fits the process to the training samples"""
+
+        x = self.scale(self.levers)
+        y = np.array(self.objectives)
+        self.mean = y.mean(axis=0)
+        self.std = y.std(axis=0)
+        self.std[self.std == 0] = 1.0
+        z = (y - self.mean) / self.std
+
+        distances = self.squared_distances(x, x)
+        median = np.median(distances[np.triu_indices(len(x), 1)])
+        best = None
+        for factor in self.length_factors:
+            length_scale = max(factor * np.sqrt(median / 2), self.min_length_scale)
+            kernel = np.exp(-distances / (2 * length_scale**2))
+            for noise in self.noise_levels:
+                factorization = cho_factor(kernel + noise * np.eye(len(x)), lower=True)
+                alpha = cho_solve(factorization, z)
+                # Log marginal likelihood summed over the objectives, up to
+                # a constant
+                likelihood = -0.5 * np.sum(z * alpha) - z.shape[1] * np.sum(
+                    np.log(np.diag(factorization[0]))
+                )
+                if best is None or likelihood > best[0]:
+                    best = (likelihood, length_scale, noise, factorization, alpha)
+
+        _, self.length_scale, self.noise, factorization, self.alpha = best
+        self.cholesky = factorization[0]
+        self.training_levers = x
+        self.fitted = True
+
+    def predict(self, levers):
+        """Predicted objectives of the levers and their standard deviations
+
+        Returns
+        -------
+        mean, std : np.array (N x objectives)
+        """
+
+        cross = np.exp(
+            -self.squared_distances(self.scale(levers), self.training_levers)
+            / (2 * self.length_scale**2)
+        )
+        mean = cross @ self.alpha * self.std + self.mean
+
+        v = solve_triangular(self.cholesky, cross.T, lower=True)
+        variance = np.maximum(1 + self.noise - np.sum(v**2, axis=0), 0)
+        std = np.sqrt(variance)[:, None] * self.std
+
+        return mean, std
@@ -0,0 +1,153 @@
+"""
+Warm start of optimizations from the Pareto sets of earlier experiments.
+The levers of prior results files seed the initial population instead of
+random policies, optionally subsampled for diversity and perturbed. The
+objectives are not taken over: the seeded policies are evaluated again
+under the settings of the new experiment. The hypervolume of warm-started
+and random runs can be compared with output_analysis.convergence.compare.
+"""
+
+# Importing libraries for functionality
+import random
+
+import numpy as np
+import pandas as pd
+
+from ema_workbench.em_framework.optimization import AbstractConvergenceMetric
+from platypus import InjectedPopulation, Solution
+
+
+class WarmStart(AbstractConvergenceMetric):
+    """Convergence metric recording the number of solutions the population
+    of the optimization was seeded with, so that the convergence CSV of a
+    warm-started run can be told apart from a random start
+    """
+
+    def __init__(self, solution_count):
+        super().__init__("warm_start")
+        self.solution_count = solution_count
+
+    def __call__(self, optimizer):
+        self.results.append(self.solution_count)
+
+
+def load_prior_levers(paths, em_model):
+    """Lever values of the solutions in one or more results CSV files, e.g.
+    "outputs/nfe50000_uwf_001_demand/baseline_results_nfe50000_uwf_001_demand.csv"
+
+    Parameters
+    ----------
+    paths : list
+        Results files with a column per lever
+    em_model : ema_workbench Model
+        Model whose levers the files must contain
+
+    Returns
+    -------
+    levers : pd.DataFrame
+        Unique lever vectors of all files, clipped to the lever bounds
+    """
+
+    lever_names = [lever.name for lever in em_model.levers]
+    frames = list()
+    for path in paths:
+        results = pd.read_csv(path, index_col=0)
+        missing = [name for name in lever_names if name not in results.columns]
+        if missing:
+            raise ValueError(
+                f"{path} lacks {len(missing)} of the {len(lever_names)} levers "
+                f"of the model (e.g. {missing[0]}), it was optimized with a "
+                f"different policy structure"
+            )
+        frames.append(results[lever_names])
+
+    levers = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+    lower = [lever.lower_bound for lever in em_model.levers]
+    upper = [lever.upper_bound for lever in em_model.levers]
+
+    return levers.clip(lower, upper, axis=1)
+
+
+def diverse_subsample(levers, size):
+    """Greedy farthest-point subsample of the lever vectors: starting from a
+    random vector, the vector farthest from all chosen ones is added until
+    size vectors are chosen. Distances are taken on the levers scaled by
+    their range in the data.
+    """
+
+    if size >= len(levers):
+        return levers
+
+    values = levers.to_numpy(dtype=float)
+    span = np.ptp(values, axis=0)
+    scaled = (values - values.min(axis=0)) / np.where(span > 0, span, 1)
+
+    chosen = [random.randrange(len(values))]
+    distances = np.linalg.norm(scaled - scaled[chosen[0]], axis=1)
+    while len(chosen) < size:
+        index = int(np.argmax(distances))
+        chosen.append(index)
+        distances = np.minimum(
+            distances, np.linalg.norm(scaled - scaled[index], axis=1)
+        )
+
+    return levers.iloc[chosen]
+
+
+def warm_start_population(
+    problem, em_model, paths, size=50, perturbation=0.0, subsample=True
+):
+    """Initial population generator seeded with the levers of prior results.
+    The rest of the population is completed with random solutions. By
+    default only half of a population of 100 is seeded, so that seeds
+    warm started from the same prior solutions still start from
+    different populations.
+
+    Parameters
+    ----------
+    problem : platypus Problem
+        Problem of the optimization (see to_problem)
+    em_model : ema_workbench Model
+    paths : list
+        Results files to take the levers from
+    size : int
+        Maximum number of seeded solutions. Seeding the whole population
+        starts every seed from the same solutions when there are no more
+        prior solutions than the population size and no perturbation
+    perturbation : float
+        Standard deviation of a Gaussian perturbation of every lever,
+        relative to the range of the lever. The perturbed levers are
+        clipped to their bounds
+    subsample : bool
+        Whether more prior solutions than size are subsampled for
+        diversity (see diverse_subsample) or the first size are taken
+
+    Returns
+    -------
+    generator : platypus InjectedPopulation
+    solution_count : int
+        Number of seeded solutions
+    """
+
+    if perturbation < 0:
+        raise ValueError("perturbation must not be negative")
+
+    levers = load_prior_levers(paths, em_model)
+    levers = diverse_subsample(levers, size) if subsample else levers.iloc[:size]
+
+    positions = [problem.parameter_names.index(name) for name in levers.columns]
+    solutions = list()
+    for values in levers.itertuples(index=False):
+        variables = [None] * problem.nvars
+        for position, lever, value in zip(positions, em_model.levers, values):
+            if perturbation > 0:
+                span = lever.upper_bound - lever.lower_bound
+                value = value + random.gauss(0, perturbation * span)
+                value = min(max(value, lever.lower_bound), lever.upper_bound)
+            variables[position] = problem.types[position].encode(value)
+
+        solution = Solution(problem)
+        solution.variables = variables
+        solutions.append(solution)
+
+    return InjectedPopulation(solutions), len(solutions)
@@ -22,5 +22,83 @@ if __name__ == '__main__':
         description = os.environ.get("DESCRIPTION")
         principle = os.environ.get("PRINCIPLE")
 
-    # call the baseline optimization function 'run()' with the provided experiment input
-    baseline_optimization.run(nfe, epsilon_list, convergence_freq, description, principle)
+    # A SLURM array runs every seed as a shard (SEED=$SLURM_ARRAY_TASK_ID) and a
+    # dependent job merges the shards (MERGE_SEEDS="0 1 2 3 4")
+    seed = os.environ.get("SEED")
+    merge_seeds = os.environ.get("MERGE_SEEDS")
+    # Optional NFE between checkpoints, resubmitting the job then resumes the run
+    checkpoint_freq = os.environ.get("CHECKPOINT_FREQ")
+    if checkpoint_freq is not None:
+        checkpoint_freq = int(checkpoint_freq)
+    # STEADY_STATE=1 runs the seeds as asynchronous steady-state islands, which exchange
+    # archive members every MIGRATION_FREQ NFE if it is set
+    steady_state = os.environ.get("STEADY_STATE") == "1"
+    migration_freq = os.environ.get("MIGRATION_FREQ")
+    if migration_freq is not None:
+        migration_freq = int(migration_freq)
+    # WARM_START lists results files whose levers seed the initial populations
+    warm_start = os.environ.get("WARM_START")
+    if warm_start is not None:
+        warm_start = warm_start.split()
+    # WARM_START_SIZE is the maximum number of seeded solutions (default half the population)
+    warm_start_size = int(os.environ.get("WARM_START_SIZE", 50))
+    warm_start_perturbation = float(os.environ.get("WARM_START_PERTURBATION", 0))
+    # SCREENING_INTERVAL and/or SCREENING_HORIZON screen the offspring of the steady-state
+    # islands at a lower fidelity before evaluating the promising ones at full fidelity
+    screening_interval = os.environ.get("SCREENING_INTERVAL")
+    screening_horizon = os.environ.get("SCREENING_HORIZON")
+    screening_fidelity = None
+    if screening_interval is not None or screening_horizon is not None:
+        screening_fidelity = (screening_interval,
+                              None if screening_horizon is None else int(screening_horizon))
+    # SCREENING_COST is the cost of a screening evaluation relative to a full one
+    screening_cost = float(os.environ.get("SCREENING_COST", 1))
+    # INTEGRATION_TOLERANCE merges the reservoir integration sub-steps where the storage
+    # changes smoothly, within this storage error per month relative to the storage range
+    integration_tolerance = os.environ.get("INTEGRATION_TOLERANCE")
+    if integration_tolerance is not None:
+        integration_tolerance = float(integration_tolerance)
+    # ANALYTIC_INTEGRATION=1 integrates the months in which no release bound binds in
+    # closed form
+    analytic_integration = os.environ.get("ANALYTIC_INTEGRATION") == "1"
+    # EARLY_TERMINATION=1 stops the evaluations of steady-state offspring once they are
+    # epsilon dominated by the archive of their island
+    early_termination = os.environ.get("EARLY_TERMINATION") == "1"
+    # SURROGATE=1 pre-screens steady-state offspring with a Gaussian process surrogate,
+    # SURROGATE_KAPPA sets the predicted standard deviations of optimism (default 1)
+    surrogate = os.environ.get("SURROGATE") == "1"
+    surrogate_kappa = float(os.environ.get("SURROGATE_KAPPA", 1.0))
+    # EVALUATION_CACHE names an SQLite file of evaluations shared by the seeds and runs,
+    # whose stored evaluations are read instead of simulated
+    evaluation_cache = os.environ.get("EVALUATION_CACHE")
+
+    if merge_seeds is not None:
+        seeds = [int(seed) for seed in merge_seeds.split()]
+        baseline_optimization.merge_seeds(nfe, epsilon_list, description, principle, seeds)
+    elif seed is not None:
+        baseline_optimization.run(nfe, epsilon_list, convergence_freq, description, principle,
+                                  seeds=[int(seed)], merge=False, checkpoint_freq=checkpoint_freq,
+                                  steady_state=steady_state, warm_start=warm_start,
+                                  warm_start_size=warm_start_size,
+                                  warm_start_perturbation=warm_start_perturbation,
+                                  screening_fidelity=screening_fidelity,
+                                  screening_cost=screening_cost,
+                                  integration_tolerance=integration_tolerance,
+                                  analytic_integration=analytic_integration,
+                                  early_termination=early_termination,
+                                  surrogate=surrogate, surrogate_kappa=surrogate_kappa,
+                                  evaluation_cache=evaluation_cache)
+    else:
+        # call the baseline optimization function 'run()' with the provided experiment input
+        baseline_optimization.run(nfe, epsilon_list, convergence_freq, description, principle,
+                                  checkpoint_freq=checkpoint_freq, steady_state=steady_state,
+                                  migration_freq=migration_freq, warm_start=warm_start,
+                                  warm_start_size=warm_start_size,
+                                  warm_start_perturbation=warm_start_perturbation,
+                                  screening_fidelity=screening_fidelity,
+                                  screening_cost=screening_cost,
+                                  integration_tolerance=integration_tolerance,
+                                  analytic_integration=analytic_integration,
+                                  early_termination=early_termination,
+                                  surrogate=surrogate, surrogate_kappa=surrogate_kappa,
+                                  evaluation_cache=evaluation_cache)
@@ -2,3 +2,5 @@ from . import model_nile
 from . import model_nile_scenario
 from . import smash
 from . import model_classes
+from . import shared_inputs
+from . import principles
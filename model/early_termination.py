@@ -0,0 +1,204 @@
+"""
+Early termination of simulations whose outcomes are decided before the end
+of the horizon. The outcomes of the Nile model accumulate over the months
+(deficit sums and percentiles, the HAD low-level count, the hydropower
+production), so the simulated months bound them from both sides: the
+remaining months can do no better than meeting every demand and hydropower
+target and no worse than missing all of them. Every check_interval months
+the simulation computes the outcomes of the best and the worst case and
+stops once its termination criterion is decided for any outcomes between
+them, e.g. once a policy cannot enter an epsilon archive or once the class
+of every outcome with respect to its thresholds is known.
+
+A truncated simulation is flagged by the truncated attribute of the model.
+Its outcomes are those of the best case, i.e. the optimistic bounds, and
+saved_seconds estimates the time the remaining months would have taken.
+Outcomes that are not monotone in the months (NaN in bounded_outcomes of
+the model) never decide a criterion.
+
+Early termination is opt-in. The deficits build up month by month, so the
+bounds tighten late in the horizon, and on the current problem the checks
+cost more time than the truncated months save (see
+fidelity.early_termination_benchmark).
+"""
+
+# Importing libraries for functionality
+import time
+
+import numpy as np
+
+
+class DominanceTermination:
+    """
+    Stops a simulation once its outcomes cannot enter an epsilon archive:
+    the epsilon box of the objectives of the best case is dominated by the
+    box of an archive member. The true outcomes are at best those of the
+    best case, so their box is dominated as well.
+
+    Parameters
+    ----------
+    archive : np.array (members x objectives)
+        Objective values of the archive members
+    epsilons : list
+        Epsilon of every objective
+    maximize : list
+        Whether each objective is maximized
+    columns : list, optional
+        Column of every objective in the outcomes of the model, all
+        outcomes in order if None
+    """
+
+    # Only the best case bounds the objectives towards the archive
+    uses_worst_case = False
+
+    def __init__(self, archive, epsilons, maximize, columns=None):
+        self.sign = np.where(maximize, -1.0, 1.0)
+        self.epsilons = np.asarray(epsilons, dtype=float)
+        self.maximize = np.asarray(maximize, dtype=bool)
+        self.columns = columns
+        archive = np.asarray(archive, dtype=float).reshape(-1, len(self.sign))
+        self.archive_boxes = np.floor(self.sign * archive / self.epsilons)
+
+    def decided(self, best, worst=None):
+        """Whether each lane (row of the outcomes of the best case) is
+        dominated
+        """
+        if self.columns is not None:
+            best = best[:, self.columns]
+        boxes = np.floor(self.sign * best / self.epsilons)[:, None, :]
+
+        dominating = np.all(self.archive_boxes <= boxes, axis=-1) & np.any(
+            self.archive_boxes < boxes, axis=-1
+        )
+        return np.any(dominating, axis=-1)
+
+
+class ThresholdTermination:
+    """
+    Stops a simulation once every outcome is known to be above or below
+    each of its thresholds, e.g. the 20th and 80th percentiles of the
+    bigger80/smaller20 splits of the scenario analysis.
+
+    Parameters
+    ----------
+    thresholds : list
+        Thresholds of every outcome of the model, in order. An empty list
+        leaves an outcome undecided without holding up the termination
+    """
+
+    uses_worst_case = True
+
+    def __init__(self, thresholds):
+        self.thresholds = [
+            np.atleast_1d(np.asarray(values, dtype=float)) for values in thresholds
+        ]
+
+    @classmethod
+    def from_quantiles(cls, outcomes, quantiles=(0.2, 0.8)):
+        """Thresholds at the quantiles of earlier outcomes
+
+        Parameters
+        ----------
+        outcomes : np.array (experiments x outcomes)
+            Outcomes of e.g. a pilot or earlier run of the experiments
+        quantiles : tuple
+            Quantiles of every outcome used as thresholds
+        """
+        return cls(np.quantile(outcomes, quantiles, axis=0).T)
+
+    def decided(self, best, worst):
+        """Whether each lane (row of the outcomes of the best and the worst
+        case) is on a known side of every threshold, or its outcome is
+        known exactly
+        """
+        lower, upper = np.fmin(best, worst), np.fmax(best, worst)
+        decided = np.ones(len(lower), dtype=bool)
+        for i, values in enumerate(self.thresholds):
+            for threshold in values:
+                decided &= (
+                    (lower[:, i] > threshold)
+                    | (upper[:, i] < threshold)
+                    | (lower[:, i] == upper[:, i])
+                )
+        return decided
+
+
+def reset_truncation(nile_model):
+    """Marks the next simulation of the model as complete until it stops"""
+    nile_model.truncated = False
+    nile_model.simulated_months = nile_model.simulation_horizon
+    nile_model.saved_seconds = 0.0
+
+
+def fill_remaining_months(nile_model, months, best):
+    """Fills the accounting vectors of the months after the first months
+    with the best case (every demand met, unbounded releases and levels)
+    or the worst case (nothing received or released, unbounded low levels)
+    """
+
+    for district in nile_model.irr_districts.values():
+        remaining = district.demand[..., months : nile_model.simulation_horizon]
+        district.received_flow[..., months:] = remaining if best else 0.0
+
+    for reservoir in nile_model.reservoirs.values():
+        reservoir.release_vector[..., months:] = np.inf if best else 0.0
+        reservoir.level_vector[..., months:] = np.inf if best else -np.inf
+
+
+def outcome_cases(nile_model, months, worst_case=True):
+    """Outcomes of the best and the worst case of the remaining months
+    after the first months are simulated. The accounting of the model is
+    left at the best case.
+
+    Returns
+    -------
+    best, worst : np.array (lanes x outcomes)
+        The worst case is None unless worst_case is set
+    """
+
+    worst = None
+    if worst_case:
+        fill_remaining_months(nile_model, months, False)
+        nile_model.calculate_accounting()
+        worst = np.atleast_2d(nile_model.bounded_outcomes())
+
+    fill_remaining_months(nile_model, months, True)
+    nile_model.calculate_accounting()
+    best = np.atleast_2d(nile_model.bounded_outcomes())
+
+    return best, worst
+
+
+def terminate_early(nile_model, months, start):
+    """Whether the simulation of the model stops after its first months,
+    checked every termination_interval months. A stopped simulation is
+    flagged as truncated and its accounting holds the best case.
+
+    Parameters
+    ----------
+    nile_model : ModelNile or ModelNileScenario object
+    months : int
+        Number of simulated months
+    start : float
+        time.perf_counter() at the start of the time loop
+    """
+
+    horizon = nile_model.simulation_horizon
+    if months % nile_model.termination_interval or months >= horizon:
+        return False
+
+    criterion = nile_model.early_termination
+    best, worst = outcome_cases(nile_model, months, criterion.uses_worst_case)
+    if not np.all(criterion.decided(best, worst)):
+        return False
+
+    elapsed = time.perf_counter() - start
+    nile_model.truncated = True
+    nile_model.simulated_months = months
+    nile_model.saved_seconds = elapsed * (horizon - months) / months
+
+    # The filling of GERD ends as it would have during the remaining months
+    if months <= nile_model.GERD_filling_time * 12 < horizon:
+        nile_model.reservoirs["GERD"].filling_schedule = None
+
+    return True
@@ -0,0 +1,192 @@
+"""
+Persistent cache of evaluated outcomes in an SQLite file. An evaluation is
+addressed by a hash of its policy parameters, its context (e.g. the
+principle) and a fingerprint of everything the simulation reads: the
+settings file, the data files, the run configuration and the catchment
+inflows and district demands. Evaluations repeated in any process or run
+sharing the file are then read instead of simulated.
+"""
+
+# Importing libraries for functionality
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+# Part of every fingerprint. Bump it when a change of the simulation code
+# changes its outcomes, so that evaluations stored before are not reused
+cache_version = 1
+
+# Fingerprints of settings files and data directories read in this process
+static_fingerprints = dict()
+
+
+def static_fingerprint(
+    settings_path="settings/settings_file_Nile.xlsx", data_directory="data/"
+):
+    """Hash of the contents of the settings file and the data directory,
+    computed once per process
+    """
+
+    key = (settings_path, data_directory)
+    if key not in static_fingerprints:
+        digest = hashlib.sha256(f"version {cache_version}".encode())
+        paths = [settings_path] + [
+            os.path.join(data_directory, name)
+            for name in sorted(os.listdir(data_directory))
+        ]
+        for path in paths:
+            digest.update(os.path.basename(path).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        static_fingerprints[key] = digest.hexdigest()
+
+    return static_fingerprints[key]
+
+
+def input_fingerprint(nile_model, inflows=None, demands=None):
+    """Hash of the data a simulation of the model reads. The inflows and
+    demands default to those assigned to the catchments and districts.
+
+    Parameters
+    ----------
+    nile_model : ModelNile or ModelNileScenario object
+    inflows : dict, optional
+        Inflow vector of each catchment, by name
+    demands : dict, optional
+        Demand vector of each irrigation district, by name
+    """
+
+    if inflows is None:
+        inflows = {name: x.inflow for name, x in nile_model.catchments.items()}
+    if demands is None:
+        demands = {name: x.demand for name, x in nile_model.irr_districts.items()}
+
+    digest = hashlib.sha256(static_fingerprint().encode())
+    digest.update(
+        repr(
+            (
+                type(nile_model).__name__,
+                nile_model.simulation_horizon,
+                nile_model.init_month,
+                nile_model.integration_interval,
+                nile_model.integration_tolerance,
+                nile_model.analytic_integration,
+                nile_model.GERD_filling_time,
+            )
+        ).encode()
+    )
+    for vectors in (inflows, demands):
+        for name in sorted(vectors):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(vectors[name], dtype=float).tobytes())
+
+    return digest.hexdigest()
+
+
+class EvaluationCache:
+    """
+    Outcome vectors of evaluations stored in an SQLite file, by key. The
+    file can be shared by processes, which each open their own connection
+    on first use.
+
+    Attributes
+    ----------
+    path : str
+        SQLite file of the cache
+    hits : int
+        Evaluations read from the cache by this process
+    misses : int
+        Evaluations not found in the cache by this process
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+    def __getstate__(self):
+        # Connections cannot be pickled, every process opens its own
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS evaluations "
+                "(key TEXT PRIMARY KEY, outcomes BLOB)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def key(parameter_vector, *context):
+        """Hash of the policy parameters and the context of an evaluation
+        (e.g. principle and input fingerprint)
+        """
+        digest = hashlib.sha256(
+            np.ascontiguousarray(parameter_vector, dtype=float).tobytes()
+        )
+        digest.update(repr(context).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Stored outcomes of the key, or None if it was not evaluated"""
+        row = self.connection.execute(
+            "SELECT outcomes FROM evaluations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return np.frombuffer(row[0], dtype=float).copy()
+
+    def put(self, key, outcomes):
+        self.put_many([(key, outcomes)])
+
+    def put_many(self, items):
+        """Stores the outcomes of many (key, outcomes) pairs at once"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO evaluations VALUES (?, ?)",
+                [
+                    (key, np.asarray(outcomes, dtype=float).tobytes())
+                    for key, outcomes in items
+                ],
+            )
+
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def statistics(self):
+        """Hits, misses and hit rate of this process and the number of
+        evaluations stored in the file
+        """
+        (entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM evaluations"
+        ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "entries": entries,
+        }
+
+
+def describe_statistics(path, statistics):
+    """One line summary of the statistics of the cache file at path (see
+    EvaluationCache.statistics) for logs and time counter files
+    """
+    return (
+        f"evaluation cache {path}: {statistics['hits']} hits, "
+        f"{statistics['misses']} misses (hit rate {statistics['hit_rate']:.1%}), "
+        f"{statistics['entries']} stored evaluations"
+    )
@@ -1,11 +1,34 @@
+import math
 import os
+from bisect import bisect_right
+
 import numpy as np
 from scipy.constants import g
 
+from model.shared_inputs import SharedArrayState
+
 data_directory = "data/"
 
 
-class Catchment:
+def allocate_monthly_vector(shape, recorded=True):
+    """Zero vector with time as the last axis. A vector that is not
+    recorded keeps a single slot which every month of the horizon refers
+    to. The simulation can still index it by month, but only the value
+    of the latest month is kept.
+    """
+    if recorded:
+        return np.zeros(shape)
+
+    slot = np.zeros(shape[:-1] + (1,))
+    return np.lib.stride_tricks.as_strided(
+        slot, shape=shape, strides=slot.strides[:-1] + (0,)
+    )
+
+
+class Catchment(SharedArrayState):
+    # Read-only input arrays that can be placed in shared memory
+    input_names = ["inflow"]
+
     def __init__(self, name):
         # Explanation placeholder
         self.name = name
@@ -29,14 +52,15 @@ class HydropowerPlant:
     ):
 
         if self.release_share is not None:
-            actual_release *= self.release_share
+            actual_release = actual_release * self.release_share
 
         m3_to_kg_factor = 1000
         hours_in_a_day = 24
         W_MW_conversion = 1e-6
-        turbine_flow = min(actual_release, self.max_turbine_flow)
-        head = max(0, reservoir_level - self.head_start_level)
-        power_in_MW = min(
+        # numpy minimum/maximum so that batches of lanes are handled too
+        turbine_flow = np.minimum(actual_release, self.max_turbine_flow)
+        head = np.maximum(0, reservoir_level - self.head_start_level)
+        power_in_MW = np.minimum(
             self.max_capacity,
             turbine_flow
             * head
@@ -53,7 +77,7 @@ class HydropowerPlant:
         return hydropower_production, target_production
 
 
-class IrrigationDistrict:
+class IrrigationDistrict(SharedArrayState):
     """
     A class used to represent districts that demand irrigation
 
@@ -69,9 +93,20 @@ class IrrigationDistrict:
 
     Methods
     -------
-
+    allocate_buffers(simulation_horizon=int, batch_size=int, recorded=set)
+        Allocates the monthly vectors for the whole simulation horizon
+    reset_buffers()
+        Zero-fills the monthly vectors
+    calculate_deficits(simulation_horizon=int)
+        Calculates the monthly deficits and targets after a simulation
     """
 
+    # Monthly vectors written by the simulation, one value per month
+    buffer_names = ["received_flow", "received_flow_raw"]
+
+    # Read-only input arrays that can be placed in shared memory
+    input_names = ["demand"]
+
     def __init__(self, name):
         # Explanation placeholder
         self.name = name
@@ -83,8 +118,40 @@ class IrrigationDistrict:
         self.normalised_deficit = np.empty(0)
         self.target = np.empty(0)
 
+    def allocate_buffers(self, simulation_horizon, batch_size=None, recorded=None):
+        """Allocates the monthly vectors of the district once for the
+        whole simulation horizon. The simulation writes into them by
+        time index instead of growing them every month. With a
+        batch_size, the vectors get a leading axis with one row per
+        simultaneously simulated lane. Only the vectors named in
+        recorded (all if None) keep every month.
+        """
+        shape = (simulation_horizon,)
+        if batch_size is not None:
+            shape = (batch_size,) + shape
+        for var in self.buffer_names:
+            setattr(
+                self,
+                var,
+                allocate_monthly_vector(shape, recorded is None or var in recorded),
+            )
+
+    def reset_buffers(self):
+        """Zero-fills the monthly vectors in place"""
+        for var in self.buffer_names:
+            getattr(self, var).fill(0)
+
+    def calculate_deficits(self, simulation_horizon):
+        """Calculates the deficit (demand not met by the received flow)
+        and the target (demand) of every simulated month in one pass
+        after the simulation.
+        """
+        demand = self.demand[..., :simulation_horizon]
+        self.deficit = np.maximum(0, demand - self.received_flow)
+        self.target = np.broadcast_to(demand, self.received_flow.shape).copy()
 
-class Reservoir:
+
+class Reservoir(SharedArrayState):
     """
     A class used to represent reservoirs of the problem
 
@@ -123,6 +190,16 @@ class Reservoir:
         m3/s
         A vector that holds the release decisions from the reservoir
         throughout the simulation horizon
+    substep_vector : np.array (1xH)
+        Number of integration sub-steps (closed-form pieces with the
+        analytic integration) taken in every month
+    integration_tolerance : float
+        Storage error per month allowed to the adaptive integration,
+        relative to the storage range of the reservoir. Fixed sub-steps
+        if None
+    analytic_integration : bool
+        Whether months in which no release bound binds are integrated
+        in closed form
     hydropower_plants : list
         A list that holds the hydropower plant objects belonging to the
         reservoir
@@ -132,16 +209,74 @@ class Reservoir:
 
     Methods
     -------
+    allocate_buffers(simulation_horizon=int, integration_interval=str,
+                     batch_size=int, recorded=set)
+        Allocates the state vectors for the whole simulation horizon
+    reset_buffers()
+        Zero-fills the state vectors, keeping the initial storage
     storage_to_level(h=float)
         Returns the level(height) based on volume
     level_to_storage(s=float)
         Returns the volume based on level(height)
     level_to_surface(h=float)
         Returns the surface area based on level
-    integration()
-        FILL IN LATER!!!!
+    compile_lookup_tables()
+        Composes the level, surface and release bound relations into
+        lookup tables over storage
+    storage_lookup(s=float)
+        Returns level, surface and (min, max) release for a storage
+        from the lookup tables
+    integration(t=int, ...)
+        Integrates the flows of month t into storage and writes the
+        resulting states into the state vectors at index t
+    integration_batch(t=int, ...)
+        Same as integration for all lanes of batch-allocated vectors
+    integration_adaptive(t=int, ...)
+        Integration with sub-steps chosen from a local error estimate
+    integration_adaptive_batch(t=int, ...)
+        Same as integration_adaptive for all lanes of batch-allocated
+        vectors
+    integration_analytic(t=int, ...)
+        Integration in closed form for months in which no release bound
+        binds
+    integration_analytic_batch(t=int, ...)
+        Same as integration_analytic for all lanes of batch-allocated
+        vectors
+    calculate_hydropower(nu_of_days=np.array)
+        Calculates the monthly hydropower production, target and deficit
+        after a simulation
     """
 
+    # Monthly state vectors with one value per simulated month. The
+    # storage vector is one longer as it also holds the initial storage.
+    buffer_names = [
+        "level_vector",
+        "inflow_vector",
+        "release_vector",
+        "total_evap",
+        "substep_vector",
+    ]
+
+    # Read-only relations, lookup tables and targets that can be placed in
+    # shared memory
+    input_names = [
+        "evap_rates",
+        "rating_curve",
+        "storage_rating_curve",
+        "level_to_storage_rel",
+        "level_to_surface_rel",
+        "storage_to_surface_rel",
+        "lookup_breaks",
+        "lookup_coefficients",
+        "lookup_bucket_segments",
+        "target_hydropower_production",
+    ]
+
+    # Maximum relative error of the compiled lookup tables and the upper
+    # limit on the number of buckets of the uniform storage grid
+    lookup_tolerance = 1e-9
+    lookup_max_bucket_count = 2**16
+
     def __init__(self, name):
         # Explanation placeholder
         self.name = name
@@ -164,6 +299,7 @@ class Reservoir:
         fh = os.path.join(data_directory, f"stosur_rel_{name}.txt")
         self.storage_to_surface_rel = np.loadtxt(fh)
 
+        self.initial_storage = 0  # To be set in the model main file
         self.average_cross_section = None  # To be set in the model main file
         self.target_hydropower_production = None  # To be set if obj exists
         self.storage_vector = np.empty(0)
@@ -177,26 +313,89 @@ class Reservoir:
         self.total_evap = np.empty(0)
         self.deficit = np.empty(0)
         self.target = np.empty(0)
-        # Basic memorization implementation
-        # self.level_to_surface_memo = dict()
-        # self.storage_to_level_memo = dict()
-        # self.level_to_minmax_memo = dict()
+        self.in_month_releases = np.empty(0)
+        self.substep_vector = np.empty(0)
+        self.integration_tolerance = None  # Fixed sub-steps unless set
+        self.adaptive_block = 1
+        self.analytic_integration = False  # Sub-steps in every month unless set
         # self.constraint_check = list()
 
+        # Storage based lookup tables replacing the interpolations of the
+        # integration sub-steps
+        self.compile_lookup_tables()
+
+    def allocate_buffers(
+        self, simulation_horizon, integration_interval, batch_size=None, recorded=None
+    ):
+        """Allocates the state vectors once for the whole simulation
+        horizon (and the sub-step releases for the longest month) so
+        that integration writes into them by index. With a batch_size,
+        the vectors get a leading axis with one row per simultaneously
+        simulated lane. Only the vectors named in recorded (all if None)
+        keep every month. The storage vectors start from initial_storage.
+        """
+        shape = (simulation_horizon,)
+        if batch_size is not None:
+            shape = (batch_size,) + shape
+        self.storage_vector = allocate_monthly_vector(
+            shape[:-1] + (simulation_horizon + 1,),
+            recorded is None or "storage_vector" in recorded,
+        )
+        self.storage_vector[..., 0] = self.initial_storage
+
+        for var in self.buffer_names:
+            setattr(
+                self,
+                var,
+                allocate_monthly_vector(shape, recorded is None or var in recorded),
+            )
+
+        max_substeps = max(
+            self.substep_count(nu_of_days, integration_interval)
+            for nu_of_days in range(28, 32)
+        )
+        self.in_month_releases = np.zeros(shape[:-1] + (max_substeps,))
+
+    def reset_buffers(self):
+        """Zero-fills the state vectors in place, leaving only the
+        initial value in the storage vector
+        """
+        self.storage_vector[..., 1:] = 0
+        self.storage_vector[..., 0] = self.initial_storage
+        for var in self.buffer_names:
+            getattr(self, var).fill(0)
+        self.in_month_releases.fill(0)
+
+    @staticmethod
+    def integration_step(nu_of_days, integration_interval):
+        """Returns the total seconds of the month and the size of one
+        integration sub-step in seconds
+        """
+        total_seconds = 3600 * 24 * nu_of_days
+
+        integration_step_possibilities = {
+            "once-a-month": total_seconds,
+            "weekly": total_seconds / 4,
+            "daily": total_seconds / nu_of_days,
+            "12-hours": total_seconds / (nu_of_days * 2),
+            "6-hours": total_seconds / (nu_of_days * 4),
+            "hourly": total_seconds / (nu_of_days * 24),
+            "half-an-hour": total_seconds / (nu_of_days * 48),
+        }
+        return total_seconds, integration_step_possibilities[integration_interval]
+
+    @classmethod
+    def substep_count(cls, nu_of_days, integration_interval):
+        total_seconds, integ_step = cls.integration_step(
+            nu_of_days, integration_interval
+        )
+        return np.arange(0, total_seconds, integ_step).size
+
     def read_hydropower_target(self):
 
         fh = os.path.join(data_directory, f"{self.name}prod.txt")
         self.target_hydropower_production = np.loadtxt(fh)
 
-    # def storage_to_level(self, s):
-    #     rounded_s = s - (s % 1000)
-    #     if rounded_s not in self.storage_to_level_memo:
-    #         self.storage_to_level_memo[rounded_s] = np.interp(
-    #             rounded_s, self.level_to_storage_rel[1], self.level_to_storage_rel[0]
-    #         )
-
-    #     return self.storage_to_level_memo[rounded_s]
-
     def storage_to_level(self, s):
         return np.interp(s, self.level_to_storage_rel[1], self.level_to_storage_rel[0])
 
@@ -209,15 +408,6 @@ class Reservoir:
             s = h * self.average_cross_section
         return s
 
-    # def level_to_surface(self, h):
-    #     rounded_h = round(h, 2)
-    #     if rounded_h not in self.level_to_surface_memo:
-    #         self.level_to_surface_memo[rounded_h] = np.interp(
-    #             rounded_h, self.level_to_surface_rel[0], self.level_to_surface_rel[1]
-    #         )
-
-    #     return self.level_to_surface_memo[rounded_h]
-
     def level_to_surface(self, h):
         return np.interp(h, self.level_to_surface_rel[0], self.level_to_surface_rel[1])
 
@@ -226,16 +416,6 @@ class Reservoir:
             s, self.storage_to_surface_rel[0], self.storage_to_surface_rel[1]
         )
 
-    # def level_to_minmax(self, h):
-    #     rounded_h = round(h, 2)
-    #     if rounded_h not in self.level_to_minmax_memo:
-    #         self.level_to_minmax_memo[rounded_h] = (
-    #             np.interp(rounded_h, self.rating_curve[0], self.rating_curve[1]),
-    #             np.interp(rounded_h, self.rating_curve[0], self.rating_curve[2]),
-    #         )
-
-    #     return self.level_to_minmax_memo[rounded_h]
-
     def level_to_minmax(self, h):
         return (
             np.interp(h, self.rating_curve[0], self.rating_curve[1]),
@@ -248,13 +428,207 @@ class Reservoir:
             np.interp(s, self.storage_rating_curve[0], self.storage_rating_curve[2]),
         )
 
+    def compile_lookup_tables(self):
+        """Compiles the storage to level, level to surface and level to
+        (min, max) release relations into one table over storage. The
+        composed relations are piecewise linear with breakpoints at the
+        storages where any of the underlying relations has a breakpoint.
+        Per segment of the composed relations, the node and slope of the
+        original relation segment are stored, so that linear blending
+        repeats the arithmetic of np.interp.
+
+        A uniform grid of buckets over the storage range maps a storage
+        to its segment with index arithmetic only. The bucket width is
+        chosen below the smallest segment length, so at most one
+        breakpoint falls inside a bucket. The tables are checked against
+        the original relations and a ValueError is raised when the error
+        exceeds lookup_tolerance (relative to the range of each relation).
+        """
+        levels, storages = self.level_to_storage_rel
+        start, end = storages[0], storages[-1]
+
+        breakpoint_levels = np.concatenate(
+            [levels, self.level_to_surface_rel[0], self.rating_curve[0]]
+        )
+        breaks = np.unique(
+            np.clip(self.level_to_storage(breakpoint_levels), start, end)
+        )
+        midpoints = (breaks[:-1] + breaks[1:]) / 2
+        mid_levels = self.storage_to_level(midpoints)
+
+        # Node, value and slope of the original relation segments for
+        # every segment of the composed relations
+        relations = [
+            (storages, levels, midpoints),
+            (*self.level_to_surface_rel, mid_levels),
+            (self.rating_curve[0], self.rating_curve[1], mid_levels),
+            (self.rating_curve[0], self.rating_curve[2], mid_levels),
+        ]
+        coefficients = np.empty((3, 4, midpoints.size))
+        for k, (xp, fp, x) in enumerate(relations):
+            segment = np.searchsorted(xp, x, side="right") - 1
+            inside = (segment >= 0) & (segment < xp.size - 1)
+            segment = np.clip(segment, 0, xp.size - 2)
+            slope = (fp[segment + 1] - fp[segment]) / (xp[segment + 1] - xp[segment])
+            # Outside of the relation np.interp holds the end values
+            coefficients[0, k] = np.where(inside, xp[segment], 0)
+            coefficients[1, k] = np.where(
+                inside, fp[segment], np.where(x < xp[0], fp[0], fp[-1])
+            )
+            coefficients[2, k] = np.where(inside, slope, 0)
+
+        bucket_count = int(
+            min(
+                self.lookup_max_bucket_count,
+                2 ** np.ceil(np.log2((end - start) / np.diff(breaks).min())),
+            )
+        )
+        bucket_edges = start + np.arange(bucket_count) * (
+            (end - start) / bucket_count
+        )
+        bucket_segments = np.clip(
+            np.searchsorted(breaks, bucket_edges, side="right") - 1,
+            0,
+            midpoints.size - 1,
+        )
+
+        self.lookup_start = start
+        self.lookup_end = end
+        self.lookup_inv_width = bucket_count / (end - start)
+        self.lookup_breaks = breaks
+        self.lookup_coefficients = coefficients
+        self.lookup_bucket_segments = bucket_segments
+        self.lookup_bounds = (
+            self._compose_relations(start),
+            self._compose_relations(end),
+        )
+
+        # Gain and offset over storage of the surface and the minimum and
+        # maximum release in every region between breakpoints, preceded and
+        # followed by the constant regions outside of the relation, and the
+        # storage edges of the regions (see integration_analytic)
+        level_gain = coefficients[2, 0]
+        level_offset = coefficients[1, 0] - coefficients[2, 0] * coefficients[0, 0]
+        gains = coefficients[2, 1:] * level_gain
+        offsets = coefficients[2, 1:] * (level_offset - coefficients[0, 1:]) + (
+            coefficients[1, 1:]
+        )
+        outside = [np.array(bound[1:])[:, None] for bound in self.lookup_bounds]
+        self.lookup_linear = (
+            np.stack(
+                [
+                    np.hstack([np.zeros((3, 1)), gains, np.zeros((3, 1))]),
+                    np.hstack([outside[0], offsets, outside[1]]),
+                ]
+            ),
+            np.stack(
+                [
+                    np.concatenate([[-np.inf], breaks]),
+                    np.concatenate([breaks, [np.inf]]),
+                ]
+            ),
+        )
+
+        # Python lists of the same tables for the scalar sub-step lookups
+        self._lookup_scalar = (
+            breaks.tolist(),
+            [[row.tolist() for row in table] for table in coefficients],
+            bucket_segments.tolist(),
+        )
+        linear, edges = self.lookup_linear
+        self._lookup_linear_scalar = (
+            [[row.tolist() for row in table] for table in linear],
+            edges.tolist(),
+        )
+
+        # Error bound against the original relations at the breakpoints,
+        # quarter points and midpoints of every segment
+        check_points = np.concatenate(
+            [breaks[:-1] + fraction * np.diff(breaks) for fraction in (0, 0.25, 0.5)]
+            + [breaks[-1:]]
+        )
+        exact = np.vstack(self._compose_relations(check_points))
+        lookup = np.vstack(self.storage_lookup_vector(check_points))
+        value_range = np.ptp(exact, axis=1)
+        self.lookup_error = np.abs(lookup - exact).max(axis=1)
+        if np.any(self.lookup_error > self.lookup_tolerance * value_range):
+            raise ValueError(
+                f"Lookup tables of {self.name} exceed the tolerance: "
+                f"{self.lookup_error} for ranges {value_range}"
+            )
+
+    def _compose_relations(self, s):
+        level = self.storage_to_level(s)
+        min_release, max_release = self.level_to_minmax(level)
+        return level, self.level_to_surface(level), min_release, max_release
+
+    def storage_lookup(self, s):
+        """Returns the level, surface, minimum release and maximum release
+        for the storage s from the compiled lookup tables. Storages
+        outside of the relation are clamped as with np.interp.
+        """
+        if s <= self.lookup_start:
+            return self.lookup_bounds[0]
+        if s >= self.lookup_end:
+            return self.lookup_bounds[1]
+
+        breaks, (x0, y0, slope), bucket_segments = self._lookup_scalar
+        segment = bucket_segments[
+            min(
+                int((s - self.lookup_start) * self.lookup_inv_width),
+                len(bucket_segments) - 1,
+            )
+        ]
+        if s >= breaks[segment + 1]:
+            segment += 1
+
+        level = slope[0][segment] * (s - x0[0][segment]) + y0[0][segment]
+        return (
+            level,
+            slope[1][segment] * (level - x0[1][segment]) + y0[1][segment],
+            slope[2][segment] * (level - x0[2][segment]) + y0[2][segment],
+            slope[3][segment] * (level - x0[3][segment]) + y0[3][segment],
+        )
+
+    def storage_lookup_vector(self, s):
+        """Array version of storage_lookup performing the same arithmetic
+        element-wise, so both give identical results
+        """
+        s = np.asarray(s, dtype=float)
+        inside = np.clip(s, self.lookup_start, self.lookup_end)
+        segment = self.lookup_bucket_segments[
+            np.minimum(
+                ((inside - self.lookup_start) * self.lookup_inv_width).astype(int),
+                self.lookup_bucket_segments.size - 1,
+            )
+        ]
+        segment = np.minimum(
+            segment + (inside >= self.lookup_breaks[segment + 1]),
+            self.lookup_breaks.size - 2,
+        )
+        x0, y0, slope = self.lookup_coefficients[:, :, segment]
+
+        level = slope[0] * (inside - x0[0]) + y0[0]
+        values = [level] + [slope[k] * (level - x0[k]) + y0[k] for k in (1, 2, 3)]
+
+        return tuple(
+            np.where(
+                s <= self.lookup_start,
+                self.lookup_bounds[0][k],
+                np.where(s >= self.lookup_end, self.lookup_bounds[1][k], value),
+            )
+            for k, value in enumerate(values)
+        )
+
     def integration(
         self,
+        t,
         nu_of_days,
         policy_release_decision,
         net_secondly_inflow,
         current_month,
         integration_interval,
+        fixed_steps=False,
     ):
         """Converts the flows of the reservoir into storage. Time step
         fidelity can be adjusted within a for loop. The core idea is to
@@ -262,27 +636,44 @@ class Reservoir:
 
         Parameters
         ----------
+        t : int
+            Index of the simulated month. The storage at t is read and
+            the states at the end of the month are written at t (t+1
+            for the storage vector)
+        fixed_steps : bool
+            Whether every sub-step of integration_interval is integrated,
+            ignoring analytic_integration and integration_tolerance
 
         Returns
         -------
         """
 
-        total_seconds = 3600 * 24 * nu_of_days
+        if not fixed_steps and self.analytic_integration:
+            return self.integration_analytic(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+            )
+        if not fixed_steps and self.integration_tolerance is not None:
+            return self.integration_adaptive(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+            )
 
-        integration_step_possibilities = {
-            "once-a-month": total_seconds,
-            "weekly": total_seconds / 4,
-            "daily": total_seconds / nu_of_days,
-            "12-hours": total_seconds / (nu_of_days * 2),
-            "6-hours": total_seconds / (nu_of_days * 4),
-            "hourly": total_seconds / (nu_of_days * 24),
-            "half-an-hour": total_seconds / (nu_of_days * 48),
-        }
-        integ_step = integration_step_possibilities[integration_interval]
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
 
-        self.inflow_vector = np.append(self.inflow_vector, net_secondly_inflow)
-        current_storage = self.storage_vector[-1]
-        in_month_releases = np.empty(0)
+        self.inflow_vector[t] = net_secondly_inflow
+        current_storage = self.storage_vector[t]
+        in_month_releases = self.in_month_releases
 
         if self.filling_schedule is not None:
             releasable_excess = max(
@@ -293,9 +684,13 @@ class Reservoir:
 
         monthly_evap_total = 0
 
-        for _ in np.arange(0, total_seconds, integ_step):
-            level = self.storage_to_level(current_storage)
-            surface = self.level_to_surface(level)
+        for step, _ in enumerate(np.arange(0, total_seconds, integ_step)):
+            (
+                level,
+                surface,
+                min_possible_release,
+                max_possible_release,
+            ) = self.storage_lookup(current_storage)
 
             evaporation = surface * (
                 self.evap_rates[current_month - 1]
@@ -303,8 +698,6 @@ class Reservoir:
             )
             monthly_evap_total += evaporation
 
-            min_possible_release, max_possible_release = self.level_to_minmax(level)
-
             max_possible_release = min(max_possible_release, releasable_excess)
 
             secondly_release = min(
@@ -316,7 +709,7 @@ class Reservoir:
             #     self.constraint_check.append(("Hit UB", secondly_release, level))
             # else:
             #     self.constraint_check.append("Smooth release")
-            in_month_releases = np.append(in_month_releases, secondly_release)
+            in_month_releases[step] = secondly_release
 
             total_addition = net_secondly_inflow * integ_step
 
@@ -324,14 +717,747 @@ class Reservoir:
                 total_addition - evaporation - secondly_release * integ_step
             )
 
-        self.storage_vector = np.append(self.storage_vector, current_storage)
+        self.storage_vector[t + 1] = current_storage
 
-        avg_monthly_release = np.mean(in_month_releases)
-        self.release_vector = np.append(self.release_vector, avg_monthly_release)
+        avg_monthly_release = np.mean(in_month_releases[: step + 1])
+        self.release_vector[t] = avg_monthly_release
 
-        self.total_evap = np.append(self.total_evap, monthly_evap_total)
+        self.total_evap[t] = monthly_evap_total
+        self.substep_vector[t] = step + 1
 
         # Record level  based on storage for time t:
-        self.level_vector = np.append(
-            self.level_vector, self.storage_to_level(self.storage_vector[-1])
+        self.level_vector[t] = self.storage_lookup(current_storage)[0]
+
+    def integration_batch(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+        fixed_steps=False,
+    ):
+        """Batched version of integration for vectors allocated with a
+        batch_size. Release decisions and inflows are arrays with one
+        value per lane (inflows may also be a scalar shared by all
+        lanes). The arithmetic is the same as in integration, element
+        by element, so every lane reproduces the scalar result.
+        """
+
+        if not fixed_steps and self.analytic_integration:
+            return self.integration_analytic_batch(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+            )
+        if not fixed_steps and self.integration_tolerance is not None:
+            return self.integration_adaptive_batch(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+            )
+
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
+
+        self.inflow_vector[:, t] = net_secondly_inflow
+        current_storage = self.storage_vector[:, t].copy()
+        in_month_releases = self.in_month_releases
+
+        if self.filling_schedule is not None:
+            releasable_excess = np.maximum(
+                0, net_secondly_inflow - self.filling_schedule[current_month - 1]
+            )
+        else:
+            releasable_excess = 1e12  # Big M
+
+        monthly_evap_total = 0
+
+        for step, _ in enumerate(np.arange(0, total_seconds, integ_step)):
+            (
+                level,
+                surface,
+                min_possible_release,
+                max_possible_release,
+            ) = self.storage_lookup_vector(current_storage)
+
+            evaporation = surface * (
+                self.evap_rates[current_month - 1]
+                / (100 * (total_seconds / integ_step))
+            )
+            monthly_evap_total = monthly_evap_total + evaporation
+
+            max_possible_release = np.minimum(max_possible_release, releasable_excess)
+
+            secondly_release = np.minimum(
+                max_possible_release,
+                np.maximum(min_possible_release, policy_release_decision),
+            )
+            in_month_releases[:, step] = secondly_release
+
+            total_addition = net_secondly_inflow * integ_step
+
+            current_storage += (
+                total_addition - evaporation - secondly_release * integ_step
+            )
+
+        self.storage_vector[:, t + 1] = current_storage
+
+        self.release_vector[:, t] = np.mean(in_month_releases[:, : step + 1], axis=1)
+
+        self.total_evap[:, t] = monthly_evap_total
+        self.substep_vector[:, t] = step + 1
+
+        self.level_vector[:, t] = self.storage_lookup_vector(current_storage)[0]
+
+    def integration_adaptive(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+    ):
+        """Integration with sub-steps of adaptive size. The sub-steps of
+        integration_interval are the finest steps, which are merged into
+        blocks integrated at once while the storage changes smoothly.
+
+        A block is integrated with one step and with two half steps. It
+        is halved if it crosses a breakpoint of the lookup tables. The
+        difference of both estimates the error of the block, which must
+        stay below integration_tolerance times the storage range of the
+        reservoir, prorated by the share of the month the block covers,
+        or the block is halved. After an accepted block the next one may
+        be twice as long. The first block of a month is as long as the
+        last block of the previous month (the whole month at t = 0).
+
+        Blocks are only merged while the release is the policy decision.
+        Where a release bound (including the filling schedule) binds, the
+        release depends steeply on the storage and may switch back and
+        forth at every sub-step, which merged blocks cannot follow. The
+        month is then integrated with the fixed sub-steps of integration,
+        giving exactly its result. The other months differ from the fixed
+        sub-steps by up to the tolerance, which carries over to the
+        following months through the storage. The number of sub-steps
+        taken is written to the substep vector.
+        """
+
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
+        step_count = self.substep_count(nu_of_days, integration_interval)
+        evaporation_share = self.evap_rates[current_month - 1] / (
+            100 * (total_seconds / integ_step)
+        )
+        tolerance = (
+            self.integration_tolerance
+            * (self.lookup_end - self.lookup_start)
+            / step_count
+        )
+
+        current_storage = self.storage_vector[t]
+        in_month_releases = self.in_month_releases
+
+        if self.filling_schedule is not None:
+            releasable_excess = max(
+                0, net_secondly_inflow - self.filling_schedule[current_month - 1]
+            )
+        else:
+            releasable_excess = 1e12  # Big M
+
+        total_addition = net_secondly_inflow * integ_step
+        breaks = self._lookup_scalar[0]
+
+        def substep_rates(storage):
+            # Evaporation of one sub-step of integration_interval from
+            # storage, and whether a release bound binds
+            _, surface, min_possible_release, max_possible_release = (
+                self.storage_lookup(storage)
+            )
+            binding = not (
+                min_possible_release
+                <= policy_release_decision
+                <= min(max_possible_release, releasable_excess)
+            )
+            return surface * evaporation_share, binding
+
+        monthly_evap_total = 0
+        substeps = 0
+        step = 0
+        block = step_count if t == 0 else self.adaptive_block
+        evaporation, binding = substep_rates(current_storage)
+        change = total_addition - policy_release_decision * integ_step
+
+        while step < step_count and not binding:
+            block = max(1, min(block, step_count - step))
+            half = block // 2
+
+            mid_storage = current_storage + half * (change - evaporation)
+            mid_evaporation, binding = substep_rates(mid_storage)
+            end_storage = mid_storage + (block - half) * (change - mid_evaporation)
+            end_evaporation, end_binding = substep_rates(end_storage)
+
+            # Within a segment of the lookup tables the release bounds are
+            # linear in storage, so a bound binding at neither end of the
+            # block does not bind in between
+            if half > 0 and bisect_right(breaks, end_storage) != bisect_right(
+                breaks, current_storage
+            ):
+                binding = False
+                block = half
+                continue
+
+            binding = binding or end_binding
+            if binding:
+                break
+
+            error = abs(
+                end_storage - (current_storage + block * (change - evaporation))
+            )
+            if half > 0 and error > tolerance * block:
+                block = half
+                continue
+
+            monthly_evap_total += half * evaporation + (block - half) * mid_evaporation
+            current_storage = end_storage
+            evaporation = end_evaporation
+            step += block
+            substeps += 2 if half > 0 else 1
+            block *= 2
+
+        if binding:
+            # A release bound binds, fixed sub-steps instead
+            self.adaptive_block = step_count
+            return self.integration(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+                fixed_steps=True,
+            )
+
+        in_month_releases[:step_count] = policy_release_decision
+
+        self.inflow_vector[t] = net_secondly_inflow
+        self.storage_vector[t + 1] = current_storage
+
+        self.release_vector[t] = np.mean(in_month_releases[:step_count])
+
+        self.total_evap[t] = monthly_evap_total
+        self.substep_vector[t] = substeps
+        self.adaptive_block = block
+
+        self.level_vector[t] = self.storage_lookup(current_storage)[0]
+
+    def integration_adaptive_batch(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+    ):
+        """Batched version of integration_adaptive. Every lane chooses its
+        own blocks, and only the lanes in which a release bound binds are
+        integrated with the fixed sub-steps, so each lane reproduces the
+        scalar result whatever the other lanes of the batch.
+        """
+
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
+        step_count = self.substep_count(nu_of_days, integration_interval)
+        evaporation_share = self.evap_rates[current_month - 1] / (
+            100 * (total_seconds / integ_step)
+        )
+        tolerance = (
+            self.integration_tolerance
+            * (self.lookup_end - self.lookup_start)
+            / step_count
+        )
+
+        current_storage = self.storage_vector[:, t].copy()
+        lane_count = current_storage.size
+
+        if self.filling_schedule is not None:
+            releasable_excess = np.maximum(
+                0, net_secondly_inflow - self.filling_schedule[current_month - 1]
+            )
+        else:
+            releasable_excess = 1e12  # Big M
+
+        total_addition = net_secondly_inflow * integ_step
+        breaks = self.lookup_breaks
+
+        def substep_rates(storage):
+            _, surface, min_possible_release, max_possible_release = (
+                self.storage_lookup_vector(storage)
+            )
+            binding = (policy_release_decision < min_possible_release) | (
+                policy_release_decision
+                > np.minimum(max_possible_release, releasable_excess)
+            )
+            return surface * evaporation_share, binding
+
+        monthly_evap_total = np.zeros(lane_count)
+        substeps = np.zeros(lane_count, dtype=int)
+        step = np.zeros(lane_count, dtype=int)
+        if t == 0:
+            block = np.full(lane_count, step_count)
+        else:
+            block = np.broadcast_to(self.adaptive_block, lane_count).copy()
+        evaporation, binding = substep_rates(current_storage)
+        change = total_addition - policy_release_decision * integ_step
+
+        # Lanes still merging blocks, as in the loop of integration_adaptive
+        active = (step < step_count) & ~binding
+        while np.any(active):
+            block = np.where(
+                active, np.maximum(1, np.minimum(block, step_count - step)), block
+            )
+            half = block // 2
+
+            mid_storage = current_storage + half * (change - evaporation)
+            mid_evaporation, mid_binding = substep_rates(mid_storage)
+            end_storage = mid_storage + (block - half) * (change - mid_evaporation)
+            end_evaporation, end_binding = substep_rates(end_storage)
+
+            crossing = (half > 0) & (
+                np.searchsorted(breaks, end_storage, side="right")
+                != np.searchsorted(breaks, current_storage, side="right")
+            )
+            binding = binding | (active & ~crossing & (mid_binding | end_binding))
+
+            error = np.abs(
+                end_storage - (current_storage + block * (change - evaporation))
+            )
+            halved = active & ~binding & (
+                crossing | ((half > 0) & (error > tolerance * block))
+            )
+            accepted = active & ~binding & ~halved
+
+            monthly_evap_total = np.where(
+                accepted,
+                monthly_evap_total
+                + (half * evaporation + (block - half) * mid_evaporation),
+                monthly_evap_total,
+            )
+            current_storage = np.where(accepted, end_storage, current_storage)
+            evaporation = np.where(accepted, end_evaporation, evaporation)
+            step = np.where(accepted, step + block, step)
+            substeps = np.where(accepted, substeps + np.where(half > 0, 2, 1), substeps)
+            block = np.where(accepted, block * 2, np.where(halved, half, block))
+
+            active = (step < step_count) & ~binding
+
+        # A release bound binds in these lanes, fixed sub-steps instead
+        self.adaptive_block = np.where(binding, step_count, block)
+        self.record_smooth_lanes(
+            t,
+            nu_of_days,
+            policy_release_decision,
+            net_secondly_inflow,
+            current_month,
+            integration_interval,
+            ~binding,
+            current_storage,
+            monthly_evap_total,
+            substeps,
+        )
+
+    def integration_analytic(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+    ):
+        """Integration in closed form for months in which the release is
+        the policy decision throughout. Between two breakpoints of the
+        lookup tables the surface is linear in storage, so the sub-steps
+        of integration form a linear recurrence (the evaporation of a
+        sub-step being linear in its storage) whose k-th term is known.
+        The storage is advanced region by region to the sub-step at which
+        it leaves the region or the month ends, which gives the storage,
+        release and evaporation of the sub-steps up to rounding. The
+        rounding differs from that of the sub-steps, so the results are
+        not bit-identical to integration.
+
+        The release bounds are linear within a region as well, so they
+        bind somewhere in it only if they bind at its first or last
+        sub-step. The month is then integrated with the fixed sub-steps
+        of integration instead. The number of closed-form pieces is
+        written to the substep vector.
+        """
+
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
+        step_count = self.substep_count(nu_of_days, integration_interval)
+        evaporation_share = self.evap_rates[current_month - 1] / (
+            100 * (total_seconds / integ_step)
+        )
+
+        current_storage = self.storage_vector[t]
+        in_month_releases = self.in_month_releases
+
+        if self.filling_schedule is not None:
+            releasable_excess = max(
+                0, net_secondly_inflow - self.filling_schedule[current_month - 1]
+            )
+        else:
+            releasable_excess = 1e12  # Big M
+
+        change = (
+            net_secondly_inflow * integ_step - policy_release_decision * integ_step
+        )
+        breaks = self._lookup_scalar[0]
+        (gain, offset), (lower, upper) = self._lookup_linear_scalar
+
+        def region_of(storage):
+            if storage <= self.lookup_start:
+                return 0
+            if storage >= self.lookup_end:
+                return len(breaks)
+            return bisect_right(breaks, storage)
+
+        def binding(region, storage):
+            min_possible_release = gain[1][region] * storage + offset[1][region]
+            max_possible_release = min(
+                gain[2][region] * storage + offset[2][region], releasable_excess
+            )
+            return not (
+                min_possible_release
+                <= policy_release_decision
+                <= max_possible_release
+            )
+
+        monthly_evap_total = 0
+        pieces = 0
+        step = 0
+        fixed_steps = False
+
+        while step < step_count:
+            region = region_of(current_storage)
+            rate = evaporation_share * gain[0][region]
+            if rate >= 1:
+                # Sub-steps overshooting the equilibrium are not monotone
+                fixed_steps = True
+                break
+            # Storage after k sub-steps: s + drift * (1 - (1 - rate)^k) / rate,
+            # with the numpy functions of the batched version
+            drift = (
+                change - evaporation_share * offset[0][region] - rate * current_storage
+            )
+            log_decay = np.log1p(-rate)
+
+            def storage_after(k):
+                if rate == 0:
+                    return current_storage + drift * k
+                return current_storage + drift * (-np.expm1(k * log_decay) / rate)
+
+            k = step_count - step
+            end_storage = storage_after(k)
+            if region_of(end_storage) != region:
+                if end_storage > current_storage:
+                    edge = upper[region]
+                else:
+                    edge = lower[region]
+                share = (edge - current_storage) / drift
+                if rate == 0:
+                    estimate = share
+                elif rate * share < 1:
+                    estimate = np.log1p(-rate * share) / log_decay
+                else:
+                    estimate = k
+                k = min(k, max(1, math.ceil(estimate)))
+                while k > 1 and region_of(storage_after(k - 1)) != region:
+                    k -= 1
+                while region_of(storage_after(k)) == region:
+                    k += 1
+                end_storage = storage_after(k)
+
+            if binding(region, current_storage) or binding(
+                region, storage_after(k - 1)
+            ):
+                fixed_steps = True
+                break
+
+            monthly_evap_total += k * change - (end_storage - current_storage)
+            current_storage = end_storage
+            step += k
+            pieces += 1
+
+        if fixed_steps:
+            return self.integration(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+                fixed_steps=True,
+            )
+
+        in_month_releases[:step_count] = policy_release_decision
+
+        self.inflow_vector[t] = net_secondly_inflow
+        self.storage_vector[t + 1] = current_storage
+
+        self.release_vector[t] = np.mean(in_month_releases[:step_count])
+
+        self.total_evap[t] = monthly_evap_total
+        self.substep_vector[t] = pieces
+
+        self.level_vector[t] = self.storage_lookup(current_storage)[0]
+
+    def integration_analytic_batch(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+    ):
+        """Batched version of integration_analytic. Every lane advances
+        through its own regions, and only the lanes in which a release
+        bound binds are integrated with the fixed sub-steps, so each lane
+        reproduces the scalar result whatever the other lanes of the
+        batch.
+        """
+
+        total_seconds, integ_step = self.integration_step(
+            nu_of_days, integration_interval
+        )
+        step_count = self.substep_count(nu_of_days, integration_interval)
+        evaporation_share = self.evap_rates[current_month - 1] / (
+            100 * (total_seconds / integ_step)
+        )
+
+        current_storage = self.storage_vector[:, t].copy()
+        lane_count = current_storage.size
+
+        if self.filling_schedule is not None:
+            releasable_excess = np.maximum(
+                0, net_secondly_inflow - self.filling_schedule[current_month - 1]
+            )
+        else:
+            releasable_excess = 1e12  # Big M
+
+        change = (
+            net_secondly_inflow * integ_step - policy_release_decision * integ_step
+        )
+        breaks = self.lookup_breaks
+        (gain, offset), (lower, upper) = self.lookup_linear
+
+        def region_of(storage):
+            return np.where(
+                storage <= self.lookup_start,
+                0,
+                np.where(
+                    storage >= self.lookup_end,
+                    breaks.size,
+                    np.searchsorted(breaks, storage, side="right"),
+                ),
+            )
+
+        def binding(region, storage):
+            min_possible_release = gain[1, region] * storage + offset[1, region]
+            max_possible_release = np.minimum(
+                gain[2, region] * storage + offset[2, region], releasable_excess
+            )
+            return (policy_release_decision < min_possible_release) | (
+                policy_release_decision > max_possible_release
+            )
+
+        monthly_evap_total = np.zeros(lane_count)
+        pieces = np.zeros(lane_count, dtype=int)
+        step = np.zeros(lane_count, dtype=int)
+        fixed_steps = np.zeros(lane_count, dtype=bool)
+
+        while True:
+            active = (step < step_count) & ~fixed_steps
+            if not np.any(active):
+                break
+            region = region_of(current_storage)
+            rate = evaporation_share * gain[0, region]
+            # Sub-steps overshooting the equilibrium are not monotone
+            fixed_steps = fixed_steps | (active & (rate >= 1))
+            active = active & ~fixed_steps
+
+            # Lanes that are done or fall back keep their storage (k = 0)
+            # and are masked out below
+            with np.errstate(divide="ignore", invalid="ignore"):
+                drift = (
+                    change
+                    - evaporation_share * offset[0, region]
+                    - rate * current_storage
+                )
+                log_decay = np.log1p(-rate)
+                safe_rate = np.where(rate == 0, 1, rate)
+
+                def storage_after(k):
+                    return current_storage + drift * np.where(
+                        rate == 0, k, -np.expm1(k * log_decay) / safe_rate
+                    )
+
+                remaining = np.where(active, step_count - step, 0)
+                k = remaining
+                end_storage = storage_after(k)
+                leaving = active & (region_of(end_storage) != region)
+                if np.any(leaving):
+                    edge = np.where(
+                        end_storage > current_storage, upper[region], lower[region]
+                    )
+                    share = (edge - current_storage) / drift
+                    estimate = np.where(
+                        rate == 0, share, np.log1p(-rate * share) / log_decay
+                    )
+                    estimate = np.where(np.isfinite(estimate), estimate, remaining)
+                    k = np.where(
+                        leaving, np.clip(np.ceil(estimate), 1, remaining), remaining
+                    ).astype(int)
+                    while True:
+                        back = (
+                            leaving
+                            & (k > 1)
+                            & (region_of(storage_after(k - 1)) != region)
+                        )
+                        if not np.any(back):
+                            break
+                        k = k - back
+                    while True:
+                        forward = leaving & (region_of(storage_after(k)) == region)
+                        if not np.any(forward):
+                            break
+                        k = k + forward
+                    end_storage = storage_after(k)
+
+                fixed_steps = fixed_steps | (
+                    active
+                    & (
+                        binding(region, current_storage)
+                        | binding(region, storage_after(np.maximum(k - 1, 0)))
+                    )
+                )
+            active = active & ~fixed_steps
+
+            monthly_evap_total = np.where(
+                active,
+                monthly_evap_total + (k * change - (end_storage - current_storage)),
+                monthly_evap_total,
+            )
+            current_storage = np.where(active, end_storage, current_storage)
+            step = np.where(active, step + k, step)
+            pieces = np.where(active, pieces + 1, pieces)
+
+        self.record_smooth_lanes(
+            t,
+            nu_of_days,
+            policy_release_decision,
+            net_secondly_inflow,
+            current_month,
+            integration_interval,
+            ~fixed_steps,
+            current_storage,
+            monthly_evap_total,
+            pieces,
+        )
+
+    def record_smooth_lanes(
+        self,
+        t,
+        nu_of_days,
+        policy_release_decision,
+        net_secondly_inflow,
+        current_month,
+        integration_interval,
+        smooth,
+        current_storage,
+        monthly_evap_total,
+        substeps,
+    ):
+        """Writes month t of the batched adaptive and analytic integrations.
+        The lanes that are not smooth, i.e. in which a release bound binds,
+        are integrated with the fixed sub-steps of integration_batch, the
+        smooth lanes get their release decision throughout the month and
+        the given storage, evaporation and number of sub-steps.
+        """
+
+        if not np.all(smooth):
+            # Integrates all lanes, the smooth ones are overwritten below
+            self.integration_batch(
+                t,
+                nu_of_days,
+                policy_release_decision,
+                net_secondly_inflow,
+                current_month,
+                integration_interval,
+                fixed_steps=True,
+            )
+            if not np.any(smooth):
+                return
+
+        step_count = self.substep_count(nu_of_days, integration_interval)
+        lane_count = smooth.size
+        decisions = np.broadcast_to(policy_release_decision, lane_count)[smooth]
+
+        self.in_month_releases[smooth, :step_count] = np.reshape(decisions, (-1, 1))
+
+        self.inflow_vector[smooth, t] = np.broadcast_to(
+            net_secondly_inflow, lane_count
+        )[smooth]
+        self.storage_vector[smooth, t + 1] = current_storage[smooth]
+
+        self.release_vector[smooth, t] = np.mean(
+            self.in_month_releases[smooth, :step_count], axis=1
+        )
+
+        self.total_evap[smooth, t] = monthly_evap_total[smooth]
+        self.substep_vector[smooth, t] = substeps[smooth]
+
+        self.level_vector[smooth, t] = self.storage_lookup_vector(
+            current_storage[smooth]
+        )[0]
+
+    def calculate_hydropower(self, nu_of_days):
+        """Calculates the hydropower production of all plants of the
+        reservoir, the target production and the deficit for every
+        simulated month in one pass from the recorded releases and levels.
+
+        Parameters
+        ----------
+        nu_of_days : np.array
+            Number of days of every simulated month
+        """
+        hydropower_production = np.zeros_like(self.release_vector)
+        hydropower_target_production = np.zeros_like(self.release_vector)
+        for plant in self.hydropower_plants:
+            production, target_production = plant.calculate_hydropower_production(
+                self.release_vector, self.level_vector, nu_of_days
+            )
+            hydropower_production = hydropower_production + production
+            hydropower_target_production = (
+                hydropower_target_production + target_production
+            )
+
+        self.actual_hydropower_production = hydropower_production
+        self.deficit = np.maximum(
+            0, hydropower_target_production - hydropower_production
         )
+        self.target = hydropower_target_production
@@ -0,0 +1,644 @@
+"""
+Base class of the Nile models. It creates the reservoirs, catchments,
+irrigation districts and policy from the settings file and holds the
+simulation of the network, which ModelNile and ModelNileScenario share
+together with their settings of fidelity, integration, recording and
+early termination.
+"""
+
+# Importing libraries for functionality
+import time
+
+import numpy as np
+import pandas as pd
+
+# Importing classes to generate the model
+from model.model_classes import Reservoir, Catchment, IrrigationDistrict, HydropowerPlant
+from model.smash import Policy
+from model.early_termination import reset_truncation, terminate_early
+from model.evaluation_cache import EvaluationCache
+
+
+class ModelNileBase:
+    """
+    Static components and simulation of the Nile models. Subclasses add
+    the input data and the calculation of their outcomes.
+    """
+
+    recording_modes = ["objectives", "trace"]
+
+    # Vectors that are recorded in every mode as the accounting of
+    # hydropower and deficits after the time loop is based on them
+    accounting_variables = ["received_flow", "release_vector", "level_vector"]
+
+    def __init__(self):
+        """
+        Creating the static objects of the model including the
+        reservoirs, catchments, irrigation districts and policy
+        objects along with their parameters. Also, reading both the
+        model run configuration from settings, input data
+        as well as policy function hyper-parameters.
+        """
+
+        self.read_settings_file("settings/settings_file_Nile.xlsx")
+
+        # Generating catchment and irrigation district objects
+        self.catchments = dict()
+        for name in self.catchment_names:
+            new_catchment = Catchment(name)
+            self.catchments[name] = new_catchment
+
+        self.irr_districts = dict()
+        for name in self.irr_district_names:
+            new_irr_district = IrrigationDistrict(name)
+            self.irr_districts[name] = new_irr_district
+
+        # Generating reservoirs of the model. This includes also the generation
+        # of hydropower plants when it exists in a reservoir
+        self.reservoirs = dict()
+        for name in self.reservoir_names:
+            new_reservoir = Reservoir(name)
+
+            new_plant = HydropowerPlant(new_reservoir)
+            new_reservoir.hydropower_plants.append(new_plant)
+
+            # Set initial storage values (based on excel settings)
+            initial_storage = float(
+                self.reservoir_parameters.loc[name, "Initial Storage(m3)"]
+            )
+            new_reservoir.initial_storage = initial_storage
+
+            # Set hydropower production parameters (based on excel settings)
+            variable_names_raw = self.reservoir_parameters.columns[-4:].values.tolist()
+
+            for i, plant in enumerate(new_reservoir.hydropower_plants):
+                for variable in variable_names_raw:
+                    setattr(
+                        plant,
+                        variable.replace(" ", "_").lower(),
+                        eval(self.reservoir_parameters.loc[name, variable])[i],
+                    )
+
+            self.reservoirs[name] = new_reservoir
+
+        # Delete dataframe from memory after initialization
+        del self.reservoir_parameters
+
+        # Adaptive sub-steps or closed-form months of the reservoir
+        # integration if set in the settings file (see
+        # set_integration_tolerance and set_analytic_integration)
+        self.set_integration_tolerance(getattr(self, "integration_tolerance", None))
+        self.set_analytic_integration(getattr(self, "analytic_integration", False))
+
+        # All state vectors are recorded unless set otherwise with
+        # set_recording_mode
+        self.recording_mode = "trace"
+        self.trace_variables = None
+        self.trace_stride = 1
+
+        # State vectors are allocated once for the whole horizon
+        self.allocate_buffers()
+
+        # Simulations run over the whole horizon unless a termination
+        # criterion is set with set_early_termination
+        self.set_early_termination(None)
+        reset_truncation(self)
+
+        # Below the policy object (from the SMASH library) is generated
+        self.overarching_policy = Policy()
+
+        # Parameter values for the policy are inputted on the Excel settings
+        # file. Each policy in the self.policies list is a dictionary with
+        # variable name as the key and value as the value.
+        for policy in self.policies:
+            self.overarching_policy.add_policy_function(**policy)
+
+        # As the policies are initialised, we can get rid of this list of
+        # dictionaries to save memory space
+        del self.policies
+
+        # Optional EvaluationCache consulted by __call__ and the chunked
+        # evaluator before simulating
+        self.evaluation_cache = None
+
+    def exogenous_policy_inputs(self):
+        """Month of the year and total inflow of the previous month for
+        every time step. These policy inputs do not depend on the release
+        decisions, so the policy can precompute their part of the RBFs.
+
+        Returns
+        -------
+        exogenous_inputs : np.array (horizon x 2)
+            With a leading lane axis when the inflows have one
+        """
+
+        moy = (self.init_month + np.arange(self.simulation_horizon) - 1) % 12 + 1
+
+        total_monthly_inflow = sum(
+            [
+                x.inflow[..., : self.simulation_horizon - 1]
+                for x in self.catchments.values()
+            ]
+        )
+        # Initial value for the total inflow
+        initial_inflow = np.full(
+            total_monthly_inflow.shape[:-1] + (1,), float(self.inflowTOT00)
+        )
+        total_monthly_inflow = np.concatenate(
+            [initial_inflow, total_monthly_inflow], axis=-1
+        )
+
+        return np.stack(np.broadcast_arrays(moy, total_monthly_inflow), axis=-1)
+
+    def simulate(self, batched=False):
+        """Mathematical simulation over the specified simulation
+        duration within a main for loop based on the mass-balance
+        equations
+
+        With batched, many lanes (e.g. policies of a population or
+        realisations of the uncertainties) are simulated at once by
+        carrying the states as arrays with one value per lane. The
+        vectors are then expected to be allocated with a batch_size equal
+        to the number of lanes, while catchment inflows and district
+        demands may be vectors shared by all lanes or (lanes x horizon)
+        matrices. Every operation repeats the scalar arithmetic element
+        by element, so each lane gives exactly the result of a scalar
+        run. With an early termination criterion, the simulation stops
+        once the criterion is decided for every lane.
+
+        Parameters
+        ----------
+        batched : bool
+            Whether the lanes of batch-allocated vectors are simulated
+        """
+        reservoirs = self.reservoirs
+        catchments = self.catchments
+        irr_districts = self.irr_districts
+
+        # Month of the year and total inflow are used by the policy function
+        # in addition to the storages. They do not depend on the decisions,
+        # so their part of the policy is computed beforehand
+        release_function = self.overarching_policy.functions["release"]
+        release_function.compile_exogenous_inputs(
+            self.exogenous_policy_inputs(),
+            [len(reservoirs), len(reservoirs) + 1],
+        )
+
+        if batched:
+            minimum, maximum = np.minimum, np.maximum
+            # To handle delay, I need to keep Taminiat leftovers in a list of two
+            Taminiat_leftover = [np.zeros(self.batch_size), np.zeros(self.batch_size)]
+        else:
+            minimum, maximum = min, max
+            Taminiat_leftover = [0.0, 0.0]
+
+        def integrate(name, release_decision, inflow):
+            reservoir = reservoirs[name]
+            integration = (
+                reservoir.integration_batch if batched else reservoir.integration
+            )
+            integration(
+                t, nu_of_days, release_decision, inflow, moy, self.integration_interval
+            )
+
+        reset_truncation(self)
+        start = time.perf_counter()
+
+        for t in np.arange(self.simulation_horizon):
+            moy = (self.init_month + t - 1) % 12 + 1  # Current month
+            nu_of_days = self.nu_of_days_per_month[moy - 1]
+
+            # Month t of the state vectors, and of the inputs, which are
+            # shared by all lanes or have one row per lane
+            if batched:
+                state, data, previous = (slice(None), t), (..., t), (..., t - 1)
+            else:
+                state, data, previous = t, t, t - 1
+
+            # add the inputs for the function approximator (NN, RBF)
+            # black-box policy. Watch out for verification if the below
+            # sequence of reservoirs is the same as previous version
+            storages = np.stack(
+                [reservoir.storage_vector[state] for reservoir in reservoirs.values()],
+                axis=-1,
+            )
+
+            # Policy function is called here! Its outputs have a leading
+            # lane axis when batched
+            uu = release_function.get_output_norm(storages, t).T
+
+            decision_dict = {
+                reservoir.name: uu[index]
+                for index, reservoir in enumerate(reservoirs.values())
+            }
+
+            # Integration of flows to storages
+            integrate("GERD", decision_dict["GERD"], catchments["BlueNile"].inflow[data])
+
+            integrate(
+                "Roseires",
+                decision_dict["Roseires"],
+                catchments["GERDToRoseires"].inflow[data]
+                + reservoirs["GERD"].release_vector[state],
+            )
+
+            USSennar_input = (
+                reservoirs["Roseires"].release_vector[state]
+                + catchments["RoseiresToAbuNaama"].inflow[data]
+            )
+
+            irr_districts["USSennar"].received_flow_raw[state] = USSennar_input
+
+            irr_districts["USSennar"].received_flow[state] = minimum(
+                USSennar_input, irr_districts["USSennar"].demand[data]
+            )
+
+            USSennar_leftover = maximum(
+                0, USSennar_input - irr_districts["USSennar"].received_flow[state]
+            )
+
+            integrate(
+                "Sennar",
+                decision_dict["Sennar"],
+                USSennar_leftover + catchments["SukiToSennar"].inflow[data],
+            )
+
+            Gezira_input = reservoirs["Sennar"].release_vector[state]
+
+            irr_districts["Gezira"].received_flow_raw[state] = Gezira_input
+
+            irr_districts["Gezira"].received_flow[state] = minimum(
+                irr_districts["Gezira"].demand[data], Gezira_input
+            )
+
+            Gezira_leftover = maximum(
+                0, Gezira_input - irr_districts["Gezira"].received_flow[state]
+            )
+
+            DSSennar_input = (
+                Gezira_leftover
+                + catchments["Dinder"].inflow[data]
+                + catchments["Rahad"].inflow[data]
+            )
+
+            irr_districts["DSSennar"].received_flow_raw[state] = DSSennar_input
+
+            irr_districts["DSSennar"].received_flow[state] = minimum(
+                DSSennar_input, irr_districts["USSennar"].demand[data]
+            )
+
+            DSSennar_leftover = maximum(
+                0, DSSennar_input - irr_districts["DSSennar"].received_flow[state]
+            )
+
+            Taminiat_input = DSSennar_leftover + catchments["WhiteNile"].inflow[data]
+
+            irr_districts["Taminiat"].received_flow_raw[state] = Taminiat_input
+
+            irr_districts["Taminiat"].received_flow[state] = minimum(
+                Taminiat_input, irr_districts["Taminiat"].demand[data]
+            )
+
+            Taminiat_leftover.append(
+                maximum(
+                    0, Taminiat_input - irr_districts["Taminiat"].received_flow[state]
+                )
+            )
+            del Taminiat_leftover[0]
+
+            # Delayed reach of water to Hassanab:
+            if t == 0:
+                # Last 5 years from GRDC Dongola data set
+                Hassanab_input = (
+                    np.full(self.batch_size, 934.2) if batched else 934.2
+                )
+            else:
+                Hassanab_input = (
+                    Taminiat_leftover[0] + catchments["Atbara"].inflow[previous]
+                )
+
+            irr_districts["Hassanab"].received_flow_raw[state] = Hassanab_input
+
+            irr_districts["Hassanab"].received_flow[state] = minimum(
+                Hassanab_input, irr_districts["Hassanab"].demand[data]
+            )
+
+            Hassanab_leftover = maximum(
+                0, Hassanab_input - irr_districts["Hassanab"].received_flow[state]
+            )
+
+            integrate("HAD", decision_dict["HAD"], Hassanab_leftover)
+
+            irr_districts["Egypt"].received_flow_raw[state] = reservoirs[
+                "HAD"
+            ].release_vector[state]
+
+            irr_districts["Egypt"].received_flow[state] = minimum(
+                reservoirs["HAD"].release_vector[state],
+                irr_districts["Egypt"].demand[data],
+            )
+
+            if t == (self.GERD_filling_time * 12):
+                reservoirs["GERD"].filling_schedule = None
+
+            # Stops once the outcomes of all lanes are decided, leaving the
+            # accounting of the best case for the remaining months
+            if self.early_termination is not None and terminate_early(
+                self, t + 1, start
+            ):
+                return
+
+        # Hydropower and deficits are accounted for after the time loop
+        self.calculate_accounting()
+
+    def calculate_accounting(self):
+        """Calculates the hydropower production and the irrigation and
+        hydropower deficits and targets of every simulated month after
+        the time loop. None of these feed back into the dynamics, so they
+        are computed in one vectorized pass from the recorded releases,
+        levels and received flows.
+        """
+
+        moy = (self.init_month + np.arange(self.simulation_horizon) - 1) % 12 + 1
+        nu_of_days = np.asarray(self.nu_of_days_per_month)[moy - 1]
+
+        for district in self.irr_districts.values():
+            district.calculate_deficits(self.simulation_horizon)
+
+        for reservoir in self.reservoirs.values():
+            reservoir.calculate_hydropower(nu_of_days)
+
+    def set_GERD_filling_schedule(self, duration):
+        target_storage = 50e9
+        difference = target_storage - self.reservoirs["GERD"].initial_storage
+        secondly_diff = difference / (duration * 365 * 24 * 3600)
+        weights = self.catchments["BlueNile"].inflow[:12]
+        self.reservoirs["GERD"].filling_schedule = (
+            weights * 12 * secondly_diff
+        ) / weights.sum()
+
+    def set_recording_mode(self, mode, variables=None, stride=1):
+        """Selects which monthly vectors are kept during a simulation.
+
+        Parameters
+        ----------
+        mode : str
+            'objectives' keeps only the releases, levels and received
+            flows the objectives are calculated from, the other state
+            vectors then hold the latest month only. 'trace' records the
+            given vectors of every reservoir and irrigation district in
+            addition
+        variables : list
+            Names of the recorded vectors in 'trace' mode (e.g.
+            'level_vector', 'received_flow'). All vectors if None
+        stride : int
+            Interval in months between recorded values in 'trace' mode
+        """
+
+        if mode not in self.recording_modes:
+            raise ValueError(
+                f"Recording mode should be one of {self.recording_modes}, "
+                f"not '{mode}'"
+            )
+
+        if variables is not None:
+            unknown_variables = set(variables) - set(self.trace_variable_names())
+            if unknown_variables:
+                raise ValueError(
+                    f"Unknown trace variables: {sorted(unknown_variables)}"
+                )
+
+        if int(stride) != stride or stride < 1:
+            raise ValueError(f"Trace stride should be a positive integer, not {stride}")
+
+        if mode == "objectives" and (variables is not None or stride != 1):
+            raise ValueError("Variables and stride only apply to 'trace' mode")
+
+        self.recording_mode = mode
+        self.trace_variables = None if variables is None else list(variables)
+        self.trace_stride = int(stride)
+        self.allocate_buffers(self.batch_size)
+
+    def set_fidelity(self, integration_interval=None, simulation_horizon=None):
+        """Sets the integration interval of the reservoirs and the number of
+        simulated months, e.g. a coarse interval or a truncated horizon
+        for cheap screening evaluations. None keeps the current value.
+
+        Parameters
+        ----------
+        integration_interval : str, optional
+            Sub-step of the reservoir integration, from 'once-a-month' to
+            'half-an-hour' (see Reservoir.integration_step)
+        simulation_horizon : int, optional
+            Number of simulated months, at most the length of the input
+            data
+        """
+
+        if integration_interval is not None:
+            try:
+                Reservoir.integration_step(30, integration_interval)
+            except KeyError:
+                raise ValueError(
+                    f"Unknown integration interval '{integration_interval}'"
+                ) from None
+            self.integration_interval = integration_interval
+
+        if simulation_horizon is not None:
+            input_length = min(
+                [x.inflow.shape[-1] for x in self.catchments.values()]
+                + [x.demand.shape[-1] for x in self.irr_districts.values()]
+            )
+            if int(simulation_horizon) != simulation_horizon or not (
+                1 <= simulation_horizon <= input_length
+            ):
+                raise ValueError(
+                    f"Simulation horizon should be between 1 and {input_length} "
+                    f"months, not {simulation_horizon}"
+                )
+            self.simulation_horizon = int(simulation_horizon)
+
+        self.allocate_buffers(self.batch_size)
+
+    def get_fidelity(self):
+        """Integration interval and simulation horizon of the simulations"""
+        return self.integration_interval, self.simulation_horizon
+
+    def set_integration_tolerance(self, tolerance):
+        """Switches the reservoirs to the adaptive integration (see
+        Reservoir.integration_adaptive), which merges the sub-steps of
+        integration_interval where the storage changes smoothly. It is an
+        approximation: the storage errors of the merged blocks feed back
+        into the release decisions, so the objectives do not reproduce
+        those of the fixed sub-steps exactly (by up to about 1e-2 at a
+        tolerance of 1e-3, see fidelity.integration_benchmark).
+
+        Parameters
+        ----------
+        tolerance : float
+            Estimated storage error allowed per month, relative to the
+            storage range of each reservoir. None integrates every
+            sub-step
+        """
+
+        if tolerance is not None and not tolerance > 0:
+            raise ValueError(
+                f"Integration tolerance should be positive, not {tolerance}"
+            )
+        self.integration_tolerance = tolerance
+        for reservoir in self.reservoirs.values():
+            reservoir.integration_tolerance = tolerance
+
+    def set_analytic_integration(self, analytic=True):
+        """Switches the reservoirs to the closed-form integration of the
+        months in which no release bound binds (see
+        Reservoir.integration_analytic). It takes precedence over an
+        integration tolerance. The closed form sums the sub-steps in a
+        different order, and the rounding differences feed back into the
+        release decisions, so the objectives do not reproduce those of the
+        fixed sub-steps exactly (by up to about 1e-7, see
+        fidelity.integration_benchmark).
+        """
+
+        self.analytic_integration = bool(analytic)
+        for reservoir in self.reservoirs.values():
+            reservoir.analytic_integration = self.analytic_integration
+
+    def set_evaluation_cache(self, path):
+        """Reads the outcomes of evaluations from the SQLite file at path
+        before simulating them and stores those simulated over the whole
+        horizon (see model.evaluation_cache). The file can be shared by
+        the worker processes and by later runs. No cache if path is None.
+        """
+
+        self.evaluation_cache = None if path is None else EvaluationCache(path)
+
+    def set_early_termination(self, criterion, check_interval=24):
+        """Stops simulations once the outcomes are decided by the criterion
+        whatever the remaining months, e.g. once they cannot enter an
+        epsilon archive or once every outcome is known to be above or
+        below its thresholds (see model.early_termination). A stopped
+        simulation sets truncated, simulated_months and saved_seconds, and
+        its outcomes are the optimistic bounds.
+
+        Parameters
+        ----------
+        criterion : DominanceTermination or ThresholdTermination
+            Criterion deciding from the lower and upper bounds of the
+            outcomes. Simulations run over the whole horizon if None
+        check_interval : int
+            Months between checks of the criterion
+        """
+
+        if int(check_interval) != check_interval or check_interval < 1:
+            raise ValueError(
+                f"Check interval should be a positive integer, not {check_interval}"
+            )
+        self.early_termination = criterion
+        self.termination_interval = int(check_interval)
+
+    @staticmethod
+    def trace_variable_names():
+        """Names of the monthly vectors that can be recorded"""
+
+        names = ["storage_vector"] + Reservoir.buffer_names
+        names += IrrigationDistrict.buffer_names
+        names += ["actual_hydropower_production", "deficit", "target"]
+        return names
+
+    def allocate_buffers(self, batch_size=None):
+        """(Re)allocates the state vectors of the reservoirs and irrigation
+        districts for the simulation horizon. With a batch_size, the
+        vectors get a leading axis with one row per lane of a batched
+        simulation. Vectors that are not recorded in the current
+        recording mode hold the latest month only.
+        """
+
+        if self.recording_mode == "objectives":
+            recorded = set(self.accounting_variables)
+        elif self.trace_variables is None:
+            recorded = None
+        else:
+            recorded = set(self.trace_variables + self.accounting_variables)
+
+        for reservoir in self.reservoirs.values():
+            reservoir.allocate_buffers(
+                self.simulation_horizon,
+                self.integration_interval,
+                batch_size,
+                recorded,
+            )
+
+        for irr_district in self.irr_districts.values():
+            irr_district.allocate_buffers(self.simulation_horizon, batch_size, recorded)
+
+        self.batch_size = batch_size
+
+    def thin_traces(self):
+        """Keeps every trace_stride-th month of the recorded vectors after
+        a simulation in 'trace' mode. The vectors are allocated again
+        before the next simulation.
+        """
+
+        if self.recording_mode != "trace" or self.trace_stride == 1:
+            return
+
+        variables = self.trace_variables
+        if variables is None:
+            variables = self.trace_variable_names()
+
+        elements = list(self.reservoirs.values()) + list(self.irr_districts.values())
+        for element in elements:
+            for var in variables:
+                if hasattr(element, var):
+                    vector = getattr(element, var)[..., :: self.trace_stride]
+                    setattr(element, var, vector.copy())
+
+    def reset_parameters(self):
+        """Zero-fills the preallocated state vectors in place. Only the
+        initial value is left in the storages.
+        """
+
+        for reservoir in self.reservoirs.values():
+            reservoir.reset_buffers()
+
+        for irr_district in self.irr_districts.values():
+            irr_district.reset_buffers()
+
+    def read_settings_file(self, filepath):
+
+        model_parameters = pd.read_excel(filepath, sheet_name="ModelParameters")
+        for _, row in model_parameters.iterrows():
+            name = row["in Python"]
+            if row["Data Type"] == "str":
+                value = row["Value"]
+            else:
+                value = eval(str(row["Value"]))
+            if row["Data Type"] == "np.array":
+                value = np.array(value)
+            setattr(self, name, value)
+
+        self.reservoir_parameters = pd.read_excel(filepath, sheet_name="Reservoirs")
+
+        self.reservoir_parameters.set_index("Reservoir Name", inplace=True)
+
+        self.policies = list()
+        full_df = pd.read_excel(filepath, sheet_name="PolicyParameters")
+        splitpoints = list(full_df.loc[full_df["Parameter Name"] == "Name"].index)
+        for i in range(len(splitpoints)):
+            try:
+                one_policy = full_df.iloc[splitpoints[i] : splitpoints[i + 1], :]
+            except IndexError:
+                one_policy = full_df.iloc[splitpoints[i] :, :]
+            input_dict = dict()
+
+            for _, row in one_policy.iterrows():
+                key = row["in Python"]
+                if row["Data Type"] != "str":
+                    value = eval(str(row["Value"]))
+                else:
+                    value = row["Value"]
+                if row["Data Type"] == "np.array":
+                    value = np.array(value)
+                input_dict[key] = value
+
+            self.policies.append(input_dict)
@@ -0,0 +1,169 @@
+"""
+Justice principles aggregating the six objectives of the Nile model into
+one principle result. The objectives are deficit ratios and frequencies
+(lower is better), while every principle result is to be maximized.
+
+An aggregate is a principle with its options, e.g. ("pwf", {"gamma": 3}).
+Aggregates are computed from the objective values only, so any number of
+them can be derived from one simulation or from stored results.
+
+The pwf results of the stored runs (outputs/nfe50000_pwf_100_demand) are
+stale: they were optimized with the earlier pwf, which reused the utility
+of the previous objective for an objective of exactly 0. Zero objectives
+are common (e.g. the frequency of low HAD levels), so the current pwf
+differs for most policies and new pwf runs are not comparable with the
+stored ones. The earlier pwf is kept as ("pwf", {"gamma": 3, "legacy":
+True}) to reproduce them.
+"""
+
+# Importing libraries for functionality
+import numpy as np
+
+# Aggregates of the principles, by name. The name of an aggregate is what
+# ModelNile accepts as principle and the column in results with all of them
+default_aggregates = {
+    "uwf": ("uwf", {}),
+    "pwf": ("pwf", {"gamma": 3}),
+    "gini": ("gini", {"variant": "standard"}),
+}
+
+gini_variants = ["standard", "corrected", "satisfaction"]
+
+
+def utilitarian(objectives):
+    """Utilitarian welfare: sum of the satisfactions (1 - objective)"""
+    modified_objectives = [1 - obj for obj in objectives]
+    return sum(modified_objectives)
+
+
+def prioritarian(objectives, gamma=3, legacy=False):
+    """Prioritarian welfare: sum of the isoelastic utilities of the
+    satisfactions (1 - objective). A larger gamma gives more priority to
+    the worst-off objectives, gamma = 1 is the logarithmic utility.
+
+    Parameters
+    ----------
+    objectives : list
+        Objective values
+    gamma : float
+        Inequality aversion
+    legacy : bool
+        Whether an objective of exactly 0 gets the utility of the previous
+        objective, as in the stored pwf runs, instead of 1 / (1 - gamma)
+    """
+
+    if gamma < 0:
+        raise ValueError("gamma must not be negative")
+
+    pwf_results = []
+    for obj in objectives:
+        # A negative objective (surplus) counts as much as a deficit of the
+        # same size
+        satisfaction = 1 - obj if obj >= 0 else 1 + abs(obj)
+        if legacy and obj == 0:
+            if not pwf_results:
+                raise ValueError(
+                    "The legacy pwf is undefined for a first objective of 0"
+                )
+            pwf_obj = pwf_results[-1]
+        elif satisfaction == 0:
+            pwf_obj = 0
+        elif gamma == 1:
+            pwf_obj = np.log(satisfaction)
+        else:
+            pwf_obj = (satisfaction ** (1 - gamma)) / (1 - gamma)
+        pwf_results.append(pwf_obj)
+
+    # Calculate the total PWF
+    return sum(pwf_results)
+
+
+def gini(objectives, variant="standard"):
+    """Equality of the objectives as 1 - Gini coefficient, so that all
+    principles have a maximization direction
+
+    Parameters
+    ----------
+    objectives : list
+        Objective values
+    variant : str
+        'standard' is the Gini coefficient of the objectives, 'corrected'
+        scales it by n / (n - 1) so that complete inequality gives 1 and
+        'satisfaction' takes the coefficient of the satisfactions
+        (1 - objective) instead of the deficits
+    """
+
+    if variant not in gini_variants:
+        raise ValueError(
+            f"Invalid gini variant {variant}, choose one of {gini_variants}"
+        )
+
+    values = np.asarray(objectives, dtype=float)
+    if variant == "satisfaction":
+        values = 1 - values
+
+    n = len(values)
+    sorted_objectives = np.sort(values)
+    diffs = np.abs(np.subtract.outer(sorted_objectives, sorted_objectives)).flatten()
+    coefficient = np.sum(diffs) / (2.0 * n * np.sum(sorted_objectives))
+    if variant == "corrected":
+        coefficient *= n / (n - 1)
+
+    return 1 - coefficient
+
+
+principle_functions = {
+    "uwf": utilitarian,
+    "pwf": prioritarian,
+    "gini": gini,
+}
+
+# Principles whose result never increases with an objective (of zero or
+# more), so that bounds of the objectives bound the result as well. The
+# legacy pwf is not, as an objective of 0 takes the utility of another
+monotone_principles = ["uwf", "pwf"]
+
+
+def aggregate(objectives, principle, options=None):
+    """Principle result of the objectives
+
+    Parameters
+    ----------
+    objectives : list
+        Objective values
+    principle : str
+        'uwf', 'pwf' or 'gini'
+    options : dict, optional
+        Options of the principle, e.g. {"gamma": 2} for 'pwf'
+    """
+
+    if principle not in principle_functions:
+        raise ValueError("Invalid principle. Please choose a valid principle.")
+
+    return principle_functions[principle](objectives, **(options or {}))
+
+
+def aggregate_all(objectives, aggregates=None):
+    """Result of every aggregate of the objectives
+
+    Parameters
+    ----------
+    objectives : list
+        Objective values
+    aggregates : dict, optional
+        (principle, options) of each aggregate by name, default_aggregates
+        if None
+
+    Returns
+    -------
+    principle_results : dict
+        Result of each aggregate, by name
+    """
+
+    if aggregates is None:
+        aggregates = default_aggregates
+
+    return {
+        name: aggregate(objectives, principle, options)
+        for name, (principle, options) in aggregates.items()
+    }
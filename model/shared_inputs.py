@@ -0,0 +1,152 @@
+"""
+Read-only input arrays of the model (catchment inflows, irrigation demands
+and reservoir relations and lookup tables) placed in one shared memory
+segment. The segment is created once by the parent process. Components
+pickle the arrays in it as references, so worker processes receiving a
+pickled model attach to the segment instead of holding their own copies.
+"""
+
+# Importing libraries for functionality
+import atexit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Segments created or attached by this process, by name. The shared arrays
+# refer to the memory of these segments, so they are kept open for the
+# lifetime of the process
+segments = dict()
+
+# Start of every array in the segment is aligned to this number of bytes
+alignment = 64
+
+
+def attach_segment(name):
+    """Attaches to a shared memory segment once per process"""
+    if name not in segments:
+        segments[name] = shared_memory.SharedMemory(name=name)
+
+    return segments[name]
+
+
+def shared_view(reference):
+    """Read-only array in a shared memory segment
+
+    Parameters
+    ----------
+    reference : tuple
+        Segment name, byte offset, shape and dtype string of the array
+    """
+    name, offset, shape, dtype = reference
+    view = np.ndarray(
+        shape, dtype=dtype, buffer=attach_segment(name).buf, offset=offset
+    )
+    view.flags.writeable = False
+
+    return view
+
+
+def share_input_data(nile_model):
+    """Copies the input arrays of all catchments, irrigation districts and
+    reservoirs of the model into a new shared memory segment and replaces
+    them with read-only views of it. Inputs assigned to a component later
+    on (e.g. by generate_input_data) are pickled as ordinary arrays.
+
+    Parameters
+    ----------
+    nile_model : ModelNile or ModelNileScenario object
+
+    Returns
+    -------
+    name : str
+        Name of the created segment
+    """
+
+    components = (
+        list(nile_model.catchments.values())
+        + list(nile_model.irr_districts.values())
+        + list(nile_model.reservoirs.values())
+    )
+
+    layout = list()
+    size = 0
+    for component in components:
+        for attr in component.input_names:
+            array = getattr(component, attr)
+            if not isinstance(array, np.ndarray):
+                continue
+            layout.append((component, attr, size))
+            size += -(-array.nbytes // alignment) * alignment
+
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    segments[segment.name] = segment
+    atexit.register(release_segment, segment.name)
+
+    for component, attr, offset in layout:
+        array = np.ascontiguousarray(getattr(component, attr))
+        reference = (segment.name, offset, array.shape, array.dtype.str)
+        np.ndarray(
+            array.shape, dtype=array.dtype, buffer=segment.buf, offset=offset
+        )[...] = array
+
+        view = shared_view(reference)
+        setattr(component, attr, view)
+        component.shared_arrays[attr] = (reference, view)
+
+    return segment.name
+
+
+def release_segment(name):
+    """Removes a segment created by this process. Processes still
+    attached keep their mapping until they exit.
+    """
+    segment = segments.pop(name, None)
+    if segment is None:
+        return
+    segment.unlink()
+    try:
+        segment.close()
+    except BufferError:
+        # Arrays of this process still refer to the segment, its memory
+        # is released when the process exits
+        pass
+
+
+class SharedArrayState:
+    """
+    Pickling of model components with input arrays in shared memory. Each
+    array that is still the shared view assigned by share_input_data is
+    pickled as a reference to the segment and reattached on unpickling.
+
+    Attributes
+    ----------
+    input_names : list
+        Names of the read-only input arrays of the component
+    shared_arrays : dict
+        Reference and view of the shared input arrays, by name
+    """
+
+    input_names = list()
+
+    @property
+    def shared_arrays(self):
+        return self.__dict__.setdefault("_shared_arrays", dict())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        references = dict()
+        for attr, (reference, view) in state.pop("_shared_arrays", {}).items():
+            if state.get(attr) is view:
+                state[attr] = None
+                references[attr] = reference
+        state["_shared_array_references"] = references
+
+        return state
+
+    def __setstate__(self, state):
+        references = state.pop("_shared_array_references", {})
+        self.__dict__.update(state)
+        for attr, reference in references.items():
+            view = shared_view(reference)
+            setattr(self, attr, view)
+            self.shared_arrays[attr] = (reference, view)
@@ -40,10 +40,14 @@ class Policy:
         self.approximator_names.append(name)
 
     def assign_free_parameters(self, full_array):
+        """Distributes the parameter vector over the policy functions.
+        A (policies x parameters) matrix assigns one parameter set per
+        row to functions that support batched parameters (ncRBF).
+        """
         beginning = 0
         for name in self.approximator_names:
             end = beginning + self.functions[name].get_free_parameter_number()
-            self.functions[name].set_parameters(full_array[beginning:end])
+            self.functions[name].set_parameters(full_array[..., beginning:end])
             beginning = end
 
     def get_total_parameter_count(self):
@@ -88,7 +92,8 @@ class abstract_approximator:  # formerly abstract_approximator
         Parameters
         ----------
         X : np.array
-            The array/vector to be normalized
+            The array/vector to be normalized, or a matrix with one
+            vector per row
         m : np.array
             The array/vector that gives the minimum values
         M : np.array
@@ -100,10 +105,8 @@ class abstract_approximator:  # formerly abstract_approximator
             Normalized vector output
         """
 
-        Y = np.empty(0)
-        for i in range(X.size):
-            z = (X[i] - m[i]) / (M[i] - m[i])
-            Y = np.append(Y, z)
+        n = X.shape[-1]
+        Y = (X - m[:n]) / (M[:n] - m[:n])
 
         return Y
 
@@ -115,7 +118,8 @@ class abstract_approximator:  # formerly abstract_approximator
         Parameters
         ----------
         X : np.array
-            The array/vector to be denormalized
+            The array/vector to be denormalized, or a matrix with one
+            vector per row
         m : np.array
             The array/vector that gives the minimum values
         M : np.array
@@ -127,10 +131,8 @@ class abstract_approximator:  # formerly abstract_approximator
             deNormalized vector output
         """
 
-        Y = np.empty(0)
-        for i in range(X.size):
-            z = X[i] * (M[i] - m[i]) + m[i]
-            Y = np.append(Y, z)
+        n = X.shape[-1]
+        Y = X * (M[:n] - m[:n]) + m[:n]
 
         return Y
 
@@ -142,7 +144,8 @@ class abstract_approximator:  # formerly abstract_approximator
         Parameters
         ----------
         X : np.array
-            The array/vector to be standardized
+            The array/vector to be standardized, or a matrix with one
+            vector per row
         m : np.array
             The array/vector that gives the minimum values
         s : np.array
@@ -154,10 +157,8 @@ class abstract_approximator:  # formerly abstract_approximator
             Standardized vector output
         """
 
-        Y = np.empty(0)
-        for i in range(X.size):
-            z = (X[i] - m[i]) / (s[i])
-            Y = np.append(Y, z)
+        n = X.shape[-1]
+        Y = (X - m[:n]) / s[:n]
 
         return Y
 
@@ -169,7 +170,8 @@ class abstract_approximator:  # formerly abstract_approximator
         Parameters
         ----------
         X : np.array
-            The array/vector to be destandardized
+            The array/vector to be destandardized, or a matrix with one
+            vector per row
         m : np.array
             The array/vector that gives the minimum values
         s : np.array
@@ -180,91 +182,155 @@ class abstract_approximator:  # formerly abstract_approximator
         Y : np.array
             deStandardized vector output
         """
-        Y = np.empty(0)
-        for i in range(X.size):
-            z = X[i] * s[i] + m[i]
-            Y = np.append(Y, z)
+        n = X.shape[-1]
+        Y = X * s[:n] + m[:n]
 
         return Y
 
 
-class RBFparams:
-    def __init__(self):
-        self.c = np.empty(0)
-        self.b = np.empty(0)
-        self.w = np.empty(0)
-
-
 class ncRBF(abstract_approximator):
+    """Non-linear combination of Gaussian radial basis functions. The
+    parameters are kept as arrays: lin_param (n_outputs), centers and
+    radii (RBF_count x n_inputs) and weights (RBF_count x n_outputs).
+    When set from a (policies x parameters) matrix, every array gets a
+    leading policy axis and get_output expects one input row per policy.
+
+    Inputs that do not depend on the policy decisions can be compiled for
+    the whole horizon with compile_exogenous_inputs. get_output_norm then
+    only receives the remaining inputs together with the time step.
+    """
+
     def __init__(self, n_inputs, n_outputs, argument_dictionary):
         # function input/output normalization
         abstract_approximator.__init__(self, argument_dictionary)
         self.n_inputs = n_inputs
         self.n_outputs = n_outputs
         self.RBF_count = argument_dictionary["n_structures"]
-        self.lin_param = np.empty(0)
-        self.param = list()
+        self.clear_parameters()
 
     def set_parameters(self, pTheta):
 
         self.clear_parameters()
 
-        count = 0
-        self.lin_param = pTheta[: self.n_outputs]
-        count += self.n_outputs
-
-        for i in range(self.RBF_count):
-            cParam = RBFparams()
-            for j in range(self.n_inputs):
-                cParam.c = np.append(cParam.c, pTheta[count])
-                cParam.b = np.append(cParam.b, pTheta[count + 1])
-
-                count = count + 2
+        pTheta = np.asarray(pTheta, dtype=float)
+        self.lin_param = pTheta[..., : self.n_outputs]
 
-            for k in range(self.n_outputs):
-                cParam.w = np.append(cParam.w, pTheta[count])
+        # Per RBF, the parameters are ordered as (center, radius) pairs for
+        # every input followed by the weights of every output
+        RBF_param = pTheta[..., self.n_outputs :].reshape(
+            pTheta.shape[:-1] + (self.RBF_count, 2 * self.n_inputs + self.n_outputs)
+        )
+        self.centers = RBF_param[..., : 2 * self.n_inputs : 2]
+        self.radii = RBF_param[..., 1 : 2 * self.n_inputs : 2]
+        self.weights = RBF_param[..., 2 * self.n_inputs :]
 
-                count += 1
-            self.param.append(cParam)
+        den = self.radii**2
+        self.squared_radii = np.maximum(den, pow(10, -6))
 
     def clear_parameters(self):
 
-        self.param = list()
         self.lin_param = np.empty(0)
+        self.centers = np.empty((self.RBF_count, 0))
+        self.radii = np.empty((self.RBF_count, 0))
+        self.weights = np.empty((self.RBF_count, 0))
+        self.squared_radii = np.empty((self.RBF_count, 0))
+        self.clear_exogenous_inputs()
 
-    def get_output(self, input):
+    def compile_exogenous_inputs(self, exogenous_inputs, exogenous_indices):
+        """Precomputes the RBF exponent terms of the inputs that do not
+        depend on the policy decisions (e.g. month of the year) for every
+        time step. Has to be called again after set_parameters.
 
-        # RBF
-        phi = np.empty(0)
-        for j in range(self.RBF_count):
-            bf = 0
-            for i in range(self.n_inputs):
-
-                num = (input[i] - self.param[j].c[i]) ** 2
-                den = self.param[j].b[i] ** 2
+        Parameters
+        ----------
+        exogenous_inputs : np.array (horizon x len(exogenous_indices))
+            Values of the exogenous inputs per time step. A leading lane
+            axis gives one series per lane of a batched simulation
+        exogenous_indices : list
+            Positions of the exogenous inputs in the full input vector
+        """
 
-                if den < pow(10, -6):
-                    den = pow(10, -6)
+        self.exogenous_indices = list(exogenous_indices)
+        self.endogenous_indices = [
+            i for i in range(self.n_inputs) if i not in self.exogenous_indices
+        ]
+        self.input_sources = [
+            ("exogenous", self.exogenous_indices.index(i))
+            if i in self.exogenous_indices
+            else ("endogenous", self.endogenous_indices.index(i))
+            for i in range(self.n_inputs)
+        ]
+
+        x = self.normalize_vector(
+            exogenous_inputs,
+            self.input_min[self.exogenous_indices],
+            self.input_max[self.exogenous_indices],
+        )
+        centers = self.centers[..., np.newaxis, :, self.exogenous_indices]
+        squared_radii = self.squared_radii[..., np.newaxis, :, self.exogenous_indices]
+        terms = (x[..., np.newaxis, :] - centers) ** 2 / squared_radii
+
+        # Time is moved to the first axis so that a step can be indexed
+        # regardless of the lane axes
+        self.exogenous_terms = np.moveaxis(terms, -3, 0)
+
+    def clear_exogenous_inputs(self):
+
+        self.exogenous_indices = list()
+        self.endogenous_indices = list(range(self.n_inputs))
+        self.input_sources = list()
+        self.exogenous_terms = None
+
+    def get_output_norm(self, pInput, t=None):
+        """Denormalized policy output for normalized inputs. With a time
+        step t, pInput holds only the endogenous inputs and the compiled
+        exogenous terms of step t are used for the rest.
+        """
 
-                bf = bf + num / den
+        if t is None:
+            return abstract_approximator.get_output_norm(self, pInput)
 
-            phi = np.append(phi, np.exp(-bf))
+        x = self.normalize_vector(
+            pInput,
+            self.input_min[self.endogenous_indices],
+            self.input_max[self.endogenous_indices],
+        )
+        z = self.get_output(x, t)
+        y = self.denormalize_vector(z, self.output_min, self.output_max)
 
-        # output
-        y = np.empty(0)
+        return y
 
-        for k in range(self.n_outputs):
-            o = self.lin_param[k]
-            for i in range(self.RBF_count):
+    def get_output(self, input, t=None):
 
-                o = o + self.param[i].w[k] * phi[i]
+        # RBF
+        if t is None:
+            centers = self.centers
+            squared_radii = self.squared_radii
+            input_sources = [("endogenous", i) for i in range(self.n_inputs)]
+        else:
+            centers = self.centers[..., self.endogenous_indices]
+            squared_radii = self.squared_radii[..., self.endogenous_indices]
+            input_sources = self.input_sources
+
+        num = (input[..., np.newaxis, :] - centers) ** 2
+        terms = {
+            "endogenous": num / squared_radii,
+            "exogenous": None if t is None else self.exogenous_terms[t],
+        }
+
+        # Terms are summed one input at a time to keep the summation order
+        bf = 0
+        for source, column in input_sources:
+            bf = bf + terms[source][..., column]
+
+        phi = np.exp(-bf)
 
-            if o > 1:
-                o = 1.0
-            if o < 0:
-                o = 0.0
+        # output
+        o = self.lin_param
+        for i in range(self.RBF_count):
+            o = o + self.weights[..., i, :] * phi[..., i, np.newaxis]
 
-            y = np.append(y, o)
+        y = np.clip(o, 0.0, 1.0)
 
         return y
 
@@ -8,6 +8,7 @@ This script performs convergence metrics calculations for hypervolume, epsilon p
 - **`get_principle(s)`**: Extracts the principle name from the experiment string.
 - **`create_em_model(principle)`**: Creates an EMA Workbench model instance based on the specified principle.
 - **`run()`**: Performs convergence metrics calculations for different experiments containing different seeds.
+- **`compare()`**: Compares the hypervolume over the NFE of experiments of one principle, e.g. with and without the surrogate pre-screening.
 
 ### Usage:
 
@@ -180,4 +181,53 @@ def run(description:str, experiments:list, n_seeds:int):
         # Save the figure as a PNG file
         fig.savefig(f"{subfolderpath}/convergence_plot_{description}.png")     
 
-        plt.close(fig)
\ No newline at end of file
+        plt.close(fig)
+
+
+def compare(description:str, experiments:list, n_seeds:int, labels:list=None):
+    """
+    Compare the hypervolume over the NFE of experiments with the same principle, e.g. a
+    steady state optimization with and without the surrogate pre-screening. The
+    hypervolume of every seed is computed against the union of the merged results of all
+    experiments, so that the experiments are measured against the same reference set.
+    Writes the hypervolumes to "outputs/hypervolume_{description}.csv" and plots them.
+    """
+    if labels is None:
+        labels = experiments
+    principles = {get_principle(experiment) for experiment in experiments}
+    if len(principles) > 1:
+        raise ValueError("Compared experiments must have the same principle")
+    em_model = create_em_model(principles.pop())
+    problem = to_problem(em_model, searchover="levers")
+
+    reference_set = pd.concat(
+        [
+            pd.read_csv(f"outputs/{experiment}/baseline_results_{experiment}.csv", index_col=0)
+            for experiment in experiments
+        ],
+        ignore_index=True,
+    )
+    hv = HypervolumeMetric(reference_set, problem)
+
+    metrics = []
+    for experiment, label in zip(experiments, labels):
+        for seed in range(n_seeds):
+            archives = ArchiveLogger.load_archives(f"outputs/{experiment}/archive_logs/{seed}.tar.gz")
+            for nfe, archive in tqdm(archives.items(), desc=f"{label} seed {seed}"):
+                metrics.append({
+                    "experiment": label,
+                    "seed": seed,
+                    "nfe": int(nfe),
+                    "hypervolume": hv.calculate(archive.iloc[:, 1:]),
+                })
+    metrics = pd.DataFrame.from_dict(metrics).sort_values(by=["experiment", "seed", "nfe"])
+    metrics.to_csv(f"outputs/hypervolume_{description}.csv")
+
+    fig, ax = plt.subplots(figsize=(8, 4))
+    sns.lineplot(data=metrics, x="nfe", y="hypervolume", hue="experiment", units="seed",
+                 estimator=None, ax=ax)
+    sns.despine(fig)
+    fig.savefig(f"outputs/hypervolume_{description}.png")
+    plt.close(fig)
+
+    return metrics
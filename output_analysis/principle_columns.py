@@ -0,0 +1,123 @@
+"""
+## Recomputing Principle Columns of Stored Results
+
+The principle results are functions of the six objectives only, so they can be
+derived for any results CSV (optimization results, reference sets or archives)
+without simulating the policies again. This makes it possible to compare new
+principles, pwf gamma values or gini variants on existing archives. With
+`--pwf-legacy`, every pwf column gets a `_legacy` twin with the earlier pwf
+the stored pwf runs were optimized with (see model/principles.py).
+
+### Usage:
+
+    python -m output_analysis.principle_columns outputs/nfe50000_uwf_001_demand/baseline_results_nfe50000_uwf_001_demand.csv --pwf-gamma 1 2 3 --gini-variant standard corrected
+
+writes `baseline_results_nfe50000_uwf_001_demand_principles.csv` next to the
+input with one column per aggregate (e.g. `pwf_gamma2`, `gini_corrected`).
+"""
+
+import argparse
+import os
+
+import pandas as pd
+
+from model import principles
+
+objective_names = [
+    "egypt_agg_deficit_ratio",
+    "egypt_90p_deficit_ratio",
+    "egypt_low_had_frequency",
+    "sudan_agg_deficit_ratio",
+    "sudan_90p_deficit_ratio",
+    "ethiopia_agg_deficit_ratio",
+]
+
+
+def build_aggregates(pwf_gammas=(3,), gini_variants=("standard",), uwf=True,
+                     pwf_legacy=False):
+    """
+    Aggregates (see principles.default_aggregates) for a set of pwf gamma values
+    and gini variants, named e.g. "pwf_gamma3" and "gini_standard". With
+    pwf_legacy, the earlier pwf is added for every gamma, e.g. "pwf_gamma3_legacy".
+    """
+    aggregates = dict()
+    if uwf:
+        aggregates["uwf"] = ("uwf", {})
+    for gamma in pwf_gammas:
+        aggregates[f"pwf_gamma{gamma:g}"] = ("pwf", {"gamma": gamma})
+        if pwf_legacy:
+            aggregates[f"pwf_gamma{gamma:g}_legacy"] = ("pwf", {"gamma": gamma, "legacy": True})
+    for variant in gini_variants:
+        aggregates[f"gini_{variant}"] = ("gini", {"variant": variant})
+
+    return aggregates
+
+
+def recompute_principles(results:pd.DataFrame, aggregates:dict=None):
+    """
+    Adds a column with the result of every aggregate to a copy of the results.
+    Columns with the name of an aggregate are replaced, all others (including
+    "principle_result") are kept as they are.
+
+    Parameters:
+    results (pd.DataFrame): Results with the six objective columns.
+    aggregates (dict, optional): (principle, options) of each aggregate by name,
+        principles.default_aggregates if None.
+
+    Returns:
+    results (pd.DataFrame): Results with the principle columns.
+    """
+    missing = [name for name in objective_names if name not in results.columns]
+    if missing:
+        raise ValueError(f"Results lack the objective columns {missing}")
+
+    principle_results = pd.DataFrame(
+        [
+            principles.aggregate_all(list(objectives), aggregates)
+            for objectives in results[objective_names].to_numpy(dtype=float)
+        ],
+        index=results.index,
+    )
+
+    results = results.copy()
+    for name in principle_results.columns:
+        results[name] = principle_results[name]
+
+    return results
+
+
+def recompute_file(path:str, aggregates:dict=None, output_path:str=None):
+    """
+    Recomputes the principle columns of a results CSV (see recompute_principles)
+    and writes them to output_path, by default "<name>_principles.csv" next to the
+    input.
+
+    Returns:
+    output_path (str): File the results were written to.
+    """
+    if output_path is None:
+        root, extension = os.path.splitext(path)
+        output_path = f"{root}_principles{extension}"
+
+    results = pd.read_csv(path, index_col=0)
+    recompute_principles(results, aggregates).to_csv(output_path)
+
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute the principle columns of results CSVs")
+    parser.add_argument("paths", nargs="+", help="results CSV files")
+    parser.add_argument("--pwf-gamma", nargs="*", type=float, default=[3],
+                        help="gamma values of the prioritarian principle")
+    parser.add_argument("--pwf-legacy", action="store_true",
+                        help="also compute the earlier pwf of the stored pwf runs")
+    parser.add_argument("--gini-variant", nargs="*", default=["standard"],
+                        choices=principles.gini_variants,
+                        help="variants of the gini principle")
+    arguments = parser.parse_args()
+
+    aggregates = build_aggregates(arguments.pwf_gamma, arguments.gini_variant,
+                                  pwf_legacy=arguments.pwf_legacy)
+    for path in arguments.paths:
+        print("written:", recompute_file(path, aggregates))